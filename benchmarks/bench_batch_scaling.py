@@ -0,0 +1,41 @@
+"""多进程批量求值随进程数的伸缩性测试
+
+用法: python benchmarks/bench_batch_scaling.py [行数]
+进程数从1翻倍至CPU核数, 输出每秒求值行数及相对单进程的加速比
+"""
+import os
+import sys
+import time
+from formulaparser import Parser
+
+
+def make_columns(rows: int):
+    return dict(a=[i * 0.25 for i in range(rows)], b=[i % 97 for i in range(rows)], c=[i % 13 + 1 for i in range(rows)])
+
+
+def measure(parser: Parser, ast, columns, workers: int, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser.evaluate_batch(ast, columns, workers=workers)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(rows: int = 200000) -> int:
+    parser = Parser()
+    ast = parser.parse('sqrt(a) * sin(b) + max(a, b, c) / c - log(c, 2) + pow(b % 7, 3) - abs(a - b) // c')
+    columns = make_columns(rows)
+    cpus = os.cpu_count() or 1
+    counts = sorted({1 << i for i in range(cpus.bit_length()) if 1 << i <= cpus} | {cpus})
+
+    base = None
+    for workers in counts:
+        seconds = measure(parser, ast, columns, workers)
+        base = base or seconds
+        print(f'{workers:>4} workers  {seconds * 1000:>9.1f} ms  {rows / seconds:>12.0f} rows/s  x{base / seconds:.2f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,44 @@
+"""词法分析器耗时随公式长度的伸缩性测试
+
+用法: python benchmarks/bench_lexer_scaling.py
+公式长度每次翻倍, 若每字符耗时基本不变则分词为线性时间
+"""
+import sys
+import time
+from formulaparser.lexer import Lexer
+from formulaparser.op_manager import OperatorManager
+
+
+def make_formula(terms: int) -> str:
+    return ' + '.join(f'x{i} * 1.5e3 - f(y{i}, "s\\t{i}").attr[{i}:]' for i in range(terms))
+
+
+def measure(op_mgr: OperatorManager, text: str, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        Lexer(op_mgr, text).tokenize()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(max_ratio: float = 2.0) -> int:
+    op_mgr = OperatorManager()
+    rows = []
+    for terms in (500, 1000, 2000, 4000, 8000):
+        text = make_formula(terms)
+        seconds = measure(op_mgr, text)
+        rows.append((len(text), seconds))
+        print(f'{len(text):>10} chars  {seconds * 1000:>9.2f} ms  {seconds / len(text) * 1e9:>8.1f} ns/char')
+
+    first, last = rows[0][1] / rows[0][0], rows[-1][1] / rows[-1][0]
+    ratio = last / first
+    print(f'每字符耗时之比(最长/最短): {ratio:.2f}')
+    if ratio > max_ratio:
+        print(f'分词耗时非线性增长, 超过阈值 {max_ratio}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
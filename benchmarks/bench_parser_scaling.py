@@ -0,0 +1,62 @@
+"""语法分析耗时随公式长度的伸缩性测试
+
+用法: python benchmarks/bench_parser_scaling.py
+分别测试扁平的长公式及深层嵌套的公式, 每次翻倍规模, 若每token耗时基本不变则解析为线性时间
+"""
+import gc
+import sys
+import time
+from formulaparser.lexer import Lexer
+from formulaparser.op_manager import OperatorManager
+from formulaparser.func_manager import FunctionManager
+from formulaparser.parser import _Parser
+
+
+def make_flat(terms: int) -> str:
+    return ' + '.join(f'x{i} * 1.5e3 - f(y{i}, k=-2).attr[{i}:]' for i in range(terms))
+
+
+def make_nested(terms: int) -> str:
+    return 'f(' * terms + 'a' + ', k=[b[1:], (c,)])' * terms
+
+
+def measure(op_mgr: OperatorManager, func_mgr: FunctionManager, text: str, repeat: int = 3) -> float:
+    """返回不含分词的最短解析耗时
+
+    计时期间关闭循环垃圾回收, 其遍历存活对象的开销随语法树规模增长, 与解析算法无关
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        parser = _Parser(op_mgr, func_mgr, text)
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            parser.parse()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+
+def main(max_ratio: float = 2.0) -> int:
+    op_mgr, func_mgr = OperatorManager(), FunctionManager()
+    status = 0
+    for name, make in (('flat', make_flat), ('nested', make_nested)):
+        rows = []
+        for terms in (500, 1000, 2000, 4000, 8000):
+            text = make(terms)
+            n_tokens = len(Lexer(op_mgr, text).tokenize())
+            seconds = measure(op_mgr, func_mgr, text)
+            rows.append((n_tokens, seconds))
+            print(f'{name:>6} {n_tokens:>10} tokens  {seconds * 1000:>9.2f} ms  {seconds / n_tokens * 1e9:>8.1f} ns/token')
+
+        ratio = (rows[-1][1] / rows[-1][0]) / (rows[0][1] / rows[0][0])
+        print(f'{name} 每token耗时之比(最长/最短): {ratio:.2f}')
+        if ratio > max_ratio:
+            print(f'{name} 解析耗时非线性增长, 超过阈值 {max_ratio}')
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""词法分析、语法分析及求值的基准测试集
+
+用法: python benchmarks/run_benchmarks.py [--output 结果.json] [--baseline 基线.json] [--threshold 0.1]
+                                          [--filter 关键字] [--samples 次数] [--min-time 秒] [--latency-ops 次数]
+
+每个用例为 阶段/语料, 阶段为tokenize、parse、evaluate, 语料见CORPORA, 每次操作处理一个公式。
+吞吐量: 重复测量多个样本, 每个样本至少运行min-time秒, 报告每秒操作数(样本的中位数);
+延迟: 轮流对语料中的每个公式单独计时latency-ops次操作, 报告单次操作耗时的百分位;
+另报告tracemalloc统计的峰值内存。
+给定基线时, 每秒操作数下降或峰值内存上升超过阈值的用例视为性能回退, 退出码为1。
+"""
+import argparse
+import gc
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, Callable, Dict, List, NamedTuple
+
+import formulaparser
+from formulaparser import Parser
+from formulaparser.lexer import Lexer
+
+
+class Corpus(NamedTuple):
+    """一组公式及其求值上下文, setup用于注册自定义函数及运算符"""
+    formulas: List[str]
+    context: Dict[str, Any]
+    setup: Callable[[Parser], None] = lambda parser: None
+
+
+def _business() -> Corpus:
+    formulas = [
+        'revenue - cost',
+        '(revenue - cost) / revenue * 100',
+        'max(price * qty - discount, 0) * (1 + tax_rate)',
+        'round(sum([q1, q2, q3, q4]) / 4, 2)',
+        'min(balance, credit_limit) - fee * days / 365',
+        'abs(actual - budget) / budget > 0.05',
+        'price * qty * (1 - discount_rate) + shipping',
+        'max(revenue - cost - tax, 0) / shares',
+    ]
+    context = dict(revenue=1250.0, cost=830.5, price=19.9, qty=12, discount=15, tax_rate=0.08, q1=10, q2=12.5,
+                   q3=9, q4=14, balance=5000, credit_limit=3000, fee=12.5, days=30, actual=105, budget=100,
+                   discount_rate=0.1, shipping=8, tax=60, shares=1000)
+
+    def setup(parser: Parser):
+        parser.register_function('round', round, pure=True)
+    return Corpus(formulas, context, setup)
+
+
+def _long_sums() -> Corpus:
+    formulas = [' + '.join(f'x{i} * w{i}' for i in range(n)) for n in (100, 300)]
+    context = {**{f'x{i}': i * 0.5 for i in range(300)}, **{f'w{i}': (i % 7) + 1 for i in range(300)}}
+    return Corpus(formulas, context)
+
+
+def _nested_calls() -> Corpus:
+    # 求值仍为递归实现, 嵌套深度控制在默认递归上限以内
+    formulas = [
+        'f(' * 50 + 'x' + ', 1)' * 50,
+        'max(' * 30 + 'x' + ', y)' * 30,
+        'g(f(g(f(x, 1), k=2), 3), k=f(y, g(x, k=1)))',
+    ]
+    context = dict(x=1.5, y=2, f=lambda a, b: a + b, g=lambda a, k=0: a * 2 - k)
+    return Corpus(formulas, context)
+
+
+def _kwargs_slicing() -> Corpus:
+    formulas = [
+        'sum(xs[1:n:2], start=s) + sum(xs[::3][:k], start=0)',
+        'pick(xs, lo=xs[0], hi=xs[-1], step=2)[1:][::2]',
+        'pick(ys[n // 2:], lo=min(xs[:n]), hi=max(xs[n:]), step=1)[-k:] + ys[k:n:2]',
+        'sum((xs[0], xs[-1], ys[1:3][0]), start=m[0][1:][0])',
+    ]
+    context = dict(xs=list(range(20)), ys=list(range(50, 70)), n=10, s=1, k=3, m=[[1, 2, 3]],
+                   pick=lambda seq, lo=0, hi=0, step=1: list(seq)[::step] + [lo, hi])
+    return Corpus(formulas, context)
+
+
+def _custom_operators() -> Corpus:
+    formulas = [
+        'x ** 2 |> sqrt',
+        'a <> b ?? c',
+        '!! a ** 3 + b %% 7 |> abs',
+        '(x |> exp |> log) ** 2 <> (a %% 5 ?? 0)',
+        '!! (a <> b) + x ** 0.5 * (b %% 3) |> abs',
+    ]
+    context = dict(x=4.0, a=7, b=3, c=0.5)
+
+    def setup(parser: Parser):
+        parser.register_binary_op('**', pow, 18000, pure=True)
+        parser.register_binary_op('|>', lambda x, f: f(x), 10000)
+        parser.register_binary_op('<>', lambda x, y: x - y if x > y else y - x, 16000, pure=True)
+        parser.register_binary_op('??', lambda x, y: x if x else y, 10500, pure=True)
+        parser.register_binary_op('%%', lambda x, y: x % y + x // y, 17000, pure=True)
+        parser.register_unary_op('!!', lambda x: x * 2, pure=True)
+    return Corpus(formulas, context, setup)
+
+
+CORPORA: Dict[str, Callable[[], Corpus]] = {
+    'business': _business,
+    'long_sums': _long_sums,
+    'nested_calls': _nested_calls,
+    'kwargs_slicing': _kwargs_slicing,
+    'custom_operators': _custom_operators,
+}
+
+
+def _tokenize(op_mgr, text: str) -> Any:
+    return Lexer(op_mgr, text).tokenize()
+
+
+def _stages(corpus: Corpus) -> Dict[str, List[Callable[[], Any]]]:
+    """各阶段的操作列表, 每个操作处理一个公式, 解析不使用缓存"""
+    parser = Parser(cache_size=0)
+    corpus.setup(parser)
+    formulas, context = corpus.formulas, corpus.context
+    asts = [parser.parse(formula) for formula in formulas]
+    # 确认语料可求值, 避免测量到异常路径
+    for ast in asts:
+        ast.evaluate(context)
+
+    return {
+        'tokenize': [partial(_tokenize, parser.op_mgr, formula) for formula in formulas],
+        'parse': [partial(parser.parse, formula) for formula in formulas],
+        'evaluate': [partial(ast.evaluate, context) for ast in asts],
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def measure(ops: List[Callable[[], Any]], samples: int, min_time: float, latency_ops: int) -> Dict[str, float]:
+    """返回每秒操作数、单次操作的延迟百分位(微秒)及峰值内存(KiB)"""
+
+    def func():
+        for op in ops:
+            op()
+
+    # 确定每个样本的调用次数, 使样本耗时不低于min_time
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, math.ceil(min_time / elapsed)))
+
+    # 吞吐量: 批量运行, 取每次操作的平均耗时
+    means = []
+    gc.collect()
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        means.append((time.perf_counter() - start) / (number * len(ops)))
+
+    # 延迟: 单独计时每次操作, 按顺序轮流处理每个公式
+    latencies = []
+    gc.collect()
+    for i in range(latency_ops):
+        op = ops[i % len(ops)]
+        start = time.perf_counter_ns()
+        op()
+        latencies.append((time.perf_counter_ns() - start) / 1e9)
+
+    # tracemalloc显著拖慢执行, 与计时分开进行
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ops_per_sec': 1 / statistics.median(means),
+        'p50_us': _percentile(latencies, 50) * 1e6,
+        'p90_us': _percentile(latencies, 90) * 1e6,
+        'p99_us': _percentile(latencies, 99) * 1e6,
+        'peak_kib': peak / 1024,
+        'samples': samples,
+        'number': number * len(ops),
+        'latency_ops': latency_ops,
+    }
+
+
+def run(pattern: str = '', samples: int = 20, min_time: float = 0.05,
+        latency_ops: int = 2000) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for corpus_name, make in CORPORA.items():
+        corpus = make()
+        for stage, ops in _stages(corpus).items():
+            name = f'{stage}/{corpus_name}'
+            if pattern in name:
+                results[name] = measure(ops, samples, min_time, latency_ops)
+                r = results[name]
+                # 吞吐量为批量运行的结果, 百分位为单次操作的延迟
+                print(f'{name:<28} {r["ops_per_sec"]:>12.0f} ops/s  latency p50 {r["p50_us"]:>9.2f}us  '
+                      f'p90 {r["p90_us"]:>9.2f}us  p99 {r["p99_us"]:>9.2f}us  peak {r["peak_kib"]:>9.1f}KiB')
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """返回相对基线回退超过阈值的用例说明"""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slowdown = base['ops_per_sec'] / r['ops_per_sec'] - 1
+        growth = r['peak_kib'] / base['peak_kib'] - 1 if base['peak_kib'] else 0
+        if slowdown > threshold:
+            regressions.append(f'{name}: 每秒操作数 {base["ops_per_sec"]:.0f} -> {r["ops_per_sec"]:.0f} '
+                               f'(慢{slowdown:.1%})')
+        if growth > threshold:
+            regressions.append(f'{name}: 峰值内存 {base["peak_kib"]:.1f}KiB -> {r["peak_kib"]:.1f}KiB '
+                               f'(增加{growth:.1%})')
+    return regressions
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description='formulaparser基准测试')
+    arg_parser.add_argument('--output', help='结果保存为JSON文件')
+    arg_parser.add_argument('--baseline', help='与之比较的基线JSON文件(--output的结果)')
+    arg_parser.add_argument('--threshold', type=float, default=0.1, help='视为回退的相对变化, 默认0.1')
+    arg_parser.add_argument('--filter', default='', help='只运行名称包含该字符串的用例')
+    arg_parser.add_argument('--samples', type=int, default=20, help='每个用例测量吞吐量的样本数, 默认20')
+    arg_parser.add_argument('--min-time', type=float, default=0.05, help='每个样本的最短耗时(秒), 默认0.05')
+    arg_parser.add_argument('--latency-ops', type=int, default=2000, help='每个用例单独计时的操作数, 默认2000')
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.filter, args.samples, args.min_time, args.latency_ops)
+    if args.output:
+        report = {
+            'meta': {
+                'formulaparser': formulaparser.__version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'machine': platform.machine(),
+                'platform': platform.platform(),
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'samples': args.samples,
+                'min_time': args.min_time,
+                'latency_ops': args.latency_ops,
+            },
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'相对基线回退超过{args.threshold:.0%}的用例:')
+            for line in regressions:
+                print(f'  {line}')
+            return 1
+        print(f'与基线相比无超过{args.threshold:.0%}的回退')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,9 @@
 from formulaparser.parser import Parser
+from formulaparser.graph import FormulaGraph
+from formulaparser.profiler import Profiler
 
 
-__all__ = ['Parser']
+__all__ = ['Parser', 'FormulaGraph', 'Profiler']
 
 __version__ = '0.1.0'
 __author__ = 'xjunyo'
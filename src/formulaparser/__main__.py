@@ -0,0 +1,4 @@
+import sys
+from formulaparser.cli import main
+
+sys.exit(main())
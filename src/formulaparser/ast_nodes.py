@@ -1,33 +1,42 @@
 """抽象语法树（AST）节点类定义"""
-from operator import getitem
+from operator import getitem, attrgetter
+from functools import partial
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
-from typing import Self, Any, List, Tuple, Dict, Union
-from formulaparser.func_manager import FunctionManager
-from formulaparser.op_manager import OperatorManager
+from contextvars import ContextVar
+from typing import Self, Any, List, Tuple, Dict, Union, Callable
+from formulaparser.func_manager import FunctionManager, FunctionSnapshot
+from formulaparser.op_manager import OperatorManager, OperatorSnapshot
+
+
+def render_tree(root, render_info: Callable[[Any], Tuple[str, Union[List[Any], Dict[str, Any]]]]) -> str:
+    """以树形文本展示节点, render_info返回节点的标题及子节点"""
+    text = []
+    q = [(root, '', '')]
+    while q:
+        node, cur_prefix, leaf_prefix = q.pop()
+        head, leafs = render_info(node)
+        text.append(f'{cur_prefix}{head}')
+        if isinstance(leafs, list):
+            leafs = [('', v) for v in leafs]
+        else:
+            leafs = [(f'{k}=', v) for k, v in leafs.items()]
+        for i, (p_info, l_node) in enumerate(leafs[::-1]):
+            if i == 0:
+                next_cur_prefix, next_leaf_prefix = f'{leaf_prefix}└───{p_info}', f'{leaf_prefix}    '
+            else:
+                next_cur_prefix, next_leaf_prefix = f'{leaf_prefix}├───{p_info}', f'{leaf_prefix}│   '
+            q.append((l_node, next_cur_prefix, next_leaf_prefix))
+    return '\n'.join(text)
+
 
 # AST节点基类
 class ASTNode(ABC):
     """抽象语法树节点基类"""
+    __slots__ = ()
 
     def render(self):
-        text = []
-        q = [(self, '', '')]
-        while q:
-            node, cur_prefix, leaf_prefix = q.pop()
-            head, leafs = node._render_info()
-            text.append(f'{cur_prefix}{head}')
-            if isinstance(leafs, list):
-                leafs = [('', v) for v in leafs]
-            else:
-                leafs = [(f'{k}=', v) for k, v in leafs.items()]
-            for i, (p_info, l_node) in enumerate(leafs[::-1]):
-                if i == 0:
-                    next_cur_prefix, next_leaf_prefix = f'{leaf_prefix}└───{p_info}', f'{leaf_prefix}    '
-                else:
-                    next_cur_prefix, next_leaf_prefix = f'{leaf_prefix}├───{p_info}', f'{leaf_prefix}│   '
-                q.append((l_node, next_cur_prefix, next_leaf_prefix))
-        return '\n'.join(text)
+        return render_tree(self, lambda node: node._render_info())
 
     @abstractmethod
     def _render_info(self) -> Tuple[str, Union[List[Self], Dict[str, Self]]]:
@@ -37,8 +46,69 @@ class ASTNode(ABC):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         ...
 
+    def compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        """将语法树编译为嵌套闭包, 运算符、函数及属性链在编译时预先绑定, 调用结果与evaluate(context)一致"""
+        return self._compile()
+
+    def optimize(self) -> 'ASTNode':
+        """常量折叠及公共子表达式消除, 返回优化后的新语法树, 详见formulaparser.optimizer"""
+        from formulaparser.optimizer import fold_constants, eliminate_common_subexpressions
+        return eliminate_common_subexpressions(fold_constants(self))[0]
+
+    def cse(self) -> Tuple['ASTNode', int]:
+        """公共子表达式消除, 返回新的语法树及每次求值减少计算的节点数"""
+        from formulaparser.optimizer import eliminate_common_subexpressions
+        return eliminate_common_subexpressions(self)
+
+    def evaluate_vectorized(self, columns: Union[Dict[str, Any], None]=None) -> Any:
+        """以NumPy数组作为列数据批量求值, 返回每行结果组成的数组, 详见formulaparser.vectorize"""
+        from formulaparser.vectorize import evaluate_vectorized
+        return evaluate_vectorized(self, columns)
+
+    async def evaluate_async(self, context: Union[Dict[str, Any], None]=None, limit: Union[int, None]=None) -> Any:
+        """异步求值, 支持协程函数, 相互独立的子表达式并发等待, limit限制并发调用数, 详见formulaparser.asynchronous"""
+        from formulaparser.asynchronous import evaluate_async
+        return await evaluate_async(self, context, limit)
+
+    def evaluate_profiled(self, profiler, context: Union[Dict[str, Any], None]=None) -> Any:
+        """求值并由profiler记录各节点及函数、运算符的耗时, 详见formulaparser.profiler"""
+        return profiler.evaluate(self, context)
+
+    def incremental(self, context: Union[Dict[str, Any], None]=None):
+        """创建增量求值器, 通过update(name=value)更新变量时仅重新计算受影响的节点, 详见formulaparser.incremental"""
+        from formulaparser.incremental import IncrementalEvaluator
+        return IncrementalEvaluator(self, context)
+
+    def compact(self):
+        """展平为指令数组及常量池表示的紧凑语法树, 详见formulaparser.compact"""
+        from formulaparser.compact import CompactAST
+        return CompactAST.from_ast(self)
+
+    def postfix(self):
+        """线性化为后缀指令序列, 在显式值栈上非递归求值, 适用于很深的语法树, 详见formulaparser.postfix"""
+        from formulaparser.postfix import PostfixProgram
+        return PostfixProgram(self)
+
+    def bind(self, variables=None, registry=None, shadowable=True):
+        """绑定时解析所有函数及运算符, 返回可重复调用的对象, 详见formulaparser.bind
+
+        给出variables时以tuple、list、array.array等序列按位置传入变量, 否则传入字典;
+        registry为Parser.snapshot返回的注册表快照, 为None时使用绑定时各节点注册表的快照;
+        shadowable为可被上下文中同名变量覆盖的函数名, True表示全部, False表示均不可覆盖
+        """
+        from formulaparser.bind import BoundFormula
+        return BoundFormula(self, variables, registry, shadowable)
+
+    def dumps(self) -> bytes:
+        """序列化为二进制格式, 运算符及函数只保存名称, 可由Parser.loads加载"""
+        return self.compact().dumps()
 
-@dataclass
+    @abstractmethod
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        ...
+
+
+@dataclass(slots=True)
 class NumberNode(ASTNode):
     """数字节点"""
     value: Union[float, int]
@@ -52,8 +122,15 @@ class NumberNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return self.value
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        value = self.value
+
+        def _constant(context=None):
+            return value
+        return _constant
 
-@dataclass
+
+@dataclass(slots=True)
 class StringNode(ASTNode):
     """字符串节点"""
     value: str
@@ -67,8 +144,15 @@ class StringNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return self.value
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        value = self.value
+
+        def _constant(context=None):
+            return value
+        return _constant
+
 
-@dataclass
+@dataclass(slots=True)
 class NoneNode(ASTNode):
     def __repr__(self):
         return f'{self.__class__.__name__}'
@@ -79,11 +163,57 @@ class NoneNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return None
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        def _none(context=None):
+            return None
+        return _none
+
+
+@dataclass(slots=True)
+class ConstantNode(ASTNode):
+    """常量折叠得到的常量节点
+
+    折叠了函数调用时, names为被调用的函数名, 上下文中存在同名变量时改为对原节点original求值
+    """
+    value: Any
+    names: Tuple[str, ...] = ()
+    original: Union[ASTNode, None] = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.value!r})'
 
-@dataclass
+    def _render_info(self) -> Tuple[str, Union[List[Self], Dict[str, Self]]]:
+        return f'Const({self.value!r})', []
+
+    def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
+        if context and self.names:
+            for name in self.names:
+                if name in context:
+                    return self.original.evaluate(context)
+        return self.value
+
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        value = self.value
+        if not self.names:
+            def _constant(context=None):
+                return value
+            return _constant
+
+        names, original = self.names, self.original._compile()
+
+        def _guarded_constant(context=None):
+            if context:
+                for name in names:
+                    if name in context:
+                        return original(context)
+            return value
+        return _guarded_constant
+
+
+@dataclass(slots=True)
 class BinaryOpNode(ASTNode):
     """二元运算符节点"""
-    op_mgr: OperatorManager
+    op_mgr: Union[OperatorManager, OperatorSnapshot]
     operator: str
     left: ASTNode
     right: ASTNode
@@ -98,11 +228,19 @@ class BinaryOpNode(ASTNode):
         func = self.op_mgr.binary_funcs[self.operator]
         return func(self.left.evaluate(context), self.right.evaluate(context))
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        func = self.op_mgr.binary_funcs[self.operator]
+        left, right = self.left._compile(), self.right._compile()
+
+        def _binary_op(context=None):
+            return func(left(context), right(context))
+        return _binary_op
 
-@dataclass
+
+@dataclass(slots=True)
 class UnaryOpNode(ASTNode):
     """一元运算符节点"""
-    op_mgr: OperatorManager
+    op_mgr: Union[OperatorManager, OperatorSnapshot]
     operator: str
     operand: ASTNode
 
@@ -116,10 +254,18 @@ class UnaryOpNode(ASTNode):
         func = self.op_mgr.unary_funcs[self.operator]
         return func(self.operand.evaluate(context))
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        func = self.op_mgr.unary_funcs[self.operator]
+        operand = self.operand._compile()
+
+        def _unary_op(context=None):
+            return func(operand(context))
+        return _unary_op
+
 
-@dataclass
+@dataclass(slots=True)
 class IdentifierNode(ASTNode):
-    func_mgr: FunctionManager
+    func_mgr: Union[FunctionManager, FunctionSnapshot]
     name: str
 
     def __repr__(self):
@@ -136,8 +282,29 @@ class IdentifierNode(ASTNode):
         else:
             raise KeyError(f'{self.name} not found')
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        name, func_mgr = self.name, self.func_mgr
+        if func_mgr.has_func(name):
+            # 已注册的函数不可被覆盖或删除, 可在编译时绑定
+            func = func_mgr.get_func(name)
+
+            def _function(context=None):
+                if context and name in context:
+                    return context[name]
+                return func
+            return _function
+
+        def _identifier(context=None):
+            if context and name in context:
+                return context[name]
+            elif func_mgr.has_func(name):
+                return func_mgr.get_func(name)
+            else:
+                raise KeyError(f'{name} not found')
+        return _identifier
+
 
-@dataclass
+@dataclass(slots=True)
 class SliceNode(ASTNode):
     start: ASTNode
     stop: ASTNode
@@ -152,8 +319,24 @@ class SliceNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return slice(self.start.evaluate(context), self.stop.evaluate(context), self.step.evaluate(context))
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        literals = (NumberNode, StringNode, NoneNode)
+        if all(isinstance(node, literals) for node in (self.start, self.stop, self.step)):
+            # 字面量切片不依赖上下文, 直接构造
+            value = self.evaluate()
 
-@dataclass
+            def _literal_slice(context=None):
+                return value
+            return _literal_slice
+
+        start, stop, step = self.start._compile(), self.stop._compile(), self.step._compile()
+
+        def _slice(context=None):
+            return slice(start(context), stop(context), step(context))
+        return _slice
+
+
+@dataclass(slots=True)
 class AttributionNode(ASTNode):
     obj: ASTNode
     properties: List[str]
@@ -170,8 +353,16 @@ class AttributionNode(ASTNode):
             ans = getattr(ans, p)
         return ans
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        obj = self.obj._compile()
+        getter = attrgetter('.'.join(self.properties))
+
+        def _attribution(context=None):
+            return getter(obj(context))
+        return _attribution
 
-@dataclass
+
+@dataclass(slots=True)
 class TupleNode(ASTNode):
     args: List[ASTNode]
 
@@ -184,8 +375,15 @@ class TupleNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return tuple(arg.evaluate(context) for arg in self.args)
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        args = [arg._compile() for arg in self.args]
+
+        def _tuple(context=None):
+            return tuple([arg(context) for arg in args])
+        return _tuple
 
-@dataclass
+
+@dataclass(slots=True)
 class ListNode(ASTNode):
     args: List[ASTNode]
 
@@ -198,8 +396,15 @@ class ListNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return list(arg.evaluate(context) for arg in self.args)
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        args = [arg._compile() for arg in self.args]
+
+        def _list(context=None):
+            return [arg(context) for arg in args]
+        return _list
 
-@dataclass
+
+@dataclass(slots=True)
 class ItemNode(ASTNode):
     obj: ASTNode
     slice_obj: ASTNode
@@ -212,8 +417,15 @@ class ItemNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return getitem(self.obj.evaluate(context), self.slice_obj.evaluate(context))
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        obj, slice_obj = self.obj._compile(), self.slice_obj._compile()
+
+        def _item(context=None):
+            return getitem(obj(context), slice_obj(context))
+        return _item
+
 
-@dataclass
+@dataclass(slots=True)
 class ArgsNode(ASTNode):
     args: List[ASTNode]
 
@@ -232,6 +444,13 @@ class ArgsNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return [arg.evaluate(context) for arg in self.args]
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        args = [arg._compile() for arg in self.args]
+
+        def _args(context=None):
+            return [arg(context) for arg in args]
+        return _args
+
     def append(self, arg: ASTNode):
         self.args.append(arg)
 
@@ -242,7 +461,7 @@ class ArgsNode(ASTNode):
         return ListNode(self.args[:])
 
 
-@dataclass
+@dataclass(slots=True)
 class KwargsNode(ASTNode):
     kwargs: Dict[str, ASTNode]
 
@@ -261,13 +480,20 @@ class KwargsNode(ASTNode):
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
         return {k: v.evaluate(context) for k, v in self.kwargs.items()}
 
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        kwargs = [(k, v._compile()) for k, v in self.kwargs.items()]
+
+        def _kwargs(context=None):
+            return {k: v(context) for k, v in kwargs}
+        return _kwargs
+
     def add(self, k: str, v: ASTNode):
         if k in self.kwargs:
             raise KeyError(f'{k} already exists')
         self.kwargs[k] = v
 
 
-@dataclass
+@dataclass(slots=True)
 class FunctionCallNode(ASTNode):
     """函数调用节点"""
     func: ASTNode
@@ -280,6 +506,157 @@ class FunctionCallNode(ASTNode):
     def _render_info(self) -> Tuple[str, Union[List[Self], Dict[str, Self]]]:
         return 'Function', [self.func, self.args, self.kwargs]
 
+    def is_lazy(self, context: Union[Dict[str, Any], None]=None) -> bool:
+        """调用的是否为未被上下文中同名变量覆盖的惰性函数"""
+        func = self.func
+        return (isinstance(func, IdentifierNode) and func.name in func.func_mgr.lazy_functions
+                and not (context and func.name in context))
+
+    def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
+        node = self.func
+        func = node.evaluate(context)
+        if type(node) is IdentifierNode and node.name in node.func_mgr.lazy_functions and not (
+                context and node.name in context):
+            # 惰性函数的参数以thunk传入, 同is_lazy
+            return func(*[partial(arg.evaluate, context) for arg in self.args.args],
+                        **{k: partial(v.evaluate, context) for k, v in self.kwargs.kwargs.items()})
+        return func(*self.args.evaluate(context), **self.kwargs.evaluate(context))
+
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        func = self.func._compile()
+        if self.is_lazy():
+            name = self.func.name
+            arg_funcs = [arg._compile() for arg in self.args.args]
+            kwarg_funcs = [(k, v._compile()) for k, v in self.kwargs.kwargs.items()]
+
+            def _lazy_call(context=None):
+                f = func(context)
+                if context and name in context:
+                    return f(*[arg(context) for arg in arg_funcs], **{k: v(context) for k, v in kwarg_funcs})
+                return f(*[partial(arg, context) for arg in arg_funcs],
+                         **{k: partial(v, context) for k, v in kwarg_funcs})
+            return _lazy_call
+
+        if self.kwargs:
+            args, kwargs = self.args._compile(), self.kwargs._compile()
+
+            def _call(context=None):
+                f = func(context)
+                return f(*args(context), **kwargs(context))
+            return _call
+
+        # 无关键字参数时按参数个数展开, 避免构造临时列表和字典
+        arg_funcs = [arg._compile() for arg in self.args.args]
+        if len(arg_funcs) == 0:
+            def _call(context=None):
+                return func(context)()
+        elif len(arg_funcs) == 1:
+            arg0, = arg_funcs
+
+            def _call(context=None):
+                f = func(context)
+                return f(arg0(context))
+        elif len(arg_funcs) == 2:
+            arg0, arg1 = arg_funcs
+
+            def _call(context=None):
+                f = func(context)
+                return f(arg0(context), arg1(context))
+        else:
+            def _call(context=None):
+                f = func(context)
+                return f(*[arg(context) for arg in arg_funcs])
+        return _call
+
+
+# 当前CSENode求值过程中公共子表达式的值, 按SharedNode的id保存
+_shared_values: ContextVar[Union[Dict[int, Any], None]] = ContextVar('formulaparser_shared_values', default=None)
+# 可被多个父节点共用的结果类型, 其余（可能可变的）结果每次重新计算, 避免不同父节点持有同一对象
+_SHAREABLE_TYPES = frozenset({int, float, complex, bool, str, bytes, type(None)})
+
+
+@dataclass(slots=True)
+class SharedNode(ASTNode):
+    """公共子表达式节点, 被多个父节点引用, 在同一次CSENode求值中只计算一次
+
+    仅复用不可变的标量结果, 列表等可能被修改的结果仍每次重新计算
+    """
+    node: ASTNode
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.node!r})'
+
+    def _render_info(self) -> Tuple[str, Union[List[Self], Dict[str, Self]]]:
+        return f'Shared@{id(self):x}', [self.node]
+
+    def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
+        values = _shared_values.get()
+        if values is None:
+            return self.node.evaluate(context)
+        key = id(self)
+        if key in values:
+            return values[key]
+        value = self.node.evaluate(context)
+        if type(value) in _SHAREABLE_TYPES:
+            values[key] = value
+        return value
+
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        node, key, get_values, shareable_types = self.node._compile(), id(self), _shared_values.get, _SHAREABLE_TYPES
+
+        def _shared(context=None):
+            values = get_values()
+            if values is None:
+                return node(context)
+            if key in values:
+                return values[key]
+            value = node(context)
+            if type(value) in shareable_types:
+                values[key] = value
+            return value
+        return _shared
+
+
+@dataclass(slots=True)
+class CSENode(ASTNode):
+    """公共子表达式消除后的语法树根节点
+
+    body中的SharedNode在每次求值时只计算一次; 上下文覆盖了names中的函数时, 改为对未消除的原语法树original求值
+    """
+    body: ASTNode
+    original: ASTNode
+    names: Tuple[str, ...]
+    deduplicated: int
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.body!r})'
+
+    def _render_info(self) -> Tuple[str, Union[List[Self], Dict[str, Self]]]:
+        return f'CSE(deduplicated={self.deduplicated})', [self.body]
+
     def evaluate(self, context: Union[Dict[str, Any], None]=None) -> Any:
-        func = self.func.evaluate(context)
-        return func(*self.args.evaluate(context), **self.kwargs.evaluate(context))
\ No newline at end of file
+        if context:
+            for name in self.names:
+                if name in context:
+                    return self.original.evaluate(context)
+        token = _shared_values.set({})
+        try:
+            return self.body.evaluate(context)
+        finally:
+            _shared_values.reset(token)
+
+    def _compile(self) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        body, original, names = self.body._compile(), self.original._compile(), self.names
+        set_values, reset_values = _shared_values.set, _shared_values.reset
+
+        def _cse(context=None):
+            if context:
+                for name in names:
+                    if name in context:
+                        return original(context)
+            token = set_values({})
+            try:
+                return body(context)
+            finally:
+                reset_values(token)
+        return _cse
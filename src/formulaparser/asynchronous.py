@@ -0,0 +1,199 @@
+"""基于asyncio的异步求值
+
+注册的函数或运算符可以是协程函数, 调用结果为awaitable时等待其完成。
+函数调用、运算符、元组、列表、下标及切片中相互独立的子表达式通过asyncio.gather并发等待,
+limit限制同时等待的函数及运算符调用数量。
+内置的惰性函数(if_、and_then、or_else、coalesce)按顺序等待被选中的参数; 自定义惰性函数的thunk同步求值。
+"""
+import asyncio
+import inspect
+from functools import partial
+from operator import getitem, attrgetter
+from typing import Any, Dict, List, Union
+from formulaparser.func_manager import if_, and_then, or_else, coalesce
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, FunctionCallNode, SharedNode, CSENode, _SHAREABLE_TYPES
+)
+
+# 可以直接同步求值的节点
+_SYNC_NODES = (NumberNode, StringNode, NoneNode, IdentifierNode)
+
+
+async def _if(cond, then, otherwise=None):
+    if await cond():
+        return await then()
+    return await otherwise() if otherwise is not None else None
+
+
+async def _and_then(first, *rest):
+    value = await first()
+    for thunk in rest:
+        if not value:
+            return value
+        value = await thunk()
+    return value
+
+
+async def _or_else(first, *rest):
+    value = await first()
+    for thunk in rest:
+        if value:
+            return value
+        value = await thunk()
+    return value
+
+
+async def _coalesce(*thunks):
+    for thunk in thunks:
+        value = await thunk()
+        if value is not None:
+            return value
+    return None
+
+
+# 内置惰性函数的异步实现, thunk返回协程
+_LAZY_IMPLS = {if_: _if, and_then: _and_then, or_else: _or_else, coalesce: _coalesce}
+
+
+class _AsyncEvaluator:
+    """异步求值器"""
+
+    def __init__(self, context: Union[Dict[str, Any], None], limit: Union[int, None]):
+        if limit is not None and limit < 1:
+            raise ValueError(f'并发数不能小于1：{limit}')
+        self.context = context
+        self.semaphore = asyncio.Semaphore(limit) if limit else None
+        self._shared_values: Union[Dict[int, asyncio.Future], None] = None
+
+    async def visit(self, node: ASTNode) -> Any:
+        visit = getattr(self, f'visit_{type(node).__name__}', None)
+        if visit is None:
+            return node.evaluate(self.context)
+        return await visit(node)
+
+    async def gather(self, nodes: List[ASTNode]) -> List[Any]:
+        """并发求值多个子节点, 有多个异常时按子节点顺序抛出第一个"""
+        values, pending, error = [], [], None
+        for node in nodes:
+            if isinstance(node, _SYNC_NODES):
+                try:
+                    values.append(node.evaluate(self.context))
+                except Exception as e:
+                    # 之后的子节点不再求值, 之前的子节点出错时其异常在前
+                    error = e
+                    break
+            else:
+                values.append(None)
+                pending.append((len(values) - 1, node))
+        if len(pending) == 1:
+            i, node = pending[0]
+            values[i] = await self.visit(node)
+        elif pending:
+            results = await asyncio.gather(*[self.visit(node) for _, node in pending], return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            for (i, _), result in zip(pending, results):
+                values[i] = result
+        if error is not None:
+            raise error
+        return values
+
+    async def call(self, func, *args, **kwargs) -> Any:
+        result = func(*args, **kwargs)
+        if not inspect.isawaitable(result):
+            return result
+        if self.semaphore is None:
+            return await result
+        async with self.semaphore:
+            return await result
+
+    async def visit_NumberNode(self, node: NumberNode) -> Any:
+        return node.value
+
+    async def visit_StringNode(self, node: StringNode) -> Any:
+        return node.value
+
+    async def visit_NoneNode(self, node: NoneNode) -> Any:
+        return None
+
+    async def visit_ConstantNode(self, node: ConstantNode) -> Any:
+        if self.context and any(name in self.context for name in node.names):
+            return await self.visit(node.original)
+        return node.value
+
+    async def visit_IdentifierNode(self, node: IdentifierNode) -> Any:
+        return node.evaluate(self.context)
+
+    async def visit_SharedNode(self, node: SharedNode) -> Any:
+        values = self._shared_values
+        if values is None:
+            return await self.visit(node.node)
+        key = id(node)
+        if key in values:
+            # 并发的另一分支正在计算, 不可共用的结果由当前分支重新计算
+            value = await asyncio.shield(values[key])
+            if type(value) in _SHAREABLE_TYPES:
+                return value
+            return await self.visit(node.node)
+        future = values[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self.visit(node.node)
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他分支等待时不再报告该异常
+            future.exception()
+            raise
+        future.set_result(value)
+        return value
+
+    async def visit_CSENode(self, node: CSENode) -> Any:
+        if self.context and any(name in self.context for name in node.names):
+            return await self.visit(node.original)
+        values, self._shared_values = self._shared_values, {}
+        try:
+            return await self.visit(node.body)
+        finally:
+            self._shared_values = values
+
+    async def visit_BinaryOpNode(self, node: BinaryOpNode) -> Any:
+        left, right = await self.gather([node.left, node.right])
+        return await self.call(node.op_mgr.binary_funcs[node.operator], left, right)
+
+    async def visit_UnaryOpNode(self, node: UnaryOpNode) -> Any:
+        return await self.call(node.op_mgr.unary_funcs[node.operator], await self.visit(node.operand))
+
+    async def visit_SliceNode(self, node: SliceNode) -> Any:
+        return slice(*await self.gather([node.start, node.stop, node.step]))
+
+    async def visit_AttributionNode(self, node: AttributionNode) -> Any:
+        return attrgetter('.'.join(node.properties))(await self.visit(node.obj))
+
+    async def visit_TupleNode(self, node: TupleNode) -> Any:
+        return tuple(await self.gather(node.args))
+
+    async def visit_ListNode(self, node: ListNode) -> Any:
+        return await self.gather(node.args)
+
+    async def visit_ItemNode(self, node: ItemNode) -> Any:
+        return getitem(*await self.gather([node.obj, node.slice_obj]))
+
+    async def visit_FunctionCallNode(self, node: FunctionCallNode) -> Any:
+        func = await self.visit(node.func)
+        args, kwargs = node.args.args, node.kwargs.kwargs
+        if node.is_lazy(self.context):
+            impl = _LAZY_IMPLS.get(func)
+            if impl is not None:
+                return await impl(*[partial(self.visit, arg) for arg in args],
+                                  **{k: partial(self.visit, v) for k, v in kwargs.items()})
+            return await self.call(func, *[partial(arg.evaluate, self.context) for arg in args],
+                                   **{k: partial(v.evaluate, self.context) for k, v in kwargs.items()})
+        values = await self.gather([*args, *kwargs.values()])
+        return await self.call(func, *values[:len(args)], **dict(zip(kwargs, values[len(args):])))
+
+
+async def evaluate_async(node: ASTNode, context: Union[Dict[str, Any], None] = None,
+                         limit: Union[int, None] = None) -> Any:
+    """异步求值, 结果与evaluate一致; 有多个子表达式出错时抛出按求值顺序的第一个异常"""
+    return await _AsyncEvaluator(context, limit).visit(node)
@@ -0,0 +1,121 @@
+"""多进程批量求值
+
+语法树在每个工作进程初始化时传入一次并编译, 数值列通过multiprocessing.shared_memory共享, 不随任务逐行序列化。
+结果按行的顺序返回, 求值异常附带出错的行号。
+"""
+import os
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Mapping, Sequence, Tuple, Union
+from formulaparser.ast_nodes import ASTNode
+
+# 工作进程中的公式及列数据
+_worker_state: Dict[str, Any] = {}
+
+
+def _columns_of(rows: Union[Mapping[str, Sequence], Sequence[Mapping[str, Any]]]) -> Tuple[Dict[str, Sequence], int]:
+    """将按列或按行给出的数据统一为列"""
+    if isinstance(rows, Mapping):
+        columns = {name: list(values) for name, values in rows.items()}
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'各列长度不一致：{ {name: len(values) for name, values in columns.items()} }')
+        return columns, lengths.pop() if lengths else 0
+
+    rows = list(rows)
+    names = list(rows[0]) if rows else []
+    for i, row in enumerate(rows):
+        if len(row) != len(names) or any(name not in row for name in names):
+            raise ValueError(f'各行的变量名不一致，位置：第{i}行')
+    return {name: [row[name] for row in rows] for name in names}, len(rows)
+
+
+def _typecode(values: List[Any]) -> Union[str, None]:
+    """可放入共享内存的数值列的类型码"""
+    if values and all(type(v) is float for v in values):
+        return 'd'
+    if values and all(type(v) is int and -2 ** 63 <= v < 2 ** 63 for v in values):
+        return 'q'
+    return None
+
+
+def _init_worker(node: ASTNode, shared: Dict[str, Tuple[str, str, int]], objects: Dict[str, List[Any]]):
+    columns = dict(objects)
+    buffers = []
+    for name, (shm_name, typecode, length) in shared.items():
+        shm = SharedMemory(shm_name)
+        buffers.append(shm)
+        columns[name] = shm.buf.cast(typecode)[:length]
+    _worker_state.update(func=node.compile(), columns=columns, buffers=buffers)
+
+
+def _evaluate_rows(start: int, stop: int, func=None, columns=None) -> List[Any]:
+    if func is None:
+        func, columns = _worker_state['func'], _worker_state['columns']
+    names = list(columns)
+    values = [columns[name][start:stop] for name in names]
+    values = [v.tolist() if isinstance(v, memoryview) else v for v in values]
+    results = []
+    row = start
+    try:
+        for row in range(start, stop):
+            i = row - start
+            results.append(func({name: column[i] for name, column in zip(names, values)}))
+    except Exception as e:
+        e.add_note(f'位置：第{row}行')
+        e.row = row
+        raise
+    return results
+
+
+def evaluate_batch(node: ASTNode, rows: Union[Mapping[str, Sequence], Sequence[Mapping[str, Any]]],
+                   workers: Union[int, None] = None, chunk_size: Union[int, None] = None) -> List[Any]:
+    """多进程按行求值, 返回与行顺序一致的结果列表
+
+    rows为列名到列数据的映射, 或每行变量组成的映射序列; workers默认为CPU核数, 为1时在当前进程求值
+    """
+    columns, length = _columns_of(rows)
+    workers = workers or os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f'进程数不能小于1：{workers}')
+    if workers == 1 or length <= 1:
+        return _evaluate_rows(0, length, node.compile(), columns)
+
+    chunk_size = chunk_size or max(1, -(-length // (workers * 4)))
+    if chunk_size < 1:
+        raise ValueError(f'分块大小不能小于1：{chunk_size}')
+
+    # fork方式启动时语法树无需序列化, 可以包含lambda等不能pickle的自定义函数
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+    buffers, shared, objects = [], {}, {}
+    try:
+        for name, values in columns.items():
+            typecode = _typecode(values)
+            if typecode is None:
+                objects[name] = values
+                continue
+            data = array(typecode, values)
+            shm = SharedMemory(create=True, size=max(1, len(data) * data.itemsize))
+            buffers.append(shm)
+            shm.buf[:len(data) * data.itemsize] = data.tobytes()
+            shared[name] = (shm.name, typecode, length)
+
+        with ProcessPoolExecutor(workers, context, _init_worker, (node, shared, objects)) as executor:
+            futures = [executor.submit(_evaluate_rows, start, min(start + chunk_size, length))
+                       for start in range(0, length, chunk_size)]
+            results = []
+            try:
+                for future in futures:
+                    results.extend(future.result())
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
+            return results
+    finally:
+        for shm in buffers:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,359 @@
+"""绑定时解析函数及运算符
+
+bind在绑定时将每个运算符及函数名解析为注册表快照中的可调用对象, 之后注册的函数或运算符不影响已绑定的公式。
+给出variables时按位置取值: 每个变量解析为行中的固定位置, 求值时传入与variables顺序一致的行
+（tuple、list、array.array、memoryview等支持下标访问的序列）, 不需要为每行构造字典;
+未给出variables时求值时传入字典, 与compile的闭包用法相同。
+
+shadowable规定哪些已注册的函数可以被上下文中的同名变量覆盖:
+- True（默认）: 全部函数, 与evaluate一致;
+- False: 均不可覆盖, 函数调用不再检查上下文;
+- 函数名的集合: 只有其中的函数可被覆盖, 集合中未注册的名称须在调用时由上下文给出。
+
+按位置取值时是否覆盖在绑定时即可确定, variables中出现不可覆盖的函数名时抛出ValueError;
+被调用的名称既未注册也不能由上下文给出时, 在绑定时抛出KeyError, 而不是在求值时才出错。
+常量折叠及公共子表达式消除的判断同样在绑定时完成, 结果与evaluate一致。
+"""
+from functools import partial
+from operator import getitem, attrgetter, itemgetter
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Sequence, Tuple, Union
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, FunctionCallNode, SharedNode, CSENode, _shared_values,
+    _SHAREABLE_TYPES
+)
+from formulaparser.func_manager import FunctionManager, FunctionSnapshot
+from formulaparser.op_manager import OperatorManager, OperatorSnapshot
+
+
+class BoundFormula:
+    """绑定后的公式, 给出variables时调用时传入行, 否则传入字典"""
+
+    def __init__(self, node: ASTNode, variables: Union[Iterable[str], None] = None, registry=None,
+                 shadowable: Union[bool, Iterable[str]] = True):
+        self.node = node
+        self.variables: Union[Tuple[str, ...], None] = None if variables is None else tuple(variables)
+        self.registry = registry
+        self.shadowable: Union[bool, FrozenSet[str]] = (
+            shadowable if isinstance(shadowable, bool) else frozenset(shadowable)
+        )
+        slots = None
+        if self.variables is not None:
+            slots: Dict[str, int] = {}
+            for i, name in enumerate(self.variables):
+                if name in slots:
+                    raise ValueError(f'变量重复：{name}')
+                slots[name] = i
+        self.slots = slots
+        self._empty = {} if slots is None else ()
+        self._func = _Binder(slots, registry, self.shadowable).bind(node)
+
+    def __repr__(self):
+        if self.variables is None:
+            return f'{self.__class__.__name__}(**context)'
+        return f'{self.__class__.__name__}({", ".join(self.variables)})'
+
+    def __call__(self, row: Union[Sequence[Any], Dict[str, Any], None] = None) -> Any:
+        return self._func(row if row is not None else self._empty)
+
+    evaluate = __call__
+
+    def evaluate_many(self, rows: Iterable[Union[Sequence[Any], Dict[str, Any]]]) -> List[Any]:
+        """对多行求值, 返回结果列表"""
+        return list(map(self._func, rows))
+
+
+class _Binder:
+    """生成以行（或字典）为参数的闭包, 各节点的语义与其_compile一致"""
+
+    def __init__(self, slots: Union[Dict[str, int], None], registry, shadowable: Union[bool, FrozenSet[str]]):
+        # slots为None时按名称从字典取值
+        self.slots = slots
+        self.registry = registry
+        self.shadowable = shadowable
+        # 未给出registry时, 每个注册表在绑定时只取一次快照, 按注册表的id保存
+        self._snapshots: Dict[int, Union[FunctionSnapshot, OperatorSnapshot]] = {}
+
+    def bind(self, node: ASTNode) -> Callable[[Any], Any]:
+        visit = getattr(self, f'visit_{type(node).__name__}', None)
+        if visit is None:
+            # 未知节点以行构造的上下文整体求值
+            if self.slots is None:
+                return node.evaluate
+            names = tuple(self.slots)
+
+            def _evaluate(row):
+                return node.evaluate(dict(zip(names, row)))
+            return _evaluate
+        return visit(node)
+
+    def _snapshot(self, manager: Union[FunctionManager, OperatorManager, FunctionSnapshot, OperatorSnapshot]):
+        snapshot = self._snapshots.get(id(manager))
+        if snapshot is None:
+            snapshot = self._snapshots[id(manager)] = manager.snapshot()
+        return snapshot
+
+    def functions(self, node: IdentifierNode) -> FunctionSnapshot:
+        return self.registry.functions if self.registry is not None else self._snapshot(node.func_mgr)
+
+    def operators(self, node: Union[BinaryOpNode, UnaryOpNode]) -> OperatorSnapshot:
+        return self.registry.operators if self.registry is not None else self._snapshot(node.op_mgr)
+
+    def may_shadow(self, name: str) -> bool:
+        return self.shadowable is True or (self.shadowable is not False and name in self.shadowable)
+
+    def key(self, node: ASTNode) -> Union[int, str, None]:
+        """总是从行中取值的标识符返回其下标（按名称取值时为名称）, 否则返回None"""
+        if not isinstance(node, IdentifierNode):
+            return None
+        name = node.name
+        registered = self.functions(node).has_func(name)
+        if self.slots is None:
+            return None if registered else name
+        if name in self.slots and registered and not self.may_shadow(name):
+            raise ValueError(f'变量"{name}"不能覆盖同名函数')
+        return self.slots.get(name)
+
+    def overridden(self, names: Iterable[str]) -> bool:
+        """按位置取值时, names中的函数是否被变量覆盖"""
+        if self.slots is None:
+            return False
+        for name in names:
+            if name in self.slots:
+                if not self.may_shadow(name):
+                    raise ValueError(f'变量"{name}"不能覆盖同名函数')
+                return True
+        return False
+
+    def shadowed(self, names: Iterable[str]) -> Tuple[str, ...]:
+        """按名称取值时, names中需要在求值时检查上下文的函数名"""
+        if self.slots is not None:
+            return ()
+        return tuple(name for name in names if self.may_shadow(name))
+
+    @staticmethod
+    def constant(value: Any) -> Callable[[Any], Any]:
+        def _constant(row):
+            return value
+        return _constant
+
+    def visit_NumberNode(self, node: NumberNode):
+        return self.constant(node.value)
+
+    visit_StringNode = visit_NumberNode
+
+    def visit_NoneNode(self, node: NoneNode):
+        return self.constant(None)
+
+    def visit_ConstantNode(self, node: ConstantNode):
+        if self.overridden(node.names):
+            return self.bind(node.original)
+        value, names = node.value, self.shadowed(node.names)
+        if not names:
+            return self.constant(value)
+        original = self.bind(node.original)
+
+        def _constant(context):
+            for name in names:
+                if name in context:
+                    return original(context)
+            return value
+        return _constant
+
+    def visit_IdentifierNode(self, node: IdentifierNode):
+        key = self.key(node)
+        if key is not None:
+            return itemgetter(key)
+        # 不在行中的标识符只能是已注册的函数, 在绑定时确定
+        name, functions = node.name, self.functions(node)
+        if not functions.has_func(name):
+            raise KeyError(f'{name} not found')
+        func = functions.get_func(name)
+        if self.shadowed((name,)):
+            def _function(context):
+                if name in context:
+                    return context[name]
+                return func
+            return _function
+        return self.constant(func)
+
+    def visit_BinaryOpNode(self, node: BinaryOpNode):
+        func = self.operators(node).get_binary_func(node.operator)
+        left, right = node.left, node.right
+        # 操作数为变量时直接从行中取值, 减少一层闭包调用
+        i, j = self.key(left), self.key(right)
+        if i is not None:
+            if j is not None:
+                def _binary_op(row):
+                    return func(row[i], row[j])
+                return _binary_op
+            if isinstance(right, NumberNode):
+                value = right.value
+
+                def _binary_op(row):
+                    return func(row[i], value)
+                return _binary_op
+        elif j is not None and isinstance(left, NumberNode):
+            value = left.value
+
+            def _binary_op(row):
+                return func(value, row[j])
+            return _binary_op
+        left, right = self.bind(left), self.bind(right)
+
+        def _binary_op(row):
+            return func(left(row), right(row))
+        return _binary_op
+
+    def visit_UnaryOpNode(self, node: UnaryOpNode):
+        func, operand = self.operators(node).get_unary_func(node.operator), self.bind(node.operand)
+
+        def _unary_op(row):
+            return func(operand(row))
+        return _unary_op
+
+    def visit_SliceNode(self, node: SliceNode):
+        start, stop, step = self.bind(node.start), self.bind(node.stop), self.bind(node.step)
+
+        def _slice(row):
+            return slice(start(row), stop(row), step(row))
+        return _slice
+
+    def visit_AttributionNode(self, node: AttributionNode):
+        getter, obj = attrgetter('.'.join(node.properties)), self.bind(node.obj)
+
+        def _attribution(row):
+            return getter(obj(row))
+        return _attribution
+
+    def visit_TupleNode(self, node: TupleNode):
+        args = [self.bind(arg) for arg in node.args]
+
+        def _tuple(row):
+            return tuple([arg(row) for arg in args])
+        return _tuple
+
+    def visit_ListNode(self, node: ListNode):
+        args = [self.bind(arg) for arg in node.args]
+
+        def _list(row):
+            return [arg(row) for arg in args]
+        return _list
+
+    def visit_ItemNode(self, node: ItemNode):
+        obj, slice_obj = self.bind(node.obj), self.bind(node.slice_obj)
+
+        def _item(row):
+            return getitem(obj(row), slice_obj(row))
+        return _item
+
+    def visit_FunctionCallNode(self, node: FunctionCallNode):
+        args = [self.bind(arg) for arg in node.args.args]
+        kwargs = [(k, self.bind(v)) for k, v in node.kwargs.kwargs.items()]
+        func_node = node.func
+        if isinstance(func_node, IdentifierNode):
+            name, functions = func_node.name, self.functions(func_node)
+            if (self.slots is None and not functions.has_func(name)
+                    and not (isinstance(self.shadowable, frozenset) and name in self.shadowable)):
+                # 被调用的名称须已注册, 或明确声明由上下文给出
+                raise KeyError(f'函数不存在"{name}"')
+            if self.key(func_node) is None:
+                return self.call(name, functions.get_func(name), functions.is_lazy(name), args, kwargs)
+
+        # 被调用的对象由行决定
+        func = self.bind(func_node)
+
+        def _call(row):
+            return func(row)(*[arg(row) for arg in args], **{k: v(row) for k, v in kwargs})
+        return _call
+
+    def call(self, name: str, func: Callable, lazy: bool, args: List[Callable], kwargs: List[Tuple[str, Callable]]):
+        """调用已注册的函数"""
+        if self.shadowed((name,)):
+            # 上下文中的同名变量覆盖函数时按普通函数调用
+            if lazy:
+                def _call(context):
+                    if name in context:
+                        return context[name](*[arg(context) for arg in args], **{k: v(context) for k, v in kwargs})
+                    return func(*[partial(arg, context) for arg in args],
+                                **{k: partial(v, context) for k, v in kwargs})
+            elif kwargs:
+                def _call(context):
+                    return (context[name] if name in context else func)(
+                        *[arg(context) for arg in args], **{k: v(context) for k, v in kwargs}
+                    )
+            elif len(args) == 1:
+                arg0, = args
+
+                def _call(context):
+                    return (context[name] if name in context else func)(arg0(context))
+            elif len(args) == 2:
+                arg0, arg1 = args
+
+                def _call(context):
+                    return (context[name] if name in context else func)(arg0(context), arg1(context))
+            else:
+                def _call(context):
+                    return (context[name] if name in context else func)(*[arg(context) for arg in args])
+            return _call
+
+        if lazy:
+            def _lazy_call(row):
+                return func(*[partial(arg, row) for arg in args], **{k: partial(v, row) for k, v in kwargs})
+            return _lazy_call
+        if kwargs:
+            def _call(row):
+                return func(*[arg(row) for arg in args], **{k: v(row) for k, v in kwargs})
+        elif len(args) == 1:
+            arg0, = args
+
+            def _call(row):
+                return func(arg0(row))
+        elif len(args) == 2:
+            arg0, arg1 = args
+
+            def _call(row):
+                return func(arg0(row), arg1(row))
+        else:
+            def _call(row):
+                return func(*[arg(row) for arg in args])
+        return _call
+
+    def visit_SharedNode(self, node: SharedNode):
+        inner, key, get_values = self.bind(node.node), id(node), _shared_values.get
+
+        def _shared(row):
+            values = get_values()
+            if values is None:
+                return inner(row)
+            if key in values:
+                return values[key]
+            value = inner(row)
+            if type(value) in _SHAREABLE_TYPES:
+                values[key] = value
+            return value
+        return _shared
+
+    def visit_CSENode(self, node: CSENode):
+        if self.overridden(node.names):
+            return self.bind(node.original)
+        body, set_values, reset_values = self.bind(node.body), _shared_values.set, _shared_values.reset
+
+        def _cse(row):
+            token = set_values({})
+            try:
+                return body(row)
+            finally:
+                reset_values(token)
+
+        names = self.shadowed(node.names)
+        if not names:
+            return _cse
+        original = self.bind(node.original)
+
+        def _checked_cse(context):
+            for name in names:
+                if name in context:
+                    return original(context)
+            return _cse(context)
+        return _checked_cse
@@ -0,0 +1,118 @@
+"""公式目录文件
+
+将大量命名公式的序列化结果写入一个文件, 通过mmap打开后按名称二分查找, 只解码被访问的公式。
+文件格式（小端序）:
+    头部: 魔数b'FPCAT1\0\0' | 公式数(u32) | 保留(u32) | 索引偏移(u64)
+    各公式的dumps结果及名称(utf-8)依次存放
+    索引: 按名称字节序排列的定长记录 名称偏移(u64) | 名称长度(u32) | 数据偏移(u64) | 数据长度(u32)
+"""
+import mmap
+import struct
+from typing import Any, Iterator, Mapping, Tuple, Union
+from formulaparser.ast_nodes import ASTNode
+from formulaparser.compact import CompactAST
+
+MAGIC = b'FPCAT1\0\0'
+_HEADER = struct.Struct('<8sIIQ')
+_RECORD = struct.Struct('<QIQI')
+_KEY = struct.Struct('<QI')
+
+
+def write_catalog(path, formulas: Mapping[str, ASTNode]):
+    """将命名公式写入目录文件"""
+    items = sorted((name.encode('utf-8'), ast.dumps()) for name, ast in formulas.items())
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(items), 0, 0))
+        records = []
+        for key, data in items:
+            data_offset = f.tell()
+            f.write(data)
+            key_offset = f.tell()
+            f.write(key)
+            records.append(_RECORD.pack(key_offset, len(key), data_offset, len(data)))
+        index_offset = f.tell()
+        f.write(b''.join(records))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(items), 0, index_offset))
+
+
+class Catalog:
+    """以mmap打开的公式目录, 按名称延迟解码公式"""
+
+    def __init__(self, path, parser):
+        self.parser = parser
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'无法识别的目录文件：{path}')
+        if len(self._mmap) < _HEADER.size or self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'无法识别的目录文件：{path}')
+        _, self._count, _, self._index_offset = _HEADER.unpack_from(self._mmap)
+        if self._index_offset + self._count * _RECORD.size > len(self._mmap):
+            self.close()
+            raise ValueError(f'目录文件不完整：{path}')
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _record(self, i: int) -> Tuple[int, int, int, int]:
+        return _RECORD.unpack_from(self._mmap, self._index_offset + i * _RECORD.size)
+
+    def _key(self, i: int) -> bytes:
+        key_offset, key_len = _KEY.unpack_from(self._mmap, self._index_offset + i * _RECORD.size)
+        return self._mmap[key_offset:key_offset + key_len]
+
+    def _find(self, name: str) -> Union[int, None]:
+        key, lo, hi = name.encode('utf-8'), 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key(lo) == key:
+            return lo
+        return None
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def keys(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self._key(i).decode('utf-8')
+
+    def load_compact(self, name: str) -> CompactAST:
+        """读取并解码指定名称的公式, 返回紧凑表示"""
+        i = self._find(name)
+        if i is None:
+            raise KeyError(f'目录中不存在公式：{name}')
+        _, _, data_offset, data_len = self._record(i)
+        registry = self.parser.snapshot()
+        return CompactAST.loads(self._mmap[data_offset:data_offset + data_len],
+                                registry.operators, registry.functions)
+
+    def __getitem__(self, name: str) -> ASTNode:
+        return self.load_compact(name).to_ast()
+
+    def get(self, name: str, default: Any = None) -> Any:
+        if self._find(name) is None:
+            return default
+        return self[name]
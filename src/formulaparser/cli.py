@@ -0,0 +1,328 @@
+"""命令行: 对CSV或JSON Lines数据流逐行计算公式
+
+用法: python -m formulaparser -f 'total=price * qty' -f 'tax=total * 0.1' data.csv -o out.csv
+
+输入按块读取、求值并写出, 内存占用与数据量无关。公式按给出的顺序求值, 后面的公式可以引用前面公式的结果;
+未命名的公式以公式文本作为列名。结束时向标准错误输出吞吐量统计。
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import re
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+from formulaparser.ast_nodes import ASTNode
+from formulaparser.parser import Parser
+
+# 命名公式 name=formula, 排除 == 运算符
+_NAMED_FORMULA = re.compile(r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(?!=)(.*)', re.S)
+_INT = re.compile(r'[+-]?\d+')
+
+
+def _to_bool(value: str) -> bool:
+    lowered = value.strip().lower()
+    if lowered in ('1', 'true', 'yes', 'y', 't'):
+        return True
+    if lowered in ('0', 'false', 'no', 'n', 'f', ''):
+        return False
+    raise ValueError(f'无法转换为bool：{value!r}')
+
+
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    'int': int, 'float': float, 'str': str, 'bool': _to_bool, 'json': json.loads,
+}
+
+
+def _auto(value: Any) -> Any:
+    """CSV中的字符串依次尝试转换为整数、浮点数, 空字符串转换为None"""
+    if not isinstance(value, str):
+        return value
+    if not value:
+        return None
+    if _INT.fullmatch(value):
+        return int(value)
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_formula_option(text: str) -> Tuple[str, str]:
+    """解析 name=formula, 未命名时以公式文本作为名称"""
+    m = _NAMED_FORMULA.fullmatch(text)
+    if m:
+        return m.group(1), m.group(2).strip()
+    return text.strip(), text
+
+
+def parse_type_option(text: str) -> Tuple[str, str]:
+    name, sep, type_name = text.partition('=')
+    if not sep or type_name not in _CONVERTERS:
+        raise argparse.ArgumentTypeError(f'类型格式应为 列名=类型, 类型为{"/".join(_CONVERTERS)}：{text}')
+    return name.strip(), type_name
+
+
+class _ChunkEvaluator:
+    """对一块数据逐行求值并格式化为输出文本, 返回(文本, 输出行数, 跳过行数, 出错行数)
+
+    多进程时在工作进程中执行, 主进程只负责读取输入及写出文本
+    """
+
+    def __init__(self, formulas: List[Tuple[str, ASTNode]], types: Dict[str, str], auto: bool, on_error: str,
+                 keep_input: bool, header: Union[List[str], None], output_fields: Union[List[str], None]):
+        self.formulas = [(name, ast.compile()) for name, ast in formulas]
+        self.converters = {name: _CONVERTERS[type_name] for name, type_name in types.items()}
+        self.auto = auto
+        self.on_error = on_error
+        self.keep_input = keep_input
+        # CSV输入的表头, 每行为值的列表
+        self.header = header
+        # 输出CSV的列, 为None时输出JSON Lines
+        self.output_fields = output_fields
+
+    @staticmethod
+    def _fail(e: Exception, line: int, name: Union[str, None] = None):
+        e.add_note(f'位置：第{line}行' + (f'，公式：{name}' if name else ''))
+        e.row = line
+        raise e
+
+    def _evaluate(self, line: int,
+                  row: Union[List[str], Dict[str, Any], Exception]) -> Tuple[Union[Dict[str, Any], None], bool]:
+        """返回(输出行, 是否出错), 出错时按策略抛出异常、跳过该行(输出行为None)或将出错的结果置为None"""
+        if isinstance(row, Exception):
+            # 无法解码的输入行没有可输出的列, null策略下同样跳过
+            if self.on_error == 'fail':
+                self._fail(row, line)
+            return None, True
+        if self.header is not None:
+            row = dict(zip(self.header, row + [None] * (len(self.header) - len(row))))
+        context, failed = dict(row), False
+        if self.auto:
+            for k, v in context.items():
+                context[k] = _auto(v)
+        for k, convert in self.converters.items():
+            if k in context:
+                try:
+                    context[k] = convert(context[k])
+                except Exception as e:
+                    if self.on_error == 'fail':
+                        self._fail(e, line)
+                    if self.on_error == 'skip':
+                        return None, True
+                    context[k], failed = None, True
+
+        out = row if self.keep_input else {}
+        for name, func in self.formulas:
+            try:
+                value = func(context)
+            except Exception as e:
+                if self.on_error == 'fail':
+                    self._fail(e, line, name)
+                if self.on_error == 'skip':
+                    return None, True
+                value, failed = None, True
+            context[name] = out[name] = value
+        return out, failed
+
+    def __call__(self, chunk: List[Tuple[int, Any]]) -> Tuple[str, int, int, int]:
+        buffer = io.StringIO()
+        if self.output_fields is not None:
+            write = csv.DictWriter(buffer, self.output_fields, extrasaction='ignore', restval='').writerow
+        else:
+            def write(row):
+                buffer.write(json.dumps(row, ensure_ascii=False, default=str))
+                buffer.write('\n')
+
+        written = skipped = errors = 0
+        for line, row in chunk:
+            out, failed = self._evaluate(line, row)
+            errors += failed
+            if out is None:
+                skipped += 1
+            else:
+                write(out)
+                written += 1
+        return buffer.getvalue(), written, skipped, errors
+
+
+_worker_evaluator: Union[_ChunkEvaluator, None] = None
+
+
+def _init_worker(*args):
+    global _worker_evaluator
+    _worker_evaluator = _ChunkEvaluator(*args)
+
+
+def _evaluate_chunk(chunk):
+    return _worker_evaluator(chunk)
+
+
+def _read_csv(stream) -> Tuple[List[str], Iterator[Tuple[int, List[str]]]]:
+    """返回表头及(行号, 值列表)的迭代器, 跳过空行"""
+    reader = csv.reader(stream)
+    header = next(reader, [])
+    return header, ((reader.line_num, values) for values in reader if values)
+
+
+def _read_jsonl(stream) -> Iterator[Tuple[int, Union[Dict[str, Any], Exception]]]:
+    """返回(行号, 对象)的迭代器, 无法解码的行为异常对象, 跳过空行"""
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+            if not isinstance(row, dict):
+                raise ValueError(f'不是JSON对象：{text.strip()[:50]}')
+        except ValueError as e:
+            row = e
+        yield line, row
+
+
+def _peek_fields(rows: Iterator[Tuple[int, Any]]) -> Tuple[List[str], Iterator[Tuple[int, Any]]]:
+    """JSON Lines输出为CSV时以第一个对象的键作为表头"""
+    head = []
+    for item in rows:
+        head.append(item)
+        if isinstance(item[1], dict):
+            return list(item[1]), chain(head, rows)
+    return [], iter(head)
+
+
+def _chunks(rows: Iterator, size: int) -> Iterator[List]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _evaluate_parallel(chunks: Iterator[List], workers: int, init_args: tuple) -> Iterator[tuple]:
+    """多进程求值, 按输入顺序产出结果, 同时提交的块数有上限以保持内存占用恒定"""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=init_args) as pool:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(pool.submit(_evaluate_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def _arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(
+        prog='python -m formulaparser', description='对CSV或JSON Lines数据逐行计算公式, 流式写出结果列')
+    arg_parser.add_argument('input', nargs='?', default='-', help='输入文件, 默认或为-时读取标准输入')
+    arg_parser.add_argument('-f', '--formula', action='append', required=True, type=parse_formula_option,
+                            help='name=formula形式的公式, 可重复给出, 后面的公式可引用前面的结果')
+    arg_parser.add_argument('-o', '--output', default='-', help='输出文件, 默认或为-时写入标准输出')
+    arg_parser.add_argument('--format', choices=('csv', 'jsonl'), help='输入格式, 默认按扩展名判断, 否则为csv')
+    arg_parser.add_argument('--output-format', choices=('csv', 'jsonl'), help='输出格式, 默认与输入相同')
+    arg_parser.add_argument('--encoding', default='utf-8', help='输入输出的编码, 默认utf-8')
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help='每块的行数, 默认1000')
+    arg_parser.add_argument('--type', action='append', default=[], type=parse_type_option, dest='types',
+                            help=f'列名=类型, 类型为{"/".join(_CONVERTERS)}, 可重复给出')
+    arg_parser.add_argument('--coerce', choices=('auto', 'none'), default='auto',
+                            help='auto时CSV的值依次尝试转换为整数、浮点数, 空值转换为None; 默认auto')
+    arg_parser.add_argument('--on-error', choices=('fail', 'skip', 'null'), default='fail',
+                            help='求值或类型转换出错时终止(fail)、跳过该行(skip)或将出错的值置为空(null), 默认fail')
+    arg_parser.add_argument('--workers', type=int, default=1, help='并行的进程数, 默认1')
+    arg_parser.add_argument('--drop-input', action='store_true', help='只输出公式结果列')
+    arg_parser.add_argument('--quiet', action='store_true', help='不输出统计信息')
+    return arg_parser
+
+
+@contextmanager
+def _open(path: str, mode: str, encoding: str, std):
+    """打开文件, path为-时使用标准输入输出且不关闭它"""
+    if path != '-':
+        with open(path, mode, encoding=encoding, newline='') as stream:
+            yield stream
+    elif not hasattr(std, 'buffer'):
+        yield std
+    else:
+        stream = io.TextIOWrapper(std.buffer, encoding=encoding, newline='')
+        try:
+            yield stream
+        finally:
+            if mode == 'w':
+                stream.flush()
+            stream.detach()
+
+
+def main(argv: Union[List[str], None] = None) -> int:
+    arg_parser = _arg_parser()
+    args = arg_parser.parse_args(argv)
+    if args.chunk_size < 1:
+        arg_parser.error(f'块大小不能小于1：{args.chunk_size}')
+    if args.workers < 1:
+        arg_parser.error(f'进程数不能小于1：{args.workers}')
+    fmt = args.format or ('jsonl' if args.input.endswith(('.jsonl', '.ndjson')) else 'csv')
+    output_fmt = args.output_format or fmt
+
+    parser = Parser()
+    try:
+        formulas = [(name, parser.parse(text)) for name, text in args.formula]
+    except (ValueError, KeyError) as e:
+        print(f'公式解析失败：{e}', file=sys.stderr)
+        return 2
+    names = [name for name, _ in formulas]
+    keep_input = not args.drop_input
+
+    n_read = n_written = n_skipped = n_errors = 0
+    start = time.perf_counter()
+    try:
+        with _open(args.input, 'r', args.encoding, sys.stdin) as stream_in, \
+                _open(args.output, 'w', args.encoding, sys.stdout) as stream_out:
+            if fmt == 'csv':
+                header, rows = _read_csv(stream_in)
+                input_fields = header
+            else:
+                header, rows = None, _read_jsonl(stream_in)
+                input_fields, rows = _peek_fields(rows) if keep_input and output_fmt == 'csv' else ([], rows)
+            output_fields = None
+            if output_fmt == 'csv':
+                output_fields = ([k for k in input_fields if k not in names] if keep_input else []) + names
+                csv.writer(stream_out).writerow(output_fields)
+            init_args = (formulas, dict(args.types), args.coerce == 'auto' and fmt == 'csv', args.on_error,
+                         keep_input, header, output_fields)
+
+            def counted(chunks):
+                nonlocal n_read
+                for chunk in chunks:
+                    n_read += len(chunk)
+                    yield chunk
+            chunks = counted(_chunks(rows, args.chunk_size))
+            if args.workers > 1:
+                results = _evaluate_parallel(chunks, args.workers, init_args)
+            else:
+                results = map(_ChunkEvaluator(*init_args), chunks)
+            for text, written, skipped, errors in results:
+                stream_out.write(text)
+                stream_out.flush()
+                n_written += written
+                n_skipped += skipped
+                n_errors += errors
+    except Exception as e:
+        print(f'求值失败：{type(e).__name__}: {e}', file=sys.stderr)
+        for note in getattr(e, '__notes__', ()):
+            print(note, file=sys.stderr)
+        return 1
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - start
+        print(f'读取{n_read}行, 输出{n_written}行, 跳过{n_skipped}行, 出错{n_errors}行, 耗时{elapsed:.3f}秒, '
+              f'{n_read / elapsed if elapsed > 0 else 0:.0f}行/秒', file=sys.stderr)
+    return 0
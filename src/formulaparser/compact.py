@@ -0,0 +1,452 @@
+"""紧凑的语法树表示
+
+CompactAST将整棵语法树展平为一个整数array指令数组及一个常量池:
+每个节点按后序依次占据[操作码, 操作数个数, 操作数...], 节点以其在数组中的位置标识, 操作数为子节点位置或常量池下标。
+运算符及函数管理器只在整棵树上保存一份, 相同的节点对象（如同名标识符、公共子表达式）只保存一次。
+
+dumps/loads使用稳定的二进制格式（小端序）, 运算符和函数只保存名称, 加载时绑定到加载方的管理器:
+    魔数b'FPA1' | 整数类型码(1字节) | 根节点位置(u32) | 指令数(u32) | 指令数组 | 常量数(u32) | 带类型标记的常量...
+"""
+import sys
+import struct
+from array import array
+from functools import partial
+from typing import Any, Dict, List, Tuple, Union
+from formulaparser.func_manager import FunctionManager
+from formulaparser.op_manager import OperatorManager
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, ArgsNode, KwargsNode, FunctionCallNode, SharedNode, CSENode,
+    render_tree, _SHAREABLE_TYPES
+)
+
+(
+    NUMBER, STRING, NONE, CONSTANT, BINARY_OP, UNARY_OP, IDENTIFIER, SLICE, ATTRIBUTION, TUPLE, LIST, ITEM,
+    FUNCTION_CALL, SHARED, CSE
+) = range(15)
+
+MAGIC = b'FPA1'
+_HEADER = struct.Struct('<4scII')
+_U32 = struct.Struct('<I')
+_FLOAT = struct.Struct('<d')
+_COMPLEX = struct.Struct('<dd')
+# 常量的类型标记
+_STR, _INT, _BYTES, _TUPLE, _FROZENSET = b'sibtz'
+_FLOAT_TAG, _COMPLEX_TAG, _SLICE, _RANGE = b'fcSr'
+_SIZED_TAGS = {_STR, _INT, _BYTES, _TUPLE, _FROZENSET}
+_SINGLETONS = {ord('N'): None, ord('T'): True, ord('F'): False}
+
+
+def _dump_value(value: Any, out: bytearray):
+    """按类型标记写入常量池中的值"""
+    if value is None or value is True or value is False:
+        out += {None: b'N', True: b'T', False: b'F'}[value]
+    elif type(value) is int:
+        data = value.to_bytes((value.bit_length() + 8) // 8, 'little', signed=True)
+        out += b'i' + _U32.pack(len(data)) + data
+    elif type(value) is float:
+        out += b'f' + _FLOAT.pack(value)
+    elif type(value) is complex:
+        out += b'c' + _COMPLEX.pack(value.real, value.imag)
+    elif type(value) in (str, bytes):
+        data = value.encode('utf-8', 'surrogatepass') if type(value) is str else value
+        out += (b's' if type(value) is str else b'b') + _U32.pack(len(data)) + data
+    elif type(value) in (tuple, frozenset):
+        out += (b't' if type(value) is tuple else b'z') + _U32.pack(len(value))
+        for item in value:
+            _dump_value(item, out)
+    elif type(value) in (slice, range):
+        out += b'S' if type(value) is slice else b'r'
+        for item in (value.start, value.stop, value.step):
+            _dump_value(item, out)
+    else:
+        raise ValueError(f'无法序列化的常量类型：{type(value).__name__}')
+
+
+def _load_value(data, offset: int) -> Tuple[Any, int]:
+    tag, offset = data[offset], offset + 1
+    if tag in _SIZED_TAGS:
+        size, offset = _U32.unpack_from(data, offset)[0], offset + _U32.size
+        end = offset + size
+        if tag == _STR:
+            return str(data[offset:end], 'utf-8', 'surrogatepass'), end
+        if tag == _INT:
+            return int.from_bytes(data[offset:end], 'little', signed=True), end
+        if tag == _BYTES:
+            return bytes(data[offset:end]), end
+        items = []
+        for _ in range(size):
+            item, offset = _load_value(data, offset)
+            items.append(item)
+        return (tuple if tag == _TUPLE else frozenset)(items), offset
+    if tag == _FLOAT_TAG:
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag in _SINGLETONS:
+        return _SINGLETONS[tag], offset
+    if tag == _COMPLEX_TAG:
+        return complex(*_COMPLEX.unpack_from(data, offset)), offset + _COMPLEX.size
+    if tag in (_SLICE, _RANGE):
+        items = []
+        for _ in range(3):
+            item, offset = _load_value(data, offset)
+            items.append(item)
+        return (slice if tag == _SLICE else range)(*items), offset
+    raise ValueError(f'无法识别的常量类型标记：{bytes([tag])!r}，位置：{offset - 1}')
+
+
+def _parts(node: ASTNode) -> List[ASTNode]:
+    """节点的所有子节点, 包括常量节点及CSENode保存的原语法树"""
+    if isinstance(node, BinaryOpNode):
+        return [node.left, node.right]
+    if isinstance(node, UnaryOpNode):
+        return [node.operand]
+    if isinstance(node, SliceNode):
+        return [node.start, node.stop, node.step]
+    if isinstance(node, AttributionNode):
+        return [node.obj]
+    if isinstance(node, ItemNode):
+        return [node.obj, node.slice_obj]
+    if isinstance(node, (TupleNode, ListNode)):
+        return node.args
+    if isinstance(node, FunctionCallNode):
+        return [node.func, *node.args.args, *node.kwargs.kwargs.values()]
+    if isinstance(node, SharedNode):
+        return [node.node]
+    if isinstance(node, CSENode):
+        return [node.body, node.original]
+    if isinstance(node, ConstantNode) and node.original is not None:
+        return [node.original]
+    if isinstance(node, (NumberNode, StringNode, NoneNode, ConstantNode, IdentifierNode)):
+        return []
+    raise ValueError(f'不支持的节点类型：{type(node).__name__}')
+
+
+class _Encoder:
+    """将语法树按后序写入指令数组"""
+
+    def __init__(self):
+        self.code: List[int] = []
+        self.pool: List[Any] = []
+        self._pool_index: Dict[Any, int] = {}
+        self.op_mgr: Union[OperatorManager, None] = None
+        self.func_mgr: Union[FunctionManager, None] = None
+
+    def constant(self, value: Any) -> int:
+        # 仅合并类型与取值都相同的字符串、整数及字符串元组, 避免1、1.0、True或0.0、-0.0被视为同一常量
+        if type(value) in (str, int) or (type(value) is tuple and all(type(v) is str for v in value)):
+            key = (type(value), value)
+            if key not in self._pool_index:
+                self._pool_index[key] = len(self.pool)
+                self.pool.append(value)
+            return self._pool_index[key]
+        self.pool.append(value)
+        return len(self.pool) - 1
+
+    def manager(self, attr: str, mgr):
+        current = getattr(self, attr)
+        if current is None:
+            setattr(self, attr, mgr)
+        elif current is not mgr:
+            raise ValueError('语法树包含来自不同注册表的节点')
+
+    def encode(self, root: ASTNode) -> int:
+        positions: Dict[int, int] = {}
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in positions:
+                continue
+            if expanded:
+                positions[id(node)] = self.emit(node, positions)
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(_parts(node)) if id(child) not in positions)
+        return positions[id(root)]
+
+    def emit(self, node: ASTNode, positions: Dict[int, int]) -> int:
+        children = [positions[id(child)] for child in _parts(node)]
+        if isinstance(node, NumberNode):
+            opcode, operands = NUMBER, [self.constant(node.value)]
+        elif isinstance(node, StringNode):
+            opcode, operands = STRING, [self.constant(node.value)]
+        elif isinstance(node, NoneNode):
+            opcode, operands = NONE, []
+        elif isinstance(node, ConstantNode):
+            opcode, operands = CONSTANT, [self.constant(node.value), self.constant(tuple(node.names)), *children]
+        elif isinstance(node, BinaryOpNode):
+            self.manager('op_mgr', node.op_mgr)
+            opcode, operands = BINARY_OP, [self.constant(node.operator), *children]
+        elif isinstance(node, UnaryOpNode):
+            self.manager('op_mgr', node.op_mgr)
+            opcode, operands = UNARY_OP, [self.constant(node.operator), *children]
+        elif isinstance(node, IdentifierNode):
+            self.manager('func_mgr', node.func_mgr)
+            opcode, operands = IDENTIFIER, [self.constant(node.name)]
+        elif isinstance(node, SliceNode):
+            opcode, operands = SLICE, children
+        elif isinstance(node, AttributionNode):
+            opcode, operands = ATTRIBUTION, [*children, self.constant(tuple(node.properties))]
+        elif isinstance(node, TupleNode):
+            opcode, operands = TUPLE, children
+        elif isinstance(node, ListNode):
+            opcode, operands = LIST, children
+        elif isinstance(node, ItemNode):
+            opcode, operands = ITEM, children
+        elif isinstance(node, FunctionCallNode):
+            n_args = len(node.args.args)
+            kwargs = [self.constant(tuple(node.kwargs.kwargs))]
+            opcode, operands = FUNCTION_CALL, [*kwargs, n_args, *children]
+        elif isinstance(node, SharedNode):
+            opcode, operands = SHARED, children
+        else:
+            opcode, operands = CSE, [*children, self.constant(tuple(node.names)), node.deduplicated]
+
+        position = len(self.code)
+        self.code.append(opcode)
+        self.code.append(len(operands))
+        self.code.extend(operands)
+        return position
+
+
+class CompactAST:
+    """展平为指令数组及常量池的语法树, 求值结果与原语法树一致"""
+    __slots__ = ('code', 'pool', 'root', 'op_mgr', 'func_mgr')
+
+    def __init__(self, code: array, pool: Tuple[Any, ...], root: int,
+                 op_mgr: Union[OperatorManager, None] = None, func_mgr: Union[FunctionManager, None] = None):
+        self.code = code
+        self.pool = pool
+        self.root = root
+        self.op_mgr = op_mgr
+        self.func_mgr = func_mgr
+
+    @classmethod
+    def from_ast(cls, node: ASTNode) -> 'CompactAST':
+        encoder = _Encoder()
+        root = encoder.encode(node)
+        # 选择能容纳所有操作数的最小整数类型
+        bound = max(map(abs, encoder.code), default=0)
+        typecode = 'b' if bound < 2 ** 7 else 'h' if bound < 2 ** 15 else 'i'
+        return cls(array(typecode, encoder.code), tuple(encoder.pool), root, encoder.op_mgr, encoder.func_mgr)
+
+    def dumps(self) -> bytes:
+        """序列化为二进制格式, 运算符及函数只保存名称"""
+        code = array(self.code.typecode, self.code)
+        if sys.byteorder == 'big':
+            code.byteswap()
+        out = bytearray(_HEADER.pack(MAGIC, self.code.typecode.encode(), self.root, len(code)))
+        out += code.tobytes()
+        out += _U32.pack(len(self.pool))
+        for value in self.pool:
+            _dump_value(value, out)
+        return bytes(out)
+
+    @classmethod
+    def loads(cls, data, op_mgr: OperatorManager, func_mgr: FunctionManager) -> 'CompactAST':
+        """从dumps的结果加载, 运算符及函数绑定到给定的管理器"""
+        if len(data) < _HEADER.size or data[:len(MAGIC)] != MAGIC:
+            raise ValueError('无法识别的序列化格式')
+        try:
+            _, typecode, root, length = _HEADER.unpack_from(data)
+            typecode = typecode.decode()
+            if typecode not in ('b', 'h', 'i'):
+                raise ValueError(f'无法识别的整数类型码：{typecode}')
+            code = array(typecode)
+            offset = _HEADER.size + length * code.itemsize
+            code.frombytes(data[_HEADER.size:offset])
+            if len(code) != length:
+                raise ValueError('序列化数据不完整')
+            if sys.byteorder == 'big':
+                code.byteswap()
+            count, offset = _U32.unpack_from(data, offset)[0], offset + _U32.size
+            pool = []
+            for _ in range(count):
+                value, offset = _load_value(data, offset)
+                pool.append(value)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f'序列化数据不完整：{e}') from e
+        position, size = 0, len(code)
+        while position < size:
+            opcode = code[position]
+            if opcode == BINARY_OP and pool[code[position + 2]] not in op_mgr.binary_ops:
+                raise ValueError(f'未注册的双目运算符：{pool[code[position + 2]]}')
+            if opcode == UNARY_OP and pool[code[position + 2]] not in op_mgr.unary_ops:
+                raise ValueError(f'未注册的单目运算符：{pool[code[position + 2]]}')
+            position += 2 + code[position + 1]
+        compact = cls(code, tuple(pool), root, op_mgr, func_mgr)
+        return compact
+
+    def __len__(self) -> int:
+        """节点数"""
+        return sum(1 for _ in self._positions())
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)} nodes)'
+
+    def _positions(self):
+        code, position = self.code, 0
+        while position < len(code):
+            yield position
+            position += 2 + code[position + 1]
+
+    def _operands(self, position: int) -> array:
+        return self.code[position + 2:position + 2 + self.code[position + 1]]
+
+    def evaluate(self, context: Union[Dict[str, Any], None] = None) -> Any:
+        return self._evaluate(self.root, context, None)
+
+    def _evaluate(self, position: int, context: Union[Dict[str, Any], None], shared: Union[Dict[int, Any], None]) -> Any:
+        code, pool = self.code, self.pool
+        opcode = code[position]
+        ops = code[position + 2:position + 2 + code[position + 1]]
+        if opcode == IDENTIFIER:
+            name = pool[ops[0]]
+            if context and name in context:
+                return context[name]
+            elif self.func_mgr.has_func(name):
+                return self.func_mgr.get_func(name)
+            else:
+                raise KeyError(f'{name} not found')
+        if opcode == NUMBER or opcode == STRING:
+            return pool[ops[0]]
+        if opcode == BINARY_OP:
+            func = self.op_mgr.binary_funcs[pool[ops[0]]]
+            return func(self._evaluate(ops[1], context, shared), self._evaluate(ops[2], context, shared))
+        if opcode == FUNCTION_CALL:
+            names, n_args = pool[ops[0]], ops[1]
+            func = self._evaluate(ops[2], context, shared)
+            if code[ops[2]] == IDENTIFIER:
+                name = pool[code[ops[2] + 2]]
+                if self.func_mgr.is_lazy(name) and not (context and name in context):
+                    # 惰性函数的参数以thunk传入
+                    args = [partial(self._evaluate, arg, context, shared) for arg in ops[3:3 + n_args]]
+                    kwargs = {k: partial(self._evaluate, v, context, shared) for k, v in zip(names, ops[3 + n_args:])}
+                    return func(*args, **kwargs)
+            args = [self._evaluate(arg, context, shared) for arg in ops[3:3 + n_args]]
+            kwargs = {k: self._evaluate(v, context, shared) for k, v in zip(names, ops[3 + n_args:])}
+            return func(*args, **kwargs)
+        if opcode == UNARY_OP:
+            return self.op_mgr.unary_funcs[pool[ops[0]]](self._evaluate(ops[1], context, shared))
+        if opcode == NONE:
+            return None
+        if opcode == CONSTANT:
+            if context:
+                for name in pool[ops[1]]:
+                    if name in context:
+                        return self._evaluate(ops[2], context, shared)
+            return pool[ops[0]]
+        if opcode == ATTRIBUTION:
+            ans = self._evaluate(ops[0], context, shared)
+            for p in pool[ops[1]]:
+                ans = getattr(ans, p)
+            return ans
+        if opcode == TUPLE:
+            return tuple(self._evaluate(arg, context, shared) for arg in ops)
+        if opcode == LIST:
+            return [self._evaluate(arg, context, shared) for arg in ops]
+        if opcode == ITEM:
+            return self._evaluate(ops[0], context, shared)[self._evaluate(ops[1], context, shared)]
+        if opcode == SLICE:
+            return slice(*[self._evaluate(arg, context, shared) for arg in ops])
+        if opcode == SHARED:
+            if shared is None:
+                return self._evaluate(ops[0], context, shared)
+            if position in shared:
+                return shared[position]
+            value = self._evaluate(ops[0], context, shared)
+            if type(value) in _SHAREABLE_TYPES:
+                shared[position] = value
+            return value
+        # CSE
+        if context:
+            for name in pool[ops[2]]:
+                if name in context:
+                    return self._evaluate(ops[1], context, shared)
+        return self._evaluate(ops[0], context, {})
+
+    def _render_info(self, item: Union[int, Tuple[str, int]]) -> Tuple[str, Union[List[Any], Dict[str, Any]]]:
+        code, pool = self.code, self.pool
+        if isinstance(item, tuple):
+            # 函数调用的参数列表
+            kind, position = item
+            ops = self._operands(position)
+            n_args = ops[1]
+            if kind == 'args':
+                return 'Args', list(ops[3:3 + n_args])
+            return 'Kwargs', dict(zip(pool[ops[0]], ops[3 + n_args:]))
+
+        opcode, ops = code[item], self._operands(item)
+        if opcode in (NUMBER, STRING):
+            return f'{pool[ops[0]]!r}', []
+        if opcode == NONE:
+            return 'None', []
+        if opcode == CONSTANT:
+            return f'Const({pool[ops[0]]!r})', []
+        if opcode == BINARY_OP:
+            return f'BinaryOp({pool[ops[0]]})', [ops[1], ops[2]]
+        if opcode == UNARY_OP:
+            return f'UnaryOp({pool[ops[0]]})', [ops[1]]
+        if opcode == IDENTIFIER:
+            return f'ID({pool[ops[0]]})', []
+        if opcode == SLICE:
+            return 'Slice', list(ops)
+        if opcode == ATTRIBUTION:
+            return f'Attr({".".join(pool[ops[1]])})', [ops[0]]
+        if opcode == TUPLE:
+            return 'Tuple', list(ops)
+        if opcode == LIST:
+            return 'List', list(ops)
+        if opcode == ITEM:
+            return 'Item', list(ops)
+        if opcode == FUNCTION_CALL:
+            return 'Function', [ops[2], ('args', item), ('kwargs', item)]
+        if opcode == SHARED:
+            return f'Shared@{item:x}', [ops[0]]
+        return f'CSE(deduplicated={ops[3]})', [ops[0]]
+
+    def render(self) -> str:
+        return render_tree(self.root, self._render_info)
+
+    def to_ast(self) -> ASTNode:
+        """转换回语法树节点, 共用的节点转换后仍为同一对象"""
+        code, pool, nodes = self.code, self.pool, {}
+        position, size = 0, len(code)
+        while position < size:
+            opcode, start = code[position], position + 2
+            end = start + code[position + 1]
+            if opcode == IDENTIFIER:
+                node = IdentifierNode(self.func_mgr, pool[code[start]])
+            elif opcode == NUMBER:
+                node = NumberNode(pool[code[start]])
+            elif opcode == BINARY_OP:
+                node = BinaryOpNode(self.op_mgr, pool[code[start]], nodes[code[start + 1]], nodes[code[start + 2]])
+            elif opcode == FUNCTION_CALL:
+                n_args = code[start + 1]
+                args = ArgsNode([nodes[op] for op in code[start + 3:start + 3 + n_args]])
+                kwargs = KwargsNode({k: nodes[op] for k, op in zip(pool[code[start]], code[start + 3 + n_args:end])})
+                node = FunctionCallNode(nodes[code[start + 2]], args, kwargs)
+            elif opcode == STRING:
+                node = StringNode(pool[code[start]])
+            elif opcode == UNARY_OP:
+                node = UnaryOpNode(self.op_mgr, pool[code[start]], nodes[code[start + 1]])
+            elif opcode == ATTRIBUTION:
+                node = AttributionNode(nodes[code[start]], list(pool[code[start + 1]]))
+            elif opcode == ITEM:
+                node = ItemNode(nodes[code[start]], nodes[code[start + 1]])
+            elif opcode in (TUPLE, LIST):
+                args = [nodes[op] for op in code[start:end]]
+                node = TupleNode(args) if opcode == TUPLE else ListNode(args)
+            elif opcode == SLICE:
+                node = SliceNode(*[nodes[op] for op in code[start:end]])
+            elif opcode == NONE:
+                node = NoneNode()
+            elif opcode == CONSTANT:
+                original = nodes[code[start + 2]] if end - start > 2 else None
+                node = ConstantNode(pool[code[start]], pool[code[start + 1]], original)
+            elif opcode == SHARED:
+                node = SharedNode(nodes[code[start]])
+            else:
+                node = CSENode(nodes[code[start]], nodes[code[start + 1]], pool[code[start + 2]], code[start + 3])
+            nodes[position] = node
+            position = end
+        return nodes[self.root]
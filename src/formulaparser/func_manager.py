@@ -1,8 +1,92 @@
 import math
+import inspect
 import operator
-from typing import Callable
+from operator import attrgetter
+from threading import Lock
+from types import MappingProxyType
+from typing import Callable, FrozenSet, Mapping, NamedTuple, Union
+from formulaparser.memo import MemoizedFunction, MemoPolicy, MemoInfo
+
+
+# 惰性函数的参数为无参的thunk, 调用时才对相应的参数求值
+def if_(cond: Callable, then: Callable, otherwise: Union[Callable, None] = None):
+    """cond为真时返回then的值, 否则返回otherwise的值, 未给出otherwise时为None"""
+    if cond():
+        return then()
+    return otherwise() if otherwise is not None else None
+
+
+def and_then(first: Callable, *rest: Callable):
+    """同a and b: 返回第一个为假的值, 都为真时返回最后一个值"""
+    value = first()
+    for thunk in rest:
+        if not value:
+            return value
+        value = thunk()
+    return value
+
+
+def or_else(first: Callable, *rest: Callable):
+    """同a or b: 返回第一个为真的值, 都为假时返回最后一个值"""
+    value = first()
+    for thunk in rest:
+        if value:
+            return value
+        value = thunk()
+    return value
+
+
+def coalesce(*thunks: Callable):
+    """返回第一个不为None的值, 都为None时返回None"""
+    for thunk in thunks:
+        value = thunk()
+        if value is not None:
+            return value
+    return None
+
+
+class FunctionSnapshot(NamedTuple):
+    """函数注册表的只读快照, 之后注册的函数不会出现在快照中"""
+    functions: Mapping[str, Callable]
+    vectorized_functions: FrozenSet[str]
+    pure_functions: FrozenSet[str]
+    lazy_functions: FrozenSet[str]
+    version: int
+
+    def __reduce__(self):
+        # MappingProxyType不能序列化, 以普通字典重建
+        return _function_snapshot, (dict(self.functions), *self[1:])
+
+    def snapshot(self) -> 'FunctionSnapshot':
+        return self
+
+    def get_func(self, name: str) -> Callable:
+        if name in self.functions:
+            return self.functions[name]
+        else:
+            raise KeyError(f'函数不存在"{name}"')
+
+    def has_func(self, name: str):
+        return name in self.functions
+
+    def is_pure(self, name: str) -> bool:
+        return name in self.pure_functions
+
+    def is_lazy(self, name: str) -> bool:
+        return name in self.lazy_functions
+
+
+def _function_snapshot(functions: dict, *fields) -> FunctionSnapshot:
+    return FunctionSnapshot(MappingProxyType(functions), *fields)
+
 
 class FunctionManager:
+    """函数注册表
+
+    内容保存在不可变的FunctionSnapshot中, 注册时在锁内复制并整体替换（写时复制）,
+    读取时不加锁, 总是看到某次注册前或后的完整状态;
+    预定义函数组成的快照每个类只构建一次, 新建的实例直接共享, 注册自定义函数时才复制
+    """
 
     PREDEFINE_FUNCTIONS = {
         'add':         operator.add,          # 加法: a + b,
@@ -52,24 +136,99 @@ class FunctionManager:
         'sqrt':        math.sqrt,
 
     }
+    # 会修改参数的内置函数, 其余内置函数均为纯函数
+    PREDEFINE_IMPURE_FUNCTIONS = {'setitem', 'delitem'}
+    # 短路求值的内置惰性函数
+    PREDEFINE_LAZY_FUNCTIONS = {
+        'if_':         if_,                   # 条件: then if cond else otherwise,
+        'and_then':    and_then,              # 短路与: a and b,
+        'or_else':     or_else,               # 短路或: a or b,
+        'coalesce':    coalesce,              # 第一个不为None的值,
+    }
 
+    def __init__(self, snapshot: Union[FunctionSnapshot, None] = None):
+        # 仅串行化注册, 读取不加锁
+        self._lock = Lock()
+        self._snapshot = snapshot if snapshot is not None else self._predefined()
 
-    def __init__(self):
-        self.functions = {}
+    @classmethod
+    def _predefined(cls) -> FunctionSnapshot:
+        """由预定义函数组成的快照, 子类重新定义预定义函数时单独构建"""
+        snapshot = cls.__dict__.get('_predefined_snapshot')
+        if snapshot is None:
+            manager = cls(_function_snapshot({}, frozenset(), frozenset(), frozenset(), 0))
+            for name, func in cls.PREDEFINE_FUNCTIONS.items():
+                manager.register_func(name, func, pure=name not in cls.PREDEFINE_IMPURE_FUNCTIONS)
+            for name, func in cls.PREDEFINE_LAZY_FUNCTIONS.items():
+                manager.register_func(name, func, pure=True, lazy=True)
+            snapshot = cls._predefined_snapshot = manager.snapshot()
+        return snapshot
 
-        for name, func in self.PREDEFINE_FUNCTIONS.items():
-            self.register_func(name, func)
+    # 以下属性均读取当前快照, 需要多个属性彼此一致时应先取snapshot()
+    # 注册表版本号, 每次注册函数后递增, 用于判断解析缓存是否失效
+    version = property(attrgetter('_snapshot.version'))
+    functions = property(attrgetter('_snapshot.functions'))
+    # 注册时声明可直接作用于NumPy数组的自定义函数
+    vectorized_functions = property(attrgetter('_snapshot.vectorized_functions'))
+    # 注册时声明的纯函数（相同参数总是返回相同结果且无副作用）, 可用于常量折叠
+    pure_functions = property(attrgetter('_snapshot.pure_functions'))
+    # 注册时声明的惰性函数, 参数以thunk传入, 由函数决定是否及何时求值
+    lazy_functions = property(attrgetter('_snapshot.lazy_functions'))
 
-    def register_func(self, name: str, func: Callable):
-        if name in self.functions:
-            raise ValueError(f'函数"{name}"已存在')
-        self.functions[name] = func
+    def register_func(self, name: str, func: Callable, vectorized: bool = False, pure: bool = False,
+                      cache: Union[int, MemoPolicy, None] = None, lazy: bool = False):
+        if lazy and cache is not None:
+            raise ValueError(f'惰性函数不能缓存结果："{name}"')
+        if cache is not None:
+            if not pure:
+                raise ValueError(f'只有纯函数可以缓存结果："{name}"')
+            if inspect.iscoroutinefunction(func):
+                raise ValueError(f'协程函数不能缓存结果："{name}"')
+            func = MemoizedFunction(func, cache if isinstance(cache, MemoPolicy) else MemoPolicy(cache))
+        with self._lock:
+            current = self._snapshot
+            if name in current.functions:
+                raise ValueError(f'函数"{name}"已存在')
+            self._snapshot = current._replace(
+                functions=MappingProxyType({**current.functions, name: func}),
+                vectorized_functions=current.vectorized_functions | {name} if vectorized
+                else current.vectorized_functions,
+                pure_functions=current.pure_functions | {name} if pure else current.pure_functions,
+                lazy_functions=current.lazy_functions | {name} if lazy else current.lazy_functions,
+                version=current.version + 1,
+            )
+        # 注册表变化后已缓存的结果可能过时
+        self.clear_memo(stats=False)
 
     def get_func(self, name: str) -> Callable:
-        if name in self.functions:
-            return self.functions[name]
-        else:
-            raise KeyError(f'函数不存在"{name}"')
+        return self._snapshot.get_func(name)
 
     def has_func(self, name: str):
-        return name in self.functions
+        return name in self._snapshot.functions
+
+    def is_pure(self, name: str) -> bool:
+        return name in self._snapshot.pure_functions
+
+    def is_lazy(self, name: str) -> bool:
+        return name in self._snapshot.lazy_functions
+
+    def snapshot(self) -> FunctionSnapshot:
+        """当前注册表的快照, 注册表不变时总是返回同一个对象"""
+        return self._snapshot
+
+    def memo_info(self, name: str) -> MemoInfo:
+        func = self.get_func(name)
+        if not isinstance(func, MemoizedFunction):
+            raise ValueError(f'函数"{name}"未启用结果缓存')
+        return func.cache_info()
+
+    def clear_memo(self, name: Union[str, None] = None, stats: bool = True):
+        """清空name或所有函数的结果缓存, stats为True时同时清空统计"""
+        funcs = [self.get_func(name)] if name is not None else self.functions.values()
+        for func in funcs:
+            if not isinstance(func, MemoizedFunction):
+                continue
+            if stats:
+                func.cache_clear()
+            else:
+                func.invalidate()
@@ -0,0 +1,89 @@
+"""多个公式融合求值
+
+compile_many将多个公式合并为一棵语法树, 常量折叠后跨公式进行公共子表达式消除,
+各公式共有的子表达式（如revenue - cost、log(volume)）每次求值只计算一次。
+求值时所有变量通过一次itemgetter从上下文中读取, 每个变量只读取一次, 之后按位置求值（见formulaparser.bind）;
+上下文缺少变量或覆盖了公式中的函数时, 改为以编译的闭包求值, 结果及异常与对每个公式分别调用evaluate一致。
+"""
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Union
+from formulaparser.ast_nodes import ASTNode, TupleNode, IdentifierNode, ConstantNode, CSENode
+from formulaparser.bind import BoundFormula
+from formulaparser.optimizer import fold_constants, eliminate_common_subexpressions, _children
+
+
+def _identifiers(root: ASTNode) -> Tuple[Set[str], Set[str]]:
+    """返回语法树中的变量名及函数名（含被折叠及被共享的函数调用）"""
+    variables, functions = set(), set()
+    stack, visited = [root], {id(root)}
+    while stack:
+        node = stack.pop()
+        if isinstance(node, IdentifierNode):
+            (functions if node.func_mgr.has_func(node.name) else variables).add(node.name)
+        elif isinstance(node, (ConstantNode, CSENode)):
+            functions.update(node.names)
+        for child in _children(node):
+            if id(child) not in visited:
+                visited.add(id(child))
+                stack.append(child)
+    return variables, functions
+
+
+class FusedFormulas:
+    """融合求值的多个公式, 调用时返回{名称: 结果}, as_tuple为True时按名称顺序返回元组"""
+
+    def __init__(self, formulas: Dict[str, ASTNode], as_tuple: bool = False):
+        self.names: Tuple[str, ...] = tuple(formulas)
+        self.as_tuple = as_tuple
+        self.node, self.deduplicated = eliminate_common_subexpressions(
+            fold_constants(TupleNode(list(formulas.values())))
+        )
+        variables, functions = _identifiers(self.node)
+        self.variables: Tuple[str, ...] = tuple(sorted(variables))
+        self._functions = frozenset(functions)
+        self._bound = BoundFormula(self.node, self.variables)
+        self._compiled = self.node.compile()
+        self._read = self._reader(self.variables)
+
+    @staticmethod
+    def _reader(variables: Tuple[str, ...]) -> Callable[[Dict[str, Any]], Tuple]:
+        if len(variables) > 1:
+            return itemgetter(*variables)
+        if variables:
+            name, = variables
+
+            def _read(context):
+                return context[name],
+            return _read
+
+        def _empty(context):
+            return ()
+        return _empty
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({", ".join(self.names)})'
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __call__(self, context: Union[Dict[str, Any], None] = None) -> Union[Dict[str, Any], Tuple]:
+        if context is None:
+            context = {}
+        if self._functions and not context.keys().isdisjoint(self._functions):
+            # 上下文覆盖了函数
+            values = self._compiled(context)
+        else:
+            try:
+                row = self._read(context)
+            except KeyError:
+                # 缺少的变量可能位于未被选中的惰性参数中, 由闭包在用到时抛出异常
+                values = self._compiled(context)
+            else:
+                values = self._bound(row)
+        return values if self.as_tuple else dict(zip(self.names, values))
+
+    evaluate = __call__
+
+    def evaluate_many(self, contexts: Iterable[Dict[str, Any]]) -> List[Union[Dict[str, Any], Tuple]]:
+        """对多个上下文求值, 返回结果列表"""
+        return [self(context) for context in contexts]
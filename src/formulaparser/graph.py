@@ -0,0 +1,157 @@
+"""命名公式依赖图
+
+公式可以通过名称引用其他公式的结果, 按拓扑顺序求值, 输入变化时仅重新计算受影响的下游公式。
+"""
+from typing import Any, Dict, List, Set, Union
+from formulaparser.parser import Parser
+from formulaparser.ast_nodes import ASTNode
+from formulaparser.incremental import _names
+from formulaparser.memo import evaluation_scope
+
+
+class FormulaGraph:
+    """命名公式依赖图"""
+
+    def __init__(self, parser: Union[Parser, None] = None):
+        self.parser = parser or Parser()
+        self._formulas: Dict[str, ASTNode] = {}
+        self._compiled = {}
+        # 公式引用的名称, 以及引用每个名称的公式
+        self._deps: Dict[str, Set[str]] = {}
+        self._dependents: Dict[str, Set[str]] = {}
+        self._inputs: Dict[str, Any] = {}
+        # 公式求值的上下文, 包含输入及公式的结果
+        self._context: Dict[str, Any] = {}
+        self._dirty: Set[str] = set()
+        self._order: Union[List[str], None] = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._formulas
+
+    def __len__(self) -> int:
+        return len(self._formulas)
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._formulas:
+            raise KeyError(f'未定义的公式：{name}')
+        self.refresh()
+        return self._context[name]
+
+    def add(self, name: str, formula: Union[str, ASTNode]) -> ASTNode:
+        """添加或替换公式, 形成循环依赖时抛出ValueError"""
+        ast = self.parser.parse(formula) if isinstance(formula, str) else formula
+        deps = _names(ast)
+        cycle = self._find_cycle(name, deps)
+        if cycle:
+            raise ValueError(f'循环依赖：{" -> ".join(cycle)}')
+
+        if name in self._formulas:
+            self._unlink(name)
+        self._formulas[name] = ast
+        self._compiled[name] = ast.compile()
+        self._deps[name] = deps
+        for dep in deps:
+            self._dependents.setdefault(dep, set()).add(name)
+        self._order = None
+        self._mark(name)
+        return ast
+
+    def remove(self, name: str):
+        """删除公式, 引用它的公式改为读取同名输入"""
+        if name not in self._formulas:
+            raise KeyError(f'未定义的公式：{name}')
+        self._unlink(name)
+        del self._formulas[name], self._compiled[name]
+        self._dirty.discard(name)
+        self._order = None
+        if name in self._inputs:
+            self._context[name] = self._inputs[name]
+        else:
+            self._context.pop(name, None)
+        for dependent in self._dependents.get(name, ()):
+            self._mark(dependent)
+
+    def _unlink(self, name: str):
+        for dep in self._deps.pop(name):
+            self._dependents[dep].discard(name)
+
+    def _find_cycle(self, name: str, deps: Set[str]) -> Union[List[str], None]:
+        """从新公式的依赖向上游搜索, 返回经过name的循环路径"""
+        if name not in deps and not self._dependents.get(name):
+            return None
+        stack, parents = [dep for dep in deps], {dep: name for dep in deps}
+        while stack:
+            current = stack.pop()
+            if current == name:
+                path = [name]
+                current = parents[name]
+                while current != name:
+                    path.append(current)
+                    current = parents[current]
+                return [name] + path[:0:-1] + [name]
+            if current not in self._formulas:
+                continue
+            for dep in self._deps[current]:
+                if dep not in parents:
+                    parents[dep] = current
+                    stack.append(dep)
+        return None
+
+    def dependencies(self, name: str) -> Set[str]:
+        """公式直接引用的其他公式"""
+        return {dep for dep in self._deps[name] if dep in self._formulas}
+
+    @property
+    def order(self) -> List[str]:
+        """公式的拓扑顺序"""
+        if self._order is None:
+            formulas = self._formulas
+            indegree = {name: len(self.dependencies(name)) for name in formulas}
+            queue = [name for name, degree in indegree.items() if degree == 0]
+            for name in queue:
+                for dependent in self._dependents.get(name, ()):
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        queue.append(dependent)
+            self._order = queue
+        return self._order
+
+    def _mark(self, name: str):
+        stack = [name]
+        while stack:
+            name = stack.pop()
+            if name in self._formulas and name not in self._dirty:
+                self._dirty.add(name)
+                stack.extend(self._dependents.get(name, ()))
+
+    def refresh(self) -> Dict[str, Any]:
+        """按拓扑顺序重新计算待更新的公式, 返回重新计算的结果"""
+        if not self._dirty:
+            return {}
+        results = {}
+        context, dirty, compiled = self._context, self._dirty, self._compiled
+        # 出现异常时未完成的公式保持待计算状态; 同一次刷新的各公式共用scope='evaluation'的函数缓存
+        with evaluation_scope():
+            for name in [name for name in self.order if name in dirty]:
+                context[name] = results[name] = compiled[name](context)
+                dirty.discard(name)
+        return results
+
+    def update(self, values: Union[Dict[str, Any], None] = None, **kwargs) -> Dict[str, Any]:
+        """更新输入并重新计算受影响的公式, 返回重新计算的结果"""
+        changes = dict(values or {}, **kwargs)
+        for name in changes:
+            if name in self._formulas:
+                raise ValueError(f'不能将公式作为输入更新：{name}')
+        self._inputs.update(changes)
+        self._context.update(changes)
+        for name in changes:
+            for dependent in self._dependents.get(name, ()):
+                self._mark(dependent)
+        return self.refresh()
+
+    @property
+    def values(self) -> Dict[str, Any]:
+        """所有公式的当前结果"""
+        self.refresh()
+        return {name: self._context[name] for name in self._formulas}
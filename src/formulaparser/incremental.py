@@ -0,0 +1,234 @@
+"""增量求值
+
+缓存语法树中每个节点上一次的值, 更新变量时仅重新计算从该变量对应的标识符节点到根节点路径上的节点。
+调用未声明为纯函数的函数或运算符的节点每次更新都会重新计算。
+惰性函数的调用作为整体求值, 未被选中的参数不会计算。
+"""
+from operator import getitem, attrgetter
+from typing import Any, Dict, List, Callable, Union, Set
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, FunctionCallNode, SharedNode, CSENode
+)
+
+
+def _operands(node: ASTNode) -> List[ASTNode]:
+    """按求值顺序返回节点的操作数"""
+    if isinstance(node, BinaryOpNode):
+        return [node.left, node.right]
+    if isinstance(node, UnaryOpNode):
+        return [node.operand]
+    if isinstance(node, SliceNode):
+        return [node.start, node.stop, node.step]
+    if isinstance(node, AttributionNode):
+        return [node.obj]
+    if isinstance(node, ItemNode):
+        return [node.obj, node.slice_obj]
+    if isinstance(node, (TupleNode, ListNode)):
+        return node.args
+    if isinstance(node, FunctionCallNode) and not node.is_lazy():
+        return [node.func, *node.args.args, *node.kwargs.kwargs.values()]
+    if isinstance(node, SharedNode):
+        return [node.node]
+    return []
+
+
+def _names(node: ASTNode) -> Set[str]:
+    """子树中所有标识符及被折叠函数的名称"""
+    names, stack, seen = set(), [node], set()
+    while stack:
+        n = stack.pop()
+        if id(n) in seen:
+            continue
+        seen.add(id(n))
+        if isinstance(n, IdentifierNode):
+            names.add(n.name)
+        elif isinstance(n, (ConstantNode, CSENode)):
+            names.update(n.names)
+        leafs = n._render_info()[1]
+        stack.extend(leafs.values() if isinstance(leafs, dict) else leafs)
+    return names
+
+
+def _called_functions(node: ASTNode) -> Union[Set[str], None]:
+    """子树中调用的函数名, 存在非纯函数或运算符时返回None"""
+    names, stack, seen = set(), [node], set()
+    while stack:
+        n = stack.pop()
+        if id(n) in seen:
+            continue
+        seen.add(id(n))
+        if isinstance(n, BinaryOpNode) and n.operator not in n.op_mgr.pure_binary_ops:
+            return None
+        if isinstance(n, UnaryOpNode) and n.operator not in n.op_mgr.pure_unary_ops:
+            return None
+        if isinstance(n, FunctionCallNode):
+            if not isinstance(n.func, IdentifierNode) or not n.func.func_mgr.is_pure(n.func.name):
+                return None
+            names.add(n.func.name)
+        leafs = n._render_info()[1]
+        stack.extend(leafs.values() if isinstance(leafs, dict) else leafs)
+    return names
+
+
+class IncrementalEvaluator:
+    """增量求值器
+
+    假定上下文中的对象不会被原地修改, 变量只通过update更新
+    """
+
+    def __init__(self, node: ASTNode, context: Union[Dict[str, Any], None] = None):
+        self.node = node
+        self.context: Dict[str, Any] = dict(context or {})
+        # 最近一次更新中重新计算的节点数
+        self.recomputed = 0
+        self._build()
+
+    def _build(self):
+        root = self.node
+        # 根节点为CSENode时, 依据上下文是否覆盖被共享的函数选择求值的语法树
+        self._guards = set()
+        while isinstance(root, CSENode):
+            self._guards.update(root.names)
+            root = root.original if any(name in self.context for name in root.names) else root.body
+
+        # 后序遍历, 子节点的序号总是小于父节点
+        nodes: List[ASTNode] = []
+        index: Dict[int, int] = {}
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in index:
+                continue
+            if expanded:
+                index[id(node)] = len(nodes)
+                nodes.append(node)
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(_operands(node)) if id(child) not in index)
+
+        self._nodes = nodes
+        self._values: List[Any] = [None] * len(nodes)
+        self._parents: List[List[int]] = [[] for _ in nodes]
+        self._dependents: Dict[str, List[int]] = {}
+        self._volatile: List[Callable[[], bool]] = []
+        self._computes: List[Callable[[], Any]] = []
+        for i, node in enumerate(nodes):
+            children = [index[id(child)] for child in _operands(node)]
+            for child in set(children):
+                self._parents[child].append(i)
+            self._computes.append(self._plan(i, node, children))
+
+        self._dirty: Set[int] = set(range(len(nodes)))
+        self._root = len(nodes) - 1
+        self._refresh()
+
+    def _depend(self, i: int, names):
+        for name in names:
+            self._dependents.setdefault(name, []).append(i)
+
+    def _plan(self, i: int, node: ASTNode, children: List[int]) -> Callable[[], Any]:
+        """返回由子节点的值计算节点值的函数"""
+        values, context = self._values, self.context
+
+        if isinstance(node, (NumberNode, StringNode)):
+            value = node.value
+            return lambda: value
+        if isinstance(node, NoneNode):
+            return lambda: None
+        if isinstance(node, (IdentifierNode, ConstantNode)):
+            self._depend(i, [node.name] if isinstance(node, IdentifierNode) else node.names)
+            return lambda: node.evaluate(context)
+        if isinstance(node, BinaryOpNode):
+            func, (left, right) = node.op_mgr.binary_funcs[node.operator], children
+            if node.operator not in node.op_mgr.pure_binary_ops:
+                self._volatile.append(lambda: i)
+            return lambda: func(values[left], values[right])
+        if isinstance(node, UnaryOpNode):
+            func, (operand,) = node.op_mgr.unary_funcs[node.operator], children
+            if node.operator not in node.op_mgr.pure_unary_ops:
+                self._volatile.append(lambda: i)
+            return lambda: func(values[operand])
+        if isinstance(node, SliceNode):
+            start, stop, step = children
+            return lambda: slice(values[start], values[stop], values[step])
+        if isinstance(node, AttributionNode):
+            getter, (obj,) = attrgetter('.'.join(node.properties)), children
+            return lambda: getter(values[obj])
+        if isinstance(node, ItemNode):
+            obj, slice_obj = children
+            return lambda: getitem(values[obj], values[slice_obj])
+        if isinstance(node, TupleNode):
+            return lambda: tuple([values[c] for c in children])
+        if isinstance(node, ListNode):
+            return lambda: [values[c] for c in children]
+        if isinstance(node, SharedNode):
+            inner, = children
+            return lambda: values[inner]
+        if isinstance(node, FunctionCallNode) and node.is_lazy():
+            # 惰性函数调用整体求值, 依赖其中所有的标识符
+            self._depend(i, _names(node))
+            functions = _called_functions(node)
+            if functions is None:
+                self._volatile.append(lambda: i)
+            else:
+                self._volatile.append(lambda: i if any(name in context for name in functions) else None)
+            return lambda: node.evaluate(context)
+        if isinstance(node, FunctionCallNode):
+            func_index, n_args = children[0], len(node.args.args)
+            args, kwargs = children[1:1 + n_args], list(zip(node.kwargs.kwargs, children[1 + n_args:]))
+            func = node.func
+            if isinstance(func, IdentifierNode) and func.func_mgr.is_pure(func.name):
+                # 上下文覆盖了纯函数时, 无法确定覆盖后的函数是否为纯函数
+                name = func.name
+                self._volatile.append(lambda: i if name in context else None)
+            else:
+                self._volatile.append(lambda: i)
+            return lambda: values[func_index](*[values[a] for a in args], **{k: values[v] for k, v in kwargs})
+
+        # 未知节点整体求值, 依赖其中所有的标识符
+        self._depend(i, _names(node))
+        self._volatile.append(lambda: i)
+        return lambda: node.evaluate(context)
+
+    def _mark(self, i: int):
+        dirty, parents = self._dirty, self._parents
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            if i not in dirty:
+                dirty.add(i)
+                stack.extend(parents[i])
+
+    def _refresh(self):
+        for volatile in self._volatile:
+            i = volatile()
+            if i is not None:
+                self._mark(i)
+        self.recomputed = 0
+        computes, values, dirty = self._computes, self._values, self._dirty
+        # 按后序序号计算, 出现异常时未完成的节点保持待计算状态
+        for i in sorted(dirty):
+            values[i] = computes[i]()
+            dirty.discard(i)
+            self.recomputed += 1
+
+    @property
+    def value(self) -> Any:
+        """最近一次求值的结果"""
+        if self._dirty:
+            self._refresh()
+        return self._values[self._root]
+
+    def update(self, values: Union[Dict[str, Any], None] = None, **kwargs) -> Any:
+        """更新变量并返回新的求值结果"""
+        changes = dict(values or {}, **kwargs)
+        self.context.update(changes)
+        if self._guards.intersection(changes):
+            self._build()
+            return self._values[self._root]
+        for name in changes:
+            for i in self._dependents.get(name, ()):
+                self._mark(i)
+        self._refresh()
+        return self._values[self._root]
@@ -1,9 +1,10 @@
 """词法分析器"""
 import re
 from enum import Enum
-from typing import List, Any
+from functools import lru_cache
+from typing import List, Any, Union
 from dataclasses import dataclass
-from formulaparser.op_manager import OperatorManager
+from formulaparser.op_manager import OperatorManager, OperatorSnapshot
 
 
 # Token类型枚举
@@ -32,178 +33,120 @@ class Token:
     position: int
 
 
+_SPACES = re.compile(' *')
+# 字符串字面量中不含引号和反斜杠的连续片段
+_STRING_CHUNK = re.compile(r'[^"\\]*')
+_STRING_ESCAPES = {'n': '\n', 't': '\t', '"': '"', '\\': '\\'}
+
+_SIMPLE_TOKENS = {
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '[': TokenType.LSQUARE,
+    ']': TokenType.RSQUARE,
+    ',': TokenType.COMMA,
+    ':': TokenType.COLON,
+}
+
+
+@lru_cache(maxsize=64)
+def build_token_pattern(operator_pattern: str, operator_chars: str) -> re.Pattern:
+    """构建分词正则, 每次匹配先跳过前导空格
+
+    operator_pattern为OperatorManager维护的最长匹配运算符正则, 同一注册表版本复用同一个字符串对象,
+    因而按其缓存编译结果的开销仅为一次字典查找
+    """
+    alternatives = [
+        r'(?P<NUMBER>\d+(?:\.\d+)?(?:[eE][+\-]?\d+)?)',
+        r'(?P<STRING>")',
+        r'(?P<IDENTIFIER>[a-zA-Z_][a-zA-Z0-9_]*)',
+        r'(?P<ATTRIBUTION>(?:\.[a-zA-Z_][a-zA-Z0-9_]*)+)',
+        f'(?P<OPERATOR>{operator_pattern})',
+        r'(?P<ASSIGNMENT>=)',
+        f'(?P<UNKNOWN_OPERATOR>[{re.escape(operator_chars)}])',
+        r'(?P<SIMPLE>[()\[\],:])',
+        r'(?P<END>\Z)',
+    ]
+    return re.compile(f' *(?:{"|".join(alternatives)})')
+
+
 class Lexer:
-    """词法分析器"""
+    """词法分析器
+
+    使用由当前运算符构建的单个正则表达式, 通过pattern.match(text, pos)一次扫描完成分词
+    """
 
-    def __init__(self, op_mgr: OperatorManager, text: str):
+    def __init__(self, op_mgr: Union[OperatorManager, OperatorSnapshot], text: str):
         self.text = text
         self.op_mgr = op_mgr
         self.position = 0
-        self.current_char = self.text[0] if text else None
-
-    def advance(self):
-        """前进一个字符"""
-        self.position += 1
-        if self.position < len(self.text):
-            self.current_char = self.text[self.position]
-        else:
-            self.current_char = None
-
-    def skip_whitespace(self):
-        """跳过空白字符"""
-        while self.current_char and self.current_char == ' ':
-            self.advance()
-
-    def read_number(self) -> Token:
-        """读取数字"""
-        start_pos = self.position
-
-        chars = re.match(r'^((\d+(\.\d+)?[eE][+\-]?\d+)|(\d+(\.\d+)?))', self.text[self.position:]).group(0)
-        if re.match(r'^\d+$', chars):
-            value = int(chars)
-        else:
-            value = float(chars)
-
-        for _ in chars:
-            self.advance()
-
-        return Token(TokenType.NUMBER, value, start_pos)
-
-    def read_string(self) -> Token:
-        """读取字符串（双引号包围）"""
-        start_pos = self.position
-        self.advance()  # 跳过开始的引号
-
-        string_value = ""
-        while self.current_char and self.current_char != '"':
-            if self.current_char == '\\':
-                self.advance()
-                if self.current_char == 'n':
-                    string_value += '\n'
-                elif self.current_char == 't':
-                    string_value += '\t'
-                elif self.current_char == '"':
-                    string_value += '"'
-                elif self.current_char == '\\':
-                    string_value += '\\'
-                else:
-                    raise ValueError(f'不支持的转义符"\\{self.current_char}"，位置：{self.position-1}')
-            else:
-                string_value += self.current_char
-            self.advance()
-
-        if self.current_char == '"':
-            self.advance()  # 跳过结束的引号
-        else:
-            raise ValueError(f'未闭合的字符串，位置：{start_pos}')
-
-        return Token(TokenType.STRING, string_value, start_pos)
-
-    def read_operator(self) -> Token:
-        start_pos = self.position
-        for op in sorted(self.op_mgr.binary_ops | self.op_mgr.unary_ops, reverse=True):
-            if op == self.text[self.position:self.position+len(op)]:
-                for _ in range(len(op)):
-                    self.advance()
-                return Token(TokenType.OPERATOR, op, start_pos)
-        if self.current_char == '=':
-            self.advance()
-            return Token(TokenType.ASSIGNMENT, '=', start_pos)
-        raise ValueError(f'不支持的运算符，位置：{start_pos}')
-
-    def read_identifier(self) -> Token:
-        """读取标识符（变量名或函数名）
-
-        标识符由字母、数字、下划线组成，必须以字母或下划线开头
-        """
-        start_pos = self.position
-
-        identifier = re.match('^[a-zA-Z_]([a-zA-Z0-9_]+)?', self.text[start_pos:]).group(0)
-
-        for _ in identifier:
-            self.advance()
-
-        return Token(TokenType.IDENTIFIER, identifier, start_pos)
-
-    def read_attribution(self) -> Token:
-        start_pos = self.position
-
-        attributions = re.match(r'^(\.[a-zA-Z_]([a-zA-Z0-9_]+)?)+', self.text[start_pos:]).group(0)
-
-        for _ in attributions:
-            self.advance()
-
-        return Token(TokenType.ATTRIBUTION, attributions.split('.')[1:], start_pos)
-
+        self.pattern = build_token_pattern(op_mgr.operator_pattern.pattern, op_mgr.AVAILABLE_CHARS)
+
+    def read_string(self, start_pos: int) -> Token:
+        """读取字符串（双引号包围）, 返回Token并将位置移动到结束引号之后"""
+        text, end = self.text, len(self.text)
+        parts = []
+        pos = start_pos + 1     # 跳过开始的引号
+        while True:
+            chunk_end = _STRING_CHUNK.match(text, pos).end()
+            parts.append(text[pos:chunk_end])
+            pos = chunk_end
+            if pos >= end:
+                raise ValueError(f'未闭合的字符串，位置：{start_pos}')
+            if text[pos] == '"':
+                pos += 1        # 跳过结束的引号
+                break
+            escape = text[pos+1] if pos + 1 < end else None
+            if escape not in _STRING_ESCAPES:
+                raise ValueError(f'不支持的转义符"\\{escape}"，位置：{pos}')
+            parts.append(_STRING_ESCAPES[escape])
+            pos += 2
+        self.position = pos
+        return Token(TokenType.STRING, ''.join(parts), start_pos)
 
     def tokenize(self) -> List[Token]:
         """将文本转换为token列表"""
+        text, end = self.text, len(self.text)
+        match = self.pattern.match
         tokens = []
-
-        while self.current_char:
-            # 跳过空白
-            if self.current_char == ' ':
-                self.skip_whitespace()
-                continue
-
-            # 数字
-            if re.match(r'\d', self.current_char):
-                tokens.append(self.read_number())
-                continue
-
-            # 字符串
-            if self.current_char == '"':
-                tokens.append(self.read_string())
-                continue
-
-            # 标识符（变量名或函数名）
-            if re.match(r'[a-zA-Z_]', self.current_char):
-                tokens.append(self.read_identifier())
-                continue
-
-            # 属性
-            if self.current_char == '.':
-                tokens.append(self.read_attribution())
-                continue
-
-            # 运算符
-            if self.current_char in self.op_mgr.AVAILABLE_CHARS:
-                tokens.append(self.read_operator())
-                continue
-
-            # 括号
-            if self.current_char == '(':
-                tokens.append(Token(TokenType.LPAREN, '(', self.position))
-                self.advance()
-                continue
-
-            if self.current_char == ')':
-                tokens.append(Token(TokenType.RPAREN, ')', self.position))
-                self.advance()
-                continue
-
-            if self.current_char == '[':
-                tokens.append(Token(TokenType.LSQUARE, '[', self.position))
-                self.advance()
-                continue
-
-            if self.current_char == ']':
-                tokens.append(Token(TokenType.RSQUARE, ']', self.position))
-                self.advance()
-                continue
-
-            # 逗号
-            if self.current_char == ',':
-                tokens.append(Token(TokenType.COMMA, ',', self.position))
-                self.advance()
-                continue
-
-            if self.current_char == ':':
-                tokens.append(Token(TokenType.COLON, ':', self.position))
-                self.advance()
+        append = tokens.append
+
+        pos = self.position
+        while pos < end:
+            m = match(text, pos)
+            if m is None:
+                pos = _SPACES.match(text, pos).end()
+                raise ValueError(f'未知字符："{text[pos]}"，位置：{pos}')
+            kind = m.lastgroup
+            start = m.start(kind)
+            if kind == 'IDENTIFIER':
+                append(Token(TokenType.IDENTIFIER, m.group(kind), start))
+            elif kind == 'OPERATOR':
+                append(Token(TokenType.OPERATOR, m.group(kind), start))
+            elif kind == 'NUMBER':
+                chars = m.group(kind)
+                if chars.isdigit():
+                    value = int(chars)
+                else:
+                    value = float(chars)
+                append(Token(TokenType.NUMBER, value, start))
+            elif kind == 'SIMPLE':
+                char = m.group(kind)
+                append(Token(_SIMPLE_TOKENS[char], char, start))
+            elif kind == 'ATTRIBUTION':
+                append(Token(TokenType.ATTRIBUTION, m.group(kind).split('.')[1:], start))
+            elif kind == 'STRING':
+                append(self.read_string(start))
+                pos = self.position
                 continue
+            elif kind == 'ASSIGNMENT':
+                append(Token(TokenType.ASSIGNMENT, '=', start))
+            elif kind == 'END':
+                pos = end
+                break
+            else:
+                raise ValueError(f'不支持的运算符，位置：{start}')
+            pos = m.end()
 
-            raise ValueError(f'未知字符："{self.current_char}"，位置：{self.position}')
-
-        tokens.append(Token(TokenType.EOF, None, self.position))
+        self.position = pos
+        tokens.append(Token(TokenType.EOF, None, pos))
         return tokens
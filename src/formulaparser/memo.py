@@ -0,0 +1,178 @@
+"""纯函数的结果缓存
+
+注册函数时给出缓存策略, 注册表中保存的是包装后的MemoizedFunction, 所有求值方式
+（evaluate、compile、postfix、批量及向量化求值等）调用该函数时均经过缓存。
+参数不可哈希时直接调用原函数, 不缓存结果; 函数抛出异常时不缓存。
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import update_wrapper
+from math import copysign
+from threading import Lock
+from typing import Any, Callable, Dict, NamedTuple, Tuple, Union
+
+
+class MemoPolicy(NamedTuple):
+    """缓存策略
+
+    maxsize为最大条目数, 超出时淘汰最久未使用的条目, 为None时不限制;
+    ttl为条目的有效期（秒）, 为None时不过期;
+    scope为'global'时缓存在多次求值间共享, 为'evaluation'时仅在同一个evaluation_scope内有效, 不受maxsize及ttl限制
+    """
+    maxsize: Union[int, None] = 128
+    ttl: Union[float, None] = None
+    scope: str = 'global'
+
+
+class MemoInfo(NamedTuple):
+    """缓存统计信息, unhashable为参数不可哈希而未缓存的调用次数"""
+    hits: int
+    misses: int
+    unhashable: int
+    evictions: int
+    maxsize: Union[int, None]
+    currsize: int
+
+
+# 当前求值范围内的缓存, 按MemoizedFunction的id分别保存
+_evaluation_caches: ContextVar[Union[Dict[int, Dict[Tuple, Any]], None]] = ContextVar(
+    'formulaparser_evaluation_caches', default=None
+)
+_KWARGS_MARK = object()
+
+
+@contextmanager
+def evaluation_scope():
+    """在with块内启用scope='evaluation'的缓存, 退出时丢弃; 嵌套时沿用外层的范围"""
+    if _evaluation_caches.get() is not None:
+        yield
+        return
+    token = _evaluation_caches.set({})
+    try:
+        yield
+    finally:
+        _evaluation_caches.reset(token)
+
+
+def _value_key(value: Any) -> Any:
+    """值的比较键, 0.0与-0.0相等但作为参数时结果可能不同, 浮点数及复数额外区分符号"""
+    if type(value) is float:
+        return value, copysign(1, value)
+    if type(value) is complex:
+        return value, copysign(1, value.real), copysign(1, value.imag)
+    if type(value) is tuple:
+        return tuple((type(v), _value_key(v)) for v in value)
+    return value
+
+
+def _make_key(args: Tuple, kwargs: Dict[str, Any]) -> Tuple:
+    """参数及其类型组成的键, 避免1、1.0、True或0.0、-0.0共用同一结果"""
+    key = tuple(map(_value_key, args))
+    if kwargs:
+        key += (_KWARGS_MARK, *[(k, _value_key(v)) for k, v in kwargs.items()])
+    return key + tuple(type(v) for v in args) + tuple(type(v) for v in kwargs.values())
+
+
+class MemoizedFunction:
+    """带结果缓存的函数包装"""
+
+    def __init__(self, func: Callable, policy: MemoPolicy, timer: Callable[[], float] = time.monotonic):
+        if policy.maxsize is not None and policy.maxsize < 1:
+            raise ValueError(f'缓存大小不能小于1：{policy.maxsize}')
+        if policy.ttl is not None and policy.ttl <= 0:
+            raise ValueError(f'缓存有效期必须大于0：{policy.ttl}')
+        if policy.scope not in ('global', 'evaluation'):
+            raise ValueError(f'未知的缓存范围：{policy.scope}')
+        update_wrapper(self, func)
+        self.func = func
+        self.policy = policy
+        self.timer = timer
+        # 键为参数, 值为(过期时间, 结果), 按最近使用的顺序排列
+        self._cache: OrderedDict[Tuple, Tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+        self._hits = self._misses = self._unhashable = self._evictions = 0
+
+    def __reduce__(self):
+        # 锁不能序列化, 复制到其他进程时只保留函数及策略
+        return type(self), (self.func, self.policy)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        types = tuple(map(type, args))
+        if kwargs or complex in types or tuple in types:
+            key = _make_key(args, kwargs)
+        elif float in types:
+            # 类型相同时浮点数的位置固定, 附加其符号即可区分0.0与-0.0
+            key = args + types + tuple([copysign(1, v) for v in args if type(v) is float])
+        else:
+            key = args + types
+        if self.policy.scope == 'evaluation':
+            return self._call_in_scope(key, args, kwargs)
+
+        ttl = self.policy.ttl
+        now = self.timer() if ttl is not None else 0.0
+        cache = self._cache
+        with self._lock:
+            try:
+                entry = cache.get(key)
+            except TypeError:
+                # 参数不可哈希, 直接调用
+                self._unhashable += 1
+                entry = False
+            else:
+                if entry is not None and (ttl is None or entry[0] > now):
+                    cache.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                if entry is not None:
+                    del cache[key]
+                self._misses += 1
+
+        value = self.func(*args, **kwargs)
+        if entry is False:
+            return value
+        with self._lock:
+            cache[key] = (now + ttl if ttl is not None else 0.0, value)
+            cache.move_to_end(key)
+            maxsize = self.policy.maxsize
+            while maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def _call_in_scope(self, key: Tuple, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        caches = _evaluation_caches.get()
+        # 不在求值范围内时不缓存
+        cache = None if caches is None else caches.setdefault(id(self), {})
+        with self._lock:
+            try:
+                if cache is not None and key in cache:
+                    self._hits += 1
+                    return cache[key]
+                hash(key)
+            except TypeError:
+                self._unhashable += 1
+                cache = None
+            else:
+                self._misses += 1
+        value = self.func(*args, **kwargs)
+        if cache is not None:
+            cache[key] = value
+        return value
+
+    def cache_info(self) -> MemoInfo:
+        with self._lock:
+            return MemoInfo(self._hits, self._misses, self._unhashable, self._evictions, self.policy.maxsize,
+                            len(self._cache))
+
+    def invalidate(self):
+        """清空缓存的结果, 保留统计, 当前求值范围内已缓存的结果不受影响"""
+        with self._lock:
+            self._cache.clear()
+
+    def cache_clear(self):
+        """清空缓存及统计"""
+        with self._lock:
+            self._cache.clear()
+            self._hits = self._misses = self._unhashable = self._evictions = 0
@@ -1,10 +1,70 @@
+import re
 import operator
-from typing import Set, Dict, Callable, Any
+from operator import attrgetter
+from threading import Lock
+from types import MappingProxyType
+from typing import Callable, Any, Optional, FrozenSet, Iterable, Mapping, NamedTuple
 
 
-class OperatorManager:
+class OperatorSnapshot(NamedTuple):
+    """运算符注册表的只读快照, 之后注册的运算符不会出现在快照中"""
     AVAILABLE_CHARS = '+-*/<>=`~!@#$%^&|?'
 
+    binary_ops: FrozenSet[str]
+    binary_funcs: Mapping[str, Callable[[Any, Any], Any]]
+    binary_precedences: Mapping[str, int]
+    unary_ops: FrozenSet[str]
+    unary_funcs: Mapping[str, Callable[[Any], Any]]
+    vectorized_binary_ops: FrozenSet[str]
+    vectorized_unary_ops: FrozenSet[str]
+    pure_binary_ops: FrozenSet[str]
+    pure_unary_ops: FrozenSet[str]
+    # 所有运算符按长度降序组成的正则
+    operator_pattern: re.Pattern
+    version: int
+
+    def __reduce__(self):
+        # MappingProxyType不能序列化, 以普通字典重建
+        return _operator_snapshot, tuple(dict(v) if isinstance(v, MappingProxyType) else v for v in self)
+
+    def snapshot(self) -> 'OperatorSnapshot':
+        return self
+
+    def get_binary_func(self, op: str) -> Callable[[Any, Any], Any]:
+        if op not in self.binary_funcs:
+            raise KeyError(f'双目运算符不存在"{op}"')
+        return self.binary_funcs[op]
+
+    def get_unary_func(self, op: str) -> Callable[[Any], Any]:
+        if op not in self.unary_funcs:
+            raise KeyError(f'单目运算符不存在"{op}"')
+        return self.unary_funcs[op]
+
+    def match_operator(self, text: str, pos: int = 0) -> Optional[str]:
+        """返回text从pos开始的最长运算符, 不存在时返回None"""
+        m = self.operator_pattern.match(text, pos)
+        return m.group() if m else None
+
+
+def _operator_snapshot(*fields) -> OperatorSnapshot:
+    return OperatorSnapshot(*(MappingProxyType(v) if isinstance(v, dict) else v for v in fields))
+
+
+def _build_operator_pattern(ops: Iterable[str]) -> re.Pattern:
+    # 正则的分支按顺序尝试, 长运算符在前即为最长匹配
+    ops = sorted(ops, key=lambda op: (-len(op), op))
+    return re.compile('|'.join(re.escape(op) for op in ops) or '(?!)')
+
+
+class OperatorManager:
+    """运算符注册表
+
+    内容保存在不可变的OperatorSnapshot中, 注册时在锁内复制并整体替换（写时复制）,
+    读取时不加锁, 总是看到某次注册前或后的完整状态;
+    预定义运算符组成的快照每个类只构建一次, 新建的实例直接共享, 注册自定义运算符时才复制
+    """
+    AVAILABLE_CHARS = OperatorSnapshot.AVAILABLE_CHARS
+
     PREDEFINE_BINARY_OPERATORS = {
         # 比较运算
         '<':  (operator.lt,       11000),
@@ -38,39 +98,89 @@ class OperatorManager:
         '~': operator.invert,
     }
 
-    def __init__(self):
-        self.binary_ops: Set[str] = set()
-        self.binary_funcs: Dict[str, Callable[[Any, Any], Any]] = dict()
-        self.binary_precedences: Dict[str, int] = dict()
+    def __init__(self, snapshot: Optional[OperatorSnapshot] = None):
+        # 仅串行化注册, 读取不加锁
+        self._lock = Lock()
+        self._snapshot = snapshot if snapshot is not None else self._predefined()
 
-        self.unary_ops: Set[str] = set()
-        self.unary_funcs: Dict[str, Callable[[Any], Any]] = dict()
+    @classmethod
+    def _predefined(cls) -> OperatorSnapshot:
+        """由预定义运算符组成的快照, 子类重新定义预定义运算符时单独构建"""
+        snapshot = cls.__dict__.get('_predefined_snapshot')
+        if snapshot is None:
+            manager = cls(_operator_snapshot(frozenset(), {}, {}, frozenset(), {}, frozenset(), frozenset(),
+                                             frozenset(), frozenset(), _build_operator_pattern(()), 0))
+            for op, (func, precedence) in cls.PREDEFINE_BINARY_OPERATORS.items():
+                manager.register_binary_op(op, func, precedence, pure=True)
+            for op, func in cls.PREDEFINE_UNARY_OPERATORS.items():
+                manager.register_unary_op(op, func, pure=True)
+            snapshot = cls._predefined_snapshot = manager.snapshot()
+        return snapshot
 
-        for op, (func, precedence) in self.PREDEFINE_BINARY_OPERATORS.items():
-            self.register_binary_op(op, func, precedence)
-
-        for op, func in self.PREDEFINE_UNARY_OPERATORS.items():
-            self.register_unary_op(op, func)
+    # 以下属性均读取当前快照, 需要多个属性彼此一致时应先取snapshot()
+    # 注册表版本号, 每次注册运算符后递增, 用于判断解析缓存是否失效
+    version = property(attrgetter('_snapshot.version'))
+    binary_ops = property(attrgetter('_snapshot.binary_ops'))
+    binary_funcs = property(attrgetter('_snapshot.binary_funcs'))
+    binary_precedences = property(attrgetter('_snapshot.binary_precedences'))
+    unary_ops = property(attrgetter('_snapshot.unary_ops'))
+    unary_funcs = property(attrgetter('_snapshot.unary_funcs'))
+    # 注册时声明可直接作用于NumPy数组的自定义运算符
+    vectorized_binary_ops = property(attrgetter('_snapshot.vectorized_binary_ops'))
+    vectorized_unary_ops = property(attrgetter('_snapshot.vectorized_unary_ops'))
+    # 纯运算符（相同操作数总是返回相同结果且无副作用）, 可用于常量折叠
+    pure_binary_ops = property(attrgetter('_snapshot.pure_binary_ops'))
+    pure_unary_ops = property(attrgetter('_snapshot.pure_unary_ops'))
+    # 所有运算符按长度降序组成的正则, 仅在注册运算符时重建
+    operator_pattern = property(attrgetter('_snapshot.operator_pattern'))
 
     def is_operator_legal(self, op: str) -> bool:
         return all(c in self.AVAILABLE_CHARS for c in op)
 
-    def register_binary_op(self, op: str, func: Callable[[Any, Any], Any], precedence: int):
+    def register_binary_op(self, op: str, func: Callable[[Any, Any], Any], precedence: int, vectorized: bool = False,
+                           pure: bool = False):
         if not self.is_operator_legal(op):
             raise ValueError(f'不合法的运算符："{op}", 运算符仅能包含字符："{self.AVAILABLE_CHARS}"')
         if precedence <= 0:
             raise ValueError(f'运算符"{op}"优先级必须大于0')
-        if op in self.binary_ops:
-            raise ValueError(f'双目运算符"{op}"已存在')
-        self.binary_ops.add(op)
-        self.binary_funcs[op] = func
-        self.binary_precedences[op] = precedence
+        with self._lock:
+            current = self._snapshot
+            if op in current.binary_ops:
+                raise ValueError(f'双目运算符"{op}"已存在')
+            binary_ops = current.binary_ops | {op}
+            self._snapshot = current._replace(
+                binary_ops=binary_ops,
+                binary_funcs=MappingProxyType({**current.binary_funcs, op: func}),
+                binary_precedences=MappingProxyType({**current.binary_precedences, op: precedence}),
+                vectorized_binary_ops=current.vectorized_binary_ops | {op} if vectorized
+                else current.vectorized_binary_ops,
+                pure_binary_ops=current.pure_binary_ops | {op} if pure else current.pure_binary_ops,
+                operator_pattern=_build_operator_pattern(binary_ops | current.unary_ops),
+                version=current.version + 1,
+            )
 
-    def register_unary_op(self, op: str, func: Callable[[Any], Any]):
+    def register_unary_op(self, op: str, func: Callable[[Any], Any], vectorized: bool = False, pure: bool = False):
         if not self.is_operator_legal(op):
             raise ValueError(f'不合法的运算符："{op}", 运算符仅能包含字符："{self.AVAILABLE_CHARS}"')
-        if op in self.unary_ops:
-            raise ValueError(f'单目运算符"{op}"已存在')
-        self.unary_ops.add(op)
-        self.unary_funcs[op] = func
+        with self._lock:
+            current = self._snapshot
+            if op in current.unary_ops:
+                raise ValueError(f'单目运算符"{op}"已存在')
+            unary_ops = current.unary_ops | {op}
+            self._snapshot = current._replace(
+                unary_ops=unary_ops,
+                unary_funcs=MappingProxyType({**current.unary_funcs, op: func}),
+                vectorized_unary_ops=current.vectorized_unary_ops | {op} if vectorized
+                else current.vectorized_unary_ops,
+                pure_unary_ops=current.pure_unary_ops | {op} if pure else current.pure_unary_ops,
+                operator_pattern=_build_operator_pattern(current.binary_ops | unary_ops),
+                version=current.version + 1,
+            )
+
+    def snapshot(self) -> OperatorSnapshot:
+        """当前注册表的快照, 注册表不变时总是返回同一个对象"""
+        return self._snapshot
 
+    def match_operator(self, text: str, pos: int = 0) -> Optional[str]:
+        """返回text从pos开始的最长运算符, 不存在时返回None"""
+        return self._snapshot.match_operator(text, pos)
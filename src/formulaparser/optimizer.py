@@ -0,0 +1,426 @@
+"""语法树优化"""
+from functools import partial
+from typing import Any, Dict, NamedTuple, FrozenSet, Tuple, Set, Callable, List
+from formulaparser.memo import _value_key
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, ArgsNode, KwargsNode, FunctionCallNode, SharedNode, CSENode
+)
+
+# 可在多次求值间共享的不可变类型
+_IMMUTABLE_TYPES = {int, float, complex, bool, str, bytes, type(None), range, slice, frozenset}
+
+
+def _is_immutable(value: Any) -> bool:
+    if type(value) is tuple:
+        return all(_is_immutable(v) for v in value)
+    return type(value) in _IMMUTABLE_TYPES
+
+
+class _NotConstant(BaseException):
+    """惰性函数取用了非常量的参数, 调用不能折叠; 继承BaseException以免被惰性函数中的except Exception捕获"""
+
+
+class _Folded(NamedTuple):
+    node: ASTNode
+    # 节点的值在求值时是否为常量; 为True时value为该常量
+    const: bool = False
+    value: Any = None
+    # 常量依赖的函数名, 上下文中存在同名变量时常量失效
+    names: FrozenSet[str] = frozenset()
+
+
+class _ConstantFolder:
+    """常量折叠
+
+    仅由字面量、纯运算符及纯函数组成的子树在优化时计算并替换为常量节点;
+    标识符可被上下文覆盖, 因此不会折叠; 计算时抛出异常的子树保持原样, 求值时仍会抛出相同异常
+    """
+
+    def __init__(self):
+        self.memo: Dict[int, _Folded] = {}
+
+    def fold(self, node: ASTNode) -> _Folded:
+        key = id(node)
+        if key not in self.memo:
+            visit = getattr(self, f'visit_{type(node).__name__}', self.visit_unknown)
+            self.memo[key] = visit(node)
+        return self.memo[key]
+
+    def optimize(self, node: ASTNode) -> ASTNode:
+        return self.literal(self.fold(node))
+
+    @staticmethod
+    def literal(folded: _Folded) -> ASTNode:
+        """将常量结果转换为字面量节点, 非常量或可变的结果返回原节点"""
+        if not folded.const or not _is_immutable(folded.value):
+            return folded.node
+        if isinstance(folded.node, (NumberNode, StringNode, NoneNode, ConstantNode)):
+            return folded.node
+        value = folded.value
+        if folded.names:
+            return ConstantNode(value, tuple(sorted(folded.names)), folded.node)
+        if type(value) in (int, float):
+            return NumberNode(value)
+        if type(value) is str:
+            return StringNode(value)
+        if value is None:
+            return NoneNode()
+        return ConstantNode(value)
+
+    def compute(self, node: ASTNode, func, args, kwargs=None, names=frozenset()) -> _Folded:
+        try:
+            value = func(*[a.value for a in args], **{k: v.value for k, v in (kwargs or {}).items()})
+        except Exception:
+            return _Folded(node)
+        names = names.union(*[a.names for a in args], *[v.names for v in (kwargs or {}).values()])
+        return _Folded(node, True, value, names)
+
+    def visit_unknown(self, node: ASTNode) -> _Folded:
+        return _Folded(node)
+
+    def visit_NumberNode(self, node: NumberNode) -> _Folded:
+        return _Folded(node, True, node.value)
+
+    visit_StringNode = visit_NumberNode
+
+    def visit_NoneNode(self, node: NoneNode) -> _Folded:
+        return _Folded(node, True, None)
+
+    def visit_ConstantNode(self, node: ConstantNode) -> _Folded:
+        return _Folded(node, True, node.value, frozenset(node.names))
+
+    def visit_BinaryOpNode(self, node: BinaryOpNode) -> _Folded:
+        left, right = self.fold(node.left), self.fold(node.right)
+        new_left, new_right = self.literal(left), self.literal(right)
+        if new_left is not node.left or new_right is not node.right:
+            node = BinaryOpNode(node.op_mgr, node.operator, new_left, new_right)
+        if left.const and right.const and node.operator in node.op_mgr.pure_binary_ops:
+            return self.compute(node, node.op_mgr.binary_funcs[node.operator], [left, right])
+        return _Folded(node)
+
+    def visit_UnaryOpNode(self, node: UnaryOpNode) -> _Folded:
+        operand = self.fold(node.operand)
+        new_operand = self.literal(operand)
+        if new_operand is not node.operand:
+            node = UnaryOpNode(node.op_mgr, node.operator, new_operand)
+        if operand.const and node.operator in node.op_mgr.pure_unary_ops:
+            return self.compute(node, node.op_mgr.unary_funcs[node.operator], [operand])
+        return _Folded(node)
+
+    def visit_SliceNode(self, node: SliceNode) -> _Folded:
+        parts = [self.fold(n) for n in (node.start, node.stop, node.step)]
+        new_parts = [self.literal(p) for p in parts]
+        if any(n is not o for n, o in zip(new_parts, (node.start, node.stop, node.step))):
+            node = SliceNode(*new_parts)
+        if all(p.const for p in parts):
+            return self.compute(node, slice, parts)
+        return _Folded(node)
+
+    def visit_AttributionNode(self, node: AttributionNode) -> _Folded:
+        obj = self.fold(node.obj)
+        new_obj = self.literal(obj)
+        if new_obj is not node.obj:
+            node = AttributionNode(new_obj, node.properties[:])
+        if obj.const and _is_immutable(obj.value):
+            # 仅读取不可变常量的属性
+            properties = node.properties
+
+            def getattrs(value):
+                for p in properties:
+                    value = getattr(value, p)
+                return value
+            return self.compute(node, getattrs, [obj])
+        return _Folded(node)
+
+    def _fold_items(self, node, cls):
+        items = [self.fold(arg) for arg in node.args]
+        new_args = [self.literal(item) for item in items]
+        if any(n is not o for n, o in zip(new_args, node.args)):
+            node = cls(new_args)
+        return node, items
+
+    def visit_TupleNode(self, node: TupleNode) -> _Folded:
+        node, items = self._fold_items(node, TupleNode)
+        if all(item.const for item in items):
+            return self.compute(node, lambda *args: args, items)
+        return _Folded(node)
+
+    def visit_ListNode(self, node: ListNode) -> _Folded:
+        # 列表可变, 自身不会被替换为常量, 但可作为纯函数的常量参数参与折叠
+        node, items = self._fold_items(node, ListNode)
+        if all(item.const for item in items):
+            return self.compute(node, lambda *args: list(args), items)
+        return _Folded(node)
+
+    def visit_ItemNode(self, node: ItemNode) -> _Folded:
+        obj, slice_obj = self.fold(node.obj), self.fold(node.slice_obj)
+        new_obj, new_slice = self.literal(obj), self.literal(slice_obj)
+        if new_obj is not node.obj or new_slice is not node.slice_obj:
+            node = ItemNode(new_obj, new_slice)
+        if obj.const and slice_obj.const:
+            return self.compute(node, lambda o, s: o[s], [obj, slice_obj])
+        return _Folded(node)
+
+    def visit_FunctionCallNode(self, node: FunctionCallNode) -> _Folded:
+        func = node.func
+        if isinstance(func, IdentifierNode) and func.func_mgr.is_lazy(func.name):
+            return self.fold_lazy(node)
+        new_args, args = self._fold_items(node.args, ArgsNode)
+        kwargs = {k: self.fold(v) for k, v in node.kwargs.kwargs.items()}
+        new_kwargs = {k: self.literal(v) for k, v in kwargs.items()}
+        if any(new_kwargs[k] is not v for k, v in node.kwargs.kwargs.items()):
+            new_kwargs = KwargsNode(new_kwargs)
+        else:
+            new_kwargs = node.kwargs
+        if new_args is not node.args or new_kwargs is not node.kwargs:
+            node = FunctionCallNode(node.func, new_args, new_kwargs)
+
+        if isinstance(func, IdentifierNode) and func.func_mgr.has_func(func.name) and func.func_mgr.is_pure(func.name):
+            if all(a.const for a in args) and all(v.const for v in kwargs.values()):
+                call = func.func_mgr.get_func(func.name)
+                return self.compute(node, call, args, kwargs, frozenset([func.name]))
+        return _Folded(node)
+
+    def fold_lazy(self, node: FunctionCallNode) -> _Folded:
+        """惰性函数调用
+
+        以thunk调用纯惰性函数, 参数在被取用时才折叠, 未被选中的分支不会在优化时计算;
+        取用的参数不是常量时调用不折叠, 已取用（求值时必定计算）的参数替换为折叠结果, 其余参数保持原样
+        """
+        func = node.func
+        args, kwargs = node.args.args, node.kwargs.kwargs
+        used: Dict[int, _Folded] = {}
+
+        def thunk(arg):
+            folded = used[id(arg)] = self.fold(arg)
+            if not folded.const:
+                raise _NotConstant
+            return folded.value
+
+        result = None
+        if func.func_mgr.is_pure(func.name):
+            try:
+                value = func.func_mgr.get_func(func.name)(
+                    *[partial(thunk, arg) for arg in args], **{k: partial(thunk, v) for k, v in kwargs.items()}
+                )
+            except (_NotConstant, Exception):
+                pass
+            else:
+                result = value, frozenset([func.name]).union(*[f.names for f in used.values()])
+
+        new_args = [self.literal(used[id(arg)]) if id(arg) in used else arg for arg in args]
+        new_kwargs = {k: self.literal(used[id(v)]) if id(v) in used else v for k, v in kwargs.items()}
+        if any(n is not o for n, o in zip(new_args, args)) or any(new_kwargs[k] is not v for k, v in kwargs.items()):
+            node = FunctionCallNode(func, ArgsNode(new_args), KwargsNode(new_kwargs))
+        if result is not None:
+            return _Folded(node, True, *result)
+        return _Folded(node)
+
+
+def fold_constants(node: ASTNode) -> ASTNode:
+    """常量折叠, 返回新的语法树, 原语法树不会被修改"""
+    return _ConstantFolder().optimize(node)
+
+
+def _children(node: ASTNode) -> List[ASTNode]:
+    leafs = node._render_info()[1]
+    return list(leafs.values()) if isinstance(leafs, dict) else leafs
+
+
+def _evaluation_size(node: ASTNode, seen: Set[int]) -> int:
+    """一次求值中计算的节点数, 同一SharedNode只计算一次"""
+    if isinstance(node, SharedNode):
+        if id(node) in seen:
+            return 0
+        seen.add(id(node))
+        return _evaluation_size(node.node, seen)
+    size = 0 if isinstance(node, (ArgsNode, KwargsNode, CSENode)) else 1
+    return size + sum(_evaluation_size(child, seen) for child in _children(node))
+
+
+class _Canonical(NamedTuple):
+    node: ASTNode
+    # 值编号, 结构相同的子树编号相同
+    number: int
+    # 子树是否仅由纯运算符、纯函数、字面量及标识符组成
+    pure: bool
+    # 子树调用的纯函数名
+    names: FrozenSet[str]
+
+
+class _CommonSubexpressionEliminator:
+    """公共子表达式消除
+
+    通过结构哈希将结构相同的子树合并为同一节点, 得到有向无环图;
+    被多个父节点引用的纯表达式包装为SharedNode, 在每次求值中只计算一次
+    """
+
+    # 不包装为SharedNode的节点: 叶子节点计算开销低, 列表为可变对象, 不可在多处共享
+    UNSHARED = (NumberNode, StringNode, NoneNode, ConstantNode, IdentifierNode, ListNode, ArgsNode, KwargsNode)
+
+    def __init__(self):
+        self.table: Dict[Tuple, _Canonical] = {}
+        self.memo: Dict[int, _Canonical] = {}
+        self.canonical_nodes: Dict[int, _Canonical] = {}
+
+    def canonical(self, node: ASTNode) -> _Canonical:
+        key = id(node)
+        if key not in self.memo:
+            if isinstance(node, SharedNode):
+                self.memo[key] = self.canonical(node.node)
+            elif isinstance(node, CSENode):
+                self.memo[key] = self.canonical(node.body)
+            else:
+                visit = getattr(self, f'visit_{type(node).__name__}', self.visit_unknown)
+                self.memo[key] = self.intern(*visit(node))
+        return self.memo[key]
+
+    def intern(self, key: Tuple, node: ASTNode, pure: bool, names: FrozenSet[str]) -> _Canonical:
+        try:
+            hash(key)
+        except TypeError:
+            key = ('Unique', id(node))
+        if key not in self.table:
+            canonical = _Canonical(node, len(self.table), pure, names)
+            self.table[key] = self.canonical_nodes[id(node)] = canonical
+        return self.table[key]
+
+    @staticmethod
+    def merge(children: List[_Canonical]) -> Tuple[bool, FrozenSet[str]]:
+        return all(c.pure for c in children), frozenset().union(*[c.names for c in children])
+
+    def visit_unknown(self, node: ASTNode):
+        return ('Unique', id(node)), node, False, frozenset()
+
+    def visit_NumberNode(self, node: NumberNode):
+        return ('Number', type(node.value), _value_key(node.value)), node, True, frozenset()
+
+    def visit_StringNode(self, node: StringNode):
+        return ('String', node.value), node, True, frozenset()
+
+    def visit_NoneNode(self, node: NoneNode):
+        return ('None',), node, True, frozenset()
+
+    def visit_ConstantNode(self, node: ConstantNode):
+        key = ('Constant', type(node.value), _value_key(node.value), node.names)
+        return key, node, True, frozenset(node.names)
+
+    def visit_IdentifierNode(self, node: IdentifierNode):
+        return ('Identifier', id(node.func_mgr), node.name), node, True, frozenset()
+
+    def visit_BinaryOpNode(self, node: BinaryOpNode):
+        left, right = self.canonical(node.left), self.canonical(node.right)
+        pure, names = self.merge([left, right])
+        pure = pure and node.operator in node.op_mgr.pure_binary_ops
+        key = ('BinaryOp', id(node.op_mgr), node.operator, left.number, right.number)
+        return key, BinaryOpNode(node.op_mgr, node.operator, left.node, right.node), pure, names
+
+    def visit_UnaryOpNode(self, node: UnaryOpNode):
+        operand = self.canonical(node.operand)
+        pure = operand.pure and node.operator in node.op_mgr.pure_unary_ops
+        key = ('UnaryOp', id(node.op_mgr), node.operator, operand.number)
+        return key, UnaryOpNode(node.op_mgr, node.operator, operand.node), pure, operand.names
+
+    def visit_SliceNode(self, node: SliceNode):
+        parts = [self.canonical(n) for n in (node.start, node.stop, node.step)]
+        pure, names = self.merge(parts)
+        key = ('Slice', *[p.number for p in parts])
+        return key, SliceNode(*[p.node for p in parts]), pure, names
+
+    def visit_AttributionNode(self, node: AttributionNode):
+        # 属性读取可能触发任意代码, 不视为纯表达式
+        obj = self.canonical(node.obj)
+        key = ('Attribution', obj.number, tuple(node.properties))
+        return key, AttributionNode(obj.node, node.properties[:]), False, obj.names
+
+    def visit_ItemNode(self, node: ItemNode):
+        obj, slice_obj = self.canonical(node.obj), self.canonical(node.slice_obj)
+        key = ('Item', obj.number, slice_obj.number)
+        return key, ItemNode(obj.node, slice_obj.node), False, obj.names | slice_obj.names
+
+    def visit_TupleNode(self, node: TupleNode):
+        items = [self.canonical(arg) for arg in node.args]
+        pure, names = self.merge(items)
+        return ('Tuple', *[i.number for i in items]), TupleNode([i.node for i in items]), pure, names
+
+    def visit_ListNode(self, node: ListNode):
+        items = [self.canonical(arg) for arg in node.args]
+        pure, names = self.merge(items)
+        return ('List', *[i.number for i in items]), ListNode([i.node for i in items]), pure, names
+
+    def visit_FunctionCallNode(self, node: FunctionCallNode):
+        func = self.canonical(node.func)
+        args = [self.canonical(arg) for arg in node.args.args]
+        kwargs = {k: self.canonical(v) for k, v in node.kwargs.kwargs.items()}
+        pure, names = self.merge(args + list(kwargs.values()))
+        func_node = func.node
+        if isinstance(func_node, IdentifierNode) and func_node.func_mgr.is_pure(func_node.name):
+            names = names | {func_node.name}
+        else:
+            pure = False
+        key = ('FunctionCall', func.number, tuple(a.number for a in args), tuple((k, v.number) for k, v in kwargs.items()))
+        new_node = FunctionCallNode(
+            func_node, ArgsNode([a.node for a in args]), KwargsNode({k: v.node for k, v in kwargs.items()})
+        )
+        return key, new_node, pure, names
+
+    def eliminate(self, node: ASTNode) -> Tuple[ASTNode, int]:
+        root = self.canonical(node).node
+
+        # 统计有向无环图中每个节点被父节点引用的次数
+        references: Dict[int, int] = {}
+        stack, visited = [root], {id(root)}
+        while stack:
+            for child in _children(stack.pop()):
+                references[id(child)] = references.get(id(child), 0) + 1
+                if id(child) not in visited:
+                    visited.add(id(child))
+                    stack.append(child)
+
+        shared: Dict[int, ASTNode] = {}
+        names: Set[str] = set()
+
+        def share(n: ASTNode) -> ASTNode:
+            key = id(n)
+            if key in shared:
+                return shared[key]
+            _replace_children(n, share)
+            canonical = self.canonical_nodes.get(key)
+            if references.get(key, 0) > 1 and canonical and canonical.pure and not isinstance(n, self.UNSHARED):
+                names.update(canonical.names)
+                shared[key] = SharedNode(n)
+            else:
+                shared[key] = n
+            return shared[key]
+
+        body = share(root)
+        deduplicated = _evaluation_size(node, set()) - _evaluation_size(body, set())
+        if deduplicated <= 0:
+            return node, 0
+        return CSENode(body, node, tuple(sorted(names)), deduplicated), deduplicated
+
+
+def _replace_children(node: ASTNode, func: Callable[[ASTNode], ASTNode]):
+    """原地替换新建节点的子节点"""
+    if isinstance(node, BinaryOpNode):
+        node.left, node.right = func(node.left), func(node.right)
+    elif isinstance(node, UnaryOpNode):
+        node.operand = func(node.operand)
+    elif isinstance(node, SliceNode):
+        node.start, node.stop, node.step = func(node.start), func(node.stop), func(node.step)
+    elif isinstance(node, AttributionNode):
+        node.obj = func(node.obj)
+    elif isinstance(node, ItemNode):
+        node.obj, node.slice_obj = func(node.obj), func(node.slice_obj)
+    elif isinstance(node, (TupleNode, ListNode, ArgsNode)):
+        node.args = [func(arg) for arg in node.args]
+    elif isinstance(node, KwargsNode):
+        node.kwargs = {k: func(v) for k, v in node.kwargs.items()}
+    elif isinstance(node, FunctionCallNode):
+        node.func, node.args, node.kwargs = func(node.func), func(node.args), func(node.kwargs)
+
+
+def eliminate_common_subexpressions(node: ASTNode) -> Tuple[ASTNode, int]:
+    """公共子表达式消除, 返回新的语法树及减少的节点计算次数; 没有可消除的子表达式时返回原语法树"""
+    return _CommonSubexpressionEliminator().eliminate(node)
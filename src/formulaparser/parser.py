@@ -1,17 +1,54 @@
-from typing import Any, Callable
-from formulaparser.func_manager import FunctionManager
-from formulaparser.op_manager import OperatorManager
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Union, NamedTuple, Tuple
+from formulaparser.func_manager import FunctionManager, FunctionSnapshot
+from formulaparser.memo import MemoPolicy, MemoInfo
+from formulaparser.op_manager import OperatorManager, OperatorSnapshot
 from formulaparser.lexer import Token, TokenType, Lexer
 from formulaparser.ast_nodes import (
     ASTNode, NumberNode, StringNode, UnaryOpNode, BinaryOpNode, FunctionCallNode, IdentifierNode, SliceNode,
-    AttributionNode, NoneNode, ItemNode, ArgsNode, KwargsNode
+    AttributionNode, NoneNode, ItemNode, ArgsNode, KwargsNode, TupleNode, ListNode
 )
 
 
+# 括号帧的种类
+_ROOT, _GROUP, _CALL, _LIST, _ITEM = range(5)
+
+
+class _Frame:
+    """一层括号的解析状态, 代替递归下降时的调用栈帧"""
+    __slots__ = ('kind', 'position', 'func', 'args', 'kwargs', 'keyword', 'extra_comma', 'parts', 'colons',
+                 'is_slice', 'operators', 'unary')
+
+    def __init__(self, kind: int, position: int, func: ASTNode = None):
+        self.kind = kind
+        # 圆括号为左括号位置, 下标为当前元素的起始位置
+        self.position = position
+        self.func = func
+        self.args: List[ASTNode] = []
+        self.kwargs = KwargsNode({}) if kind == _CALL else None
+        self.keyword = None
+        self.extra_comma = False
+        if kind == _ITEM:
+            # 当前元素的切片参数
+            self.parts: List[ASTNode] = []
+            self.colons = 0
+            self.is_slice = False
+        # 待规约的(优先级, 运算符, 左操作数), 优先级自底向上递增
+        self.operators: List[Tuple[int, str, ASTNode]] = []
+        # 当前操作数前的单目运算符
+        self.unary: List[str] = []
+
+
 class _Parser:
-    """语法分析器"""
+    """语法分析器
 
-    def __init__(self, op_mgr: OperatorManager, func_mgr: FunctionManager, text: str):
+    优先级爬升法的迭代实现: 双目运算符在所在括号帧的栈内按优先级规约, 括号嵌套使用显式的帧栈,
+    公式长度及嵌套深度只受内存限制, 耗时与token数成线性关系
+    """
+
+    def __init__(self, op_mgr: Union[OperatorManager, OperatorSnapshot],
+                 func_mgr: Union[FunctionManager, FunctionSnapshot], text: str):
         self.op_mgr = op_mgr
         self.func_mgr = func_mgr
         self.text = text
@@ -33,197 +70,342 @@ class _Parser:
         if self.current_token.type == TokenType.EOF:
             raise ValueError('表达式为空')
 
-        result = self.parse_expression()
-
-        if self.current_token.type != TokenType.EOF:
-            raise ValueError(f'解析错误：意外的token {self.current_token}')
+        op_mgr, identifier_nodes, tokens = self.op_mgr, self.identifier_nodes, self.tokens
+        unary_ops, binary_ops, precedences = op_mgr.unary_ops, op_mgr.binary_ops, op_mgr.binary_precedences
+        frame = _Frame(_ROOT, -1)
+        frames = [frame]
+        # node为None时解析操作数, 否则node为已解析的基本表达式, 继续解析后缀及运算符
+        node = None
+        while True:
+            token = self.current_token
+            token_type = token.type
+            if node is None:
+                if token_type == TokenType.NUMBER:
+                    node = NumberNode(token.value)
+                elif token_type == TokenType.IDENTIFIER:
+                    node = identifier_nodes.get(token.value)
+                    if node is None:
+                        node = identifier_nodes[token.value] = IdentifierNode(self.func_mgr, token.value)
+                elif token_type == TokenType.STRING:
+                    node = StringNode(token.value)
+                elif token_type == TokenType.OPERATOR:
+                    if token.value not in unary_ops:
+                        raise ValueError(f'Token无法解析为单目运算符：{token}')
+                    frame.unary.append(token.value)
+                elif token_type == TokenType.LPAREN:
+                    frame = _Frame(_GROUP, token.position)
+                    frames.append(frame)
+                    self.advance()
+                    if self.current_token.type == TokenType.RPAREN:
+                        node = self._close(frames)
+                        frame = frames[-1]
+                    continue
+                elif token_type == TokenType.LSQUARE:
+                    frame = _Frame(_LIST, token.position)
+                    frames.append(frame)
+                    self.advance()
+                    if self.current_token.type == TokenType.RSQUARE:
+                        node = self._close(frames)
+                        frame = frames[-1]
+                    continue
+                else:
+                    raise ValueError(f'意外的token：{token}')
+                # 仅在消耗非EOF的token后前进, 而tokens以EOF结尾, 不会越界
+                self.position += 1
+                self.current_token = tokens[self.position]
+                continue
 
-        return result
+            # 后缀: 函数调用、下标、属性
+            if token_type == TokenType.LPAREN:
+                frames.append(_Frame(_CALL, token.position, node))
+                self.advance()
+                node = self._close(frames) if self.current_token.type == TokenType.RPAREN else None
+                frame = frames[-1]
+                continue
+            if token_type == TokenType.LSQUARE:
+                self.advance()
+                frames.append(_Frame(_ITEM, self.current_token.position, node))
+                if self.current_token.type == TokenType.RSQUARE:
+                    node = self._close(frames)
+                else:
+                    node = self._end_slice_part(frames, None)
+                frame = frames[-1]
+                continue
+            if token_type == TokenType.ATTRIBUTION:
+                node = AttributionNode(node, token.value[:])
+                self.position += 1
+                self.current_token = tokens[self.position]
+                continue
+            if token_type in (TokenType.STRING, TokenType.NUMBER, TokenType.IDENTIFIER):
+                raise ValueError(f'意外的token：{token}')
 
-    def parse_expression(self, min_precedence: int = 0) -> ASTNode:
-        """解析表达式（使用优先级爬升法）"""
-        left = self.parse_unary()
+            # 操作数结束, 由内向外应用单目运算符
+            unary = frame.unary
+            while unary:
+                node = UnaryOpNode(op_mgr, unary.pop(), node)
 
-        while self.current_token.type == TokenType.OPERATOR:
-            operator = self.current_token.value
-            if operator not in self.op_mgr.binary_ops:
-                raise ValueError(f'Token无法解析为双目运算符：{self.current_token}')
-            precedence = self.op_mgr.binary_precedences[operator]
-            if precedence <= min_precedence:
-                break
-            self.advance()
-            right = self.parse_expression(precedence)
-            left = BinaryOpNode(self.op_mgr, operator, left, right)
+            operators = frame.operators
+            if token_type == TokenType.OPERATOR:
+                operator = token.value
+                if operator not in binary_ops:
+                    raise ValueError(f'Token无法解析为双目运算符：{token}')
+                precedence = precedences[operator]
+                # 左结合: 先规约优先级不低于当前运算符的部分
+                while operators and operators[-1][0] >= precedence:
+                    _, op, left = operators.pop()
+                    node = BinaryOpNode(op_mgr, op, left, node)
+                operators.append((precedence, operator, node))
+                node = None
+                self.position += 1
+                self.current_token = tokens[self.position]
+                continue
 
-        return left
+            # 表达式结束
+            while operators:
+                _, op, left = operators.pop()
+                node = BinaryOpNode(op_mgr, op, left, node)
+            if frame.kind == _ROOT:
+                if token_type != TokenType.EOF:
+                    raise ValueError(f'解析错误：意外的token {token}')
+                return node
+            if frame.kind == _ITEM:
+                node = self._end_slice_part(frames, node)
+            else:
+                node = self._end_element(frames, node)
+            frame = frames[-1]
 
-    def parse_unary(self) -> ASTNode:
-        """解析一元运算符"""
-        if self.current_token.type == TokenType.OPERATOR:
-            if self.current_token.value not in self.op_mgr.unary_ops:
-                raise ValueError(f'Token无法解析为单目运算符：{self.current_token}')
-            operator = self.current_token.value
+    def _end_element(self, frames: List[_Frame], node: ASTNode) -> Union[ASTNode, None]:
+        """圆括号或列表中的一个元素解析完毕, 返回None时继续解析下一个元素, 否则返回闭合后的节点"""
+        frame, token = frames[-1], self.current_token
+        if frame.keyword is not None:
+            frame.kwargs.add(frame.keyword, node)
+            frame.keyword = None
+        elif (frame.kind == _CALL and token.type == TokenType.ASSIGNMENT
+              and (isinstance(node, IdentifierNode) or frame.args or frame.kwargs.kwargs)):
+            if not isinstance(node, IdentifierNode):
+                raise ValueError(f'错误的赋值符号，位置: {token.position}')
+            frame.keyword = node.name
             self.advance()
-            operand = self.parse_unary()
-            return UnaryOpNode(self.op_mgr, operator, operand)
-
-        return self.parse_primary()
-
-    def parse_primary(self) -> ASTNode:
-        """解析基本表达式"""
-        token = self.current_token
+            return None
+        else:
+            if frame.kind == _CALL and frame.kwargs.kwargs:
+                raise ValueError(f'顺序参数必须在关键字参数前，位置：{token.position}')
+            frame.args.append(node)
 
-        # 数字
-        if token.type == TokenType.NUMBER:
-            ret = NumberNode(token.value)
-            self.advance()
-        # 字符串
-        elif token.type == TokenType.STRING:
-            ret = StringNode(token.value)
-            self.advance()
-        # 变量/函数调用
-        elif token.type == TokenType.IDENTIFIER:
-            if token.value not in self.identifier_nodes:
-                self.identifier_nodes[token.value] = IdentifierNode(self.func_mgr, token.value)
-            ret = self.identifier_nodes[token.value]
+        if token.type == TokenType.COMMA:
             self.advance()
-        # 圆括号表达式
-        elif token.type == TokenType.LPAREN:
-            ret = self.parse_parenthesis()
-        # 方括号表达式
-        elif token.type == TokenType.LSQUARE:
-            ret = self.parse_square()
-        else:
-            raise ValueError(f'意外的token：{token}')
+            closing = TokenType.RSQUARE if frame.kind == _LIST else TokenType.RPAREN
+            if self.current_token.type != closing:
+                return None
+            frame.extra_comma = True
+        return self._close(frames)
 
+    def _end_slice_part(self, frames: List[_Frame], node: Union[ASTNode, None]) -> Union[ASTNode, None]:
+        """下标中的一个表达式解析完毕, 处理其后的冒号及逗号, 返回值同_end_element"""
+        frame = frames[-1]
+        if node is not None:
+            frame.parts.append(node)
+            if self.current_token.type == TokenType.COLON:
+                frame.is_slice = True
+                frame.colons += 1
+                self.advance()
         while True:
-            if self.current_token.type == TokenType.LPAREN:
-                ret = self.parse_parenthesis(ret)
-            elif self.current_token.type == TokenType.LSQUARE:
-                ret = self.parse_square(ret)
-            elif self.current_token.type == TokenType.ATTRIBUTION:
-                ret = AttributionNode(ret, self.current_token.value[:])
+            token_type = self.current_token.type
+            if token_type == TokenType.COLON:
+                frame.parts.append(NoneNode())
+                frame.is_slice = True
+                frame.colons += 1
                 self.advance()
-            elif self.current_token.type in (TokenType.STRING, TokenType.NUMBER, TokenType.IDENTIFIER):
-                raise ValueError(f'意外的token：{self.current_token}')
-            else:
+                continue
+            if token_type not in (TokenType.COMMA, TokenType.RSQUARE):
+                return None
+            frame.args.append(self._slice(frame))
+            if token_type == TokenType.RSQUARE:
                 break
-        return ret
-
-    def parse_parenthesis(self, func: ASTNode=None) -> ASTNode:
-        start_position = self.current_token.position
-        self.advance()
-        # 解析参数列表
-        is_func = func is not None
-        args, kwargs, extra_comma = ArgsNode([]), KwargsNode({}), False
-        if self.current_token.type != TokenType.RPAREN:
-            node = self.parse_expression()
-            if is_func and isinstance(node, IdentifierNode) and self.current_token.type == TokenType.ASSIGNMENT:
-                self.advance()
-                kwargs.add(node.name, self.parse_expression())
-            else:
-                args.append(node)
-            while self.current_token.type == TokenType.COMMA:
-                self.advance()
-                if self.current_token.type == TokenType.RPAREN:
-                    if len(args) + len(kwargs) == 0:
-                        raise ValueError(f'意外的token：{self.current_token}')
-                    extra_comma = True
-                else:
-                    node = self.parse_expression()
-                    if is_func:
-                        if self.current_token.type == TokenType.ASSIGNMENT:
-                            if not isinstance(node, IdentifierNode):
-                                raise ValueError(f'错误的赋值符号，位置: {self.current_token.position}')
-                            self.advance()
-                            kwargs.add(node.name, self.parse_expression())
-                        else:
-                            if kwargs:
-                                raise ValueError(f'顺序参数必须在关键字参数前，位置：{self.current_token.position}')
-                            args.append(node)
-                    else:
-                        args.append(node)
-        if self.current_token.type != TokenType.RPAREN:
-            raise ValueError(f'缺少右圆括号，位置：{start_position}')
-        self.advance()
-        if is_func:
-            return FunctionCallNode(func, args, kwargs)
-        else:
-            if kwargs:
-                raise KeyError(f'元组推导式不支持keyword，位置：{start_position}')
-            if len(args) == 1 and not extra_comma:
-                return args[0]
-            else:
-                return args.to_tuple()
-
-    def parse_square(self, slice_obj: ASTNode=None) -> ASTNode:
-        self.advance()
-        # 解析参数列表
-        is_slice = slice_obj is not None
-        args, extra_comma = ArgsNode([]), False
-        parse_func = self.parse_slice if is_slice else self.parse_expression
-        if self.current_token.type != TokenType.RSQUARE:
-            args.append(parse_func())
-            while self.current_token.type == TokenType.COMMA:
-                self.advance()
-                if self.current_token.type == TokenType.RSQUARE:
-                    if len(args) == 0:
-                        raise ValueError(f'意外的token：{self.current_token}')
-                    extra_comma = True
-                else:
-                    args.append(parse_func())
-        if self.current_token.type != TokenType.RSQUARE:
-            raise ValueError(f'缺少右圆括号，位置：{self.current_token.position}')
-        self.advance()
-        if is_slice:
-            if len(args) == 1 and not extra_comma:
-                return ItemNode(slice_obj, args[0])
-            else:
-                return ItemNode(slice_obj, args.to_tuple())
-        else:
-            return args.to_list()
+            self.advance()
+            if self.current_token.type == TokenType.RSQUARE:
+                frame.extra_comma = True
+                break
+            frame.position, frame.parts, frame.colons, frame.is_slice = self.current_token.position, [], 0, False
+        return self._close(frames)
 
-    def parse_slice(self):
-        cur_position = self.current_token.position
-        args, is_slice, colon_cnt = [], False, 0
-        while self.current_token.type not in (TokenType.COMMA, TokenType.RSQUARE):
-            if self.current_token.type == TokenType.COLON:
-                args.append(NoneNode())
-                is_slice = True
-                colon_cnt += 1
-                self.advance()
-            else:
-                args.append(self.parse_expression())
-                if self.current_token.type == TokenType.COLON:
-                    is_slice = True
-                    colon_cnt += 1
-                    self.advance()
-        if is_slice:
+    @staticmethod
+    def _slice(frame: _Frame) -> ASTNode:
+        """由下标中一个元素的各部分构造切片或表达式"""
+        args, position = frame.parts, frame.position
+        if frame.is_slice:
             if len(args) > 3:
-                raise ValueError(f'切片参数个数大于3，位置：{cur_position}')
-            if colon_cnt > 2:
-                raise ValueError(f'冒号过多，位置：{cur_position}')
+                raise ValueError(f'切片参数个数大于3，位置：{position}')
+            if frame.colons > 2:
+                raise ValueError(f'冒号过多，位置：{position}')
             start, end, stop = args + [NoneNode() for _ in range(3-len(args))]
             return SliceNode(start, end, stop)
-        else:
-            if len(args) != 1:
-                raise ValueError(f'切片参数解析失败，位置：{cur_position}')
-            return args[0]
+        if len(args) != 1:
+            raise ValueError(f'切片参数解析失败，位置：{position}')
+        return args[0]
+
+    def _close(self, frames: List[_Frame]) -> ASTNode:
+        """检查右括号并弹出当前帧, 返回括号对应的节点"""
+        frame, token = frames.pop(), self.current_token
+        if frame.kind in (_LIST, _ITEM):
+            if token.type != TokenType.RSQUARE:
+                raise ValueError(f'缺少右圆括号，位置：{token.position}')
+        elif token.type != TokenType.RPAREN:
+            raise ValueError(f'缺少右圆括号，位置：{frame.position}')
+        self.advance()
+
+        args = frame.args
+        if frame.kind == _CALL:
+            return FunctionCallNode(frame.func, ArgsNode(args), frame.kwargs)
+        if frame.kind == _LIST:
+            return ListNode(args)
+        if len(args) == 1 and not frame.extra_comma:
+            return args[0] if frame.kind == _GROUP else ItemNode(frame.func, args[0])
+        return TupleNode(args) if frame.kind == _GROUP else ItemNode(frame.func, TupleNode(args))
+
+class CacheInfo(NamedTuple):
+    """解析缓存统计信息"""
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class RegistrySnapshot(NamedTuple):
+    """运算符及函数注册表的只读快照"""
+    operators: OperatorSnapshot
+    functions: FunctionSnapshot
+
 
 class Parser:
-    def __init__(self):
+    def __init__(self, cache_size: int = 256):
+        """cache_size为解析缓存的最大条目数, 为0时不缓存"""
+        if cache_size < 0:
+            raise ValueError(f'缓存大小不能小于0：{cache_size}')
         self.op_mgr = OperatorManager()
         self.func_mgr = FunctionManager()
 
-    def parse(self, text) -> ASTNode:
-        _parser = _Parser(self.op_mgr, self.func_mgr, text)
-        return _parser.parse()
+        self.cache_size = cache_size
+        self._cache: OrderedDict[Tuple[str, bool], ASTNode] = OrderedDict()
+        self._cache_version = self._registry_version()
+        self._cache_lock = Lock()
+        self._cache_hits = self._cache_misses = self._cache_evictions = 0
+
+    def _registry_version(self):
+        return self.op_mgr.version, self.func_mgr.version
+
+    def parse(self, text, optimize: bool = False) -> ASTNode:
+        """解析公式, 相同公式在注册表未变化时直接返回缓存的语法树
+
+        optimize为True时对语法树进行常量折叠及公共子表达式消除
+        """
+        key = (text, optimize)
+        # 语法树固定使用解析时的注册表快照, 之后的注册不影响已解析的语法树
+        registry = self.snapshot()
+        if not self.cache_size:
+            return self._parse(text, optimize, registry)
+
+        version = registry.operators.version, registry.functions.version
+        with self._cache_lock:
+            if version != self._cache_version:
+                # 注册表变化可能改变分词结果, 旧条目全部失效
+                self._cache.clear()
+                self._cache_version = version
+            ast = self._cache.get(key)
+            if ast is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+                return ast
+            self._cache_misses += 1
+
+        ast = self._parse(text, optimize, registry)
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._cache[key] = ast
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self._cache_evictions += 1
+        return ast
+
+    @staticmethod
+    def _parse(text, optimize: bool, registry: RegistrySnapshot) -> ASTNode:
+        ast = _Parser(registry.operators, registry.functions, text).parse()
+        if optimize:
+            ast = ast.optimize()
+        return ast
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self._cache_hits, self._cache_misses, self._cache_evictions, self.cache_size, len(self._cache))
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_hits = self._cache_misses = self._cache_evictions = 0
+
+    def compile(self, text) -> Callable[[Union[Dict[str, Any], None]], Any]:
+        """解析公式并编译为可重复调用的闭包"""
+        return self.parse(text).compile()
+
+    def compile_many(self, formulas: Dict[str, Union[str, ASTNode]], as_tuple: bool = False):
+        """将多个命名公式融合为一个可调用对象, 跨公式共享公共子表达式, 详见formulaparser.fused"""
+        from formulaparser.fused import FusedFormulas
+        return FusedFormulas({name: self.parse(f) if isinstance(f, str) else f for name, f in formulas.items()},
+                             as_tuple)
+
+    def snapshot(self) -> RegistrySnapshot:
+        """当前运算符及函数注册表的只读快照, 可传给ASTNode.bind; 不复制注册表, 可在多线程中随时调用"""
+        return RegistrySnapshot(self.op_mgr.snapshot(), self.func_mgr.snapshot())
+
+    def bind(self, text, variables: Union[Iterable[str], None] = None, shadowable: Union[bool, Iterable[str]] = True):
+        """解析公式并以当前注册表的快照绑定, 详见formulaparser.bind"""
+        return self.parse(text).bind(variables, self.snapshot(), shadowable)
+
+    def loads(self, data: bytes) -> ASTNode:
+        """加载ASTNode.dumps的序列化结果, 运算符及函数绑定到当前解析器注册表的快照"""
+        from formulaparser.compact import CompactAST
+        registry = self.snapshot()
+        return CompactAST.loads(data, registry.operators, registry.functions).to_ast()
+
+    def dump_catalog(self, path, formulas: Dict[str, Union[str, ASTNode]]):
+        """将命名公式写入可通过mmap按名称读取的目录文件"""
+        from formulaparser.catalog import write_catalog
+        write_catalog(path, {name: self.parse(f) if isinstance(f, str) else f for name, f in formulas.items()})
+
+    def open_catalog(self, path):
+        """打开目录文件, 公式在按名称访问时才解码, 详见formulaparser.catalog"""
+        from formulaparser.catalog import Catalog
+        return Catalog(path, self)
+
+    def evaluate_batch(self, text_or_ast: Union[str, ASTNode], rows, workers: Union[int, None] = None,
+                       chunk_size: Union[int, None] = None) -> List[Any]:
+        """多进程批量求值, 结果顺序与行顺序一致, 详见formulaparser.batch"""
+        from formulaparser.batch import evaluate_batch
+        ast = self.parse(text_or_ast) if isinstance(text_or_ast, str) else text_or_ast
+        return evaluate_batch(ast, rows, workers, chunk_size)
+
+    def register_function(self, name: str, func: Callable, vectorized: bool = False, pure: bool = False,
+                          cache: Union[int, MemoPolicy, None] = None, lazy: bool = False):
+        """注册函数
+
+        vectorized表示func可直接接收NumPy数组参数, 向量化求值时不再逐元素调用;
+        pure表示func为纯函数, 参数均为常量的调用可在优化时折叠;
+        cache为纯函数的结果缓存策略, 整数表示LRU缓存的大小, 详见formulaparser.memo;
+        lazy表示func为惰性函数, 每个参数以无参的thunk传入, 调用thunk时才对该参数求值
+        """
+        self.func_mgr.register_func(name, func, vectorized, pure, cache, lazy)
+
+    def memo_info(self, name: str) -> MemoInfo:
+        """函数结果缓存的命中、未命中等统计"""
+        return self.func_mgr.memo_info(name)
 
-    def register_function(self, name: str, func: Callable):
-        self.func_mgr.register_func(name, func)
+    def clear_memo(self, name: Union[str, None] = None):
+        """清空name或所有函数的结果缓存及统计"""
+        self.func_mgr.clear_memo(name)
 
-    def register_binary_op(self, op: str, func: Callable[[Any, Any], Any], precedence: int):
-        self.op_mgr.register_binary_op(op, func, precedence)
+    def register_binary_op(self, op: str, func: Callable[[Any, Any], Any], precedence: int, vectorized: bool = False,
+                           pure: bool = False):
+        self.op_mgr.register_binary_op(op, func, precedence, vectorized, pure)
 
-    def register_unary_op(self, op: str, func: Callable[[Any], Any]):
-        self.op_mgr.register_unary_op(op, func)
+    def register_unary_op(self, op: str, func: Callable[[Any], Any], vectorized: bool = False, pure: bool = False):
+        self.op_mgr.register_unary_op(op, func, vectorized, pure)
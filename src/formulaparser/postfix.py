@@ -0,0 +1,196 @@
+"""后缀指令求值
+
+将语法树一次性线性化为后缀指令序列, 求值时在显式的值栈上循环执行, 不使用Python递归,
+语法树深度只受内存限制。结果及异常与ASTNode.evaluate一致。
+惰性函数的每个参数生成独立的指令序列, 仅在函数调用其thunk时执行。
+"""
+from functools import partial
+from operator import getitem, attrgetter
+from typing import Any, Dict, List, Tuple, Union
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, FunctionCallNode, SharedNode, CSENode, _SHAREABLE_TYPES
+)
+
+(
+    PUSH, LOAD, BINARY_OP, BINARY_OP_PUSH, BINARY_OP_LOAD, UNARY_OP, CALL, ATTRIBUTION, ITEM, BUILD_TUPLE, BUILD_LIST,
+    BUILD_SLICE, GUARD, SHARED_BEGIN, SHARED_END, CSE, JUMP, EVALUATE, LAZY_CALL
+) = range(19)
+
+
+def _linearize(root: ASTNode) -> List[list]:
+    """非递归地生成后缀指令, 跳转目标在子节点生成后回填"""
+    code: List[list] = []
+    actions: List[Tuple[str, Any]] = [('visit', root)]
+    last_target = -1
+
+    while actions:
+        action, item = actions.pop()
+        if action == 'emit':
+            # 右操作数为常量或变量的双目运算合并为一条指令, 被合并的指令不能是跳转目标
+            if item[0] == BINARY_OP and code and code[-1][0] in (PUSH, LOAD) and last_target < len(code) - 1:
+                operand = code.pop()
+                item = [BINARY_OP_PUSH if operand[0] == PUSH else BINARY_OP_LOAD, (item[1], operand[1])]
+            code.append(item)
+            continue
+        if action == 'patch':
+            # 回填跳转目标为当前位置
+            item[-1] = last_target = len(code)
+            continue
+
+        node = item
+        if isinstance(node, (NumberNode, StringNode)):
+            code.append([PUSH, node.value])
+        elif isinstance(node, NoneNode):
+            code.append([PUSH, None])
+        elif isinstance(node, IdentifierNode):
+            code.append([LOAD, (node.name, node.func_mgr)])
+        elif isinstance(node, BinaryOpNode):
+            actions += [('emit', [BINARY_OP, node.op_mgr.binary_funcs[node.operator]]),
+                        ('visit', node.right), ('visit', node.left)]
+        elif isinstance(node, UnaryOpNode):
+            actions += [('emit', [UNARY_OP, node.op_mgr.unary_funcs[node.operator]]), ('visit', node.operand)]
+        elif isinstance(node, FunctionCallNode) and node.is_lazy():
+            # 惰性函数的每个参数线性化为独立的指令序列, 以thunk传入
+            kwargs = node.kwargs.kwargs
+            code.append([LAZY_CALL, node.func.name, node.func.func_mgr, tuple(map(PostfixProgram, node.args.args)),
+                         tuple(kwargs), tuple(map(PostfixProgram, kwargs.values()))])
+        elif isinstance(node, FunctionCallNode):
+            args, kwargs = node.args.args, node.kwargs.kwargs
+            actions.append(('emit', [CALL, (len(args), tuple(kwargs))]))
+            actions += [('visit', v) for v in reversed(kwargs.values())]
+            actions += [('visit', arg) for arg in reversed(args)]
+            actions.append(('visit', node.func))
+        elif isinstance(node, AttributionNode):
+            actions += [('emit', [ATTRIBUTION, attrgetter('.'.join(node.properties))]), ('visit', node.obj)]
+        elif isinstance(node, ItemNode):
+            actions += [('emit', [ITEM, None]), ('visit', node.slice_obj), ('visit', node.obj)]
+        elif isinstance(node, (TupleNode, ListNode)):
+            actions.append(('emit', [BUILD_TUPLE if isinstance(node, TupleNode) else BUILD_LIST, len(node.args)]))
+            actions += [('visit', arg) for arg in reversed(node.args)]
+        elif isinstance(node, SliceNode):
+            actions += [('emit', [BUILD_SLICE, None]), ('visit', node.step), ('visit', node.stop), ('visit', node.start)]
+        elif isinstance(node, ConstantNode):
+            if not node.names:
+                code.append([PUSH, node.value])
+                continue
+            # 上下文未覆盖names时压入常量并跳过原节点的指令
+            guard = [GUARD, node.names, node.value, None]
+            code.append(guard)
+            actions += [('patch', guard), ('visit', node.original)]
+        elif isinstance(node, SharedNode):
+            # 已计算过时压入共用的值并跳过子节点的指令
+            begin = [SHARED_BEGIN, id(node), None]
+            code.append(begin)
+            actions += [('patch', begin), ('emit', [SHARED_END, id(node)]), ('visit', node.node)]
+        elif isinstance(node, CSENode):
+            # 上下文覆盖names时跳转到原语法树的指令
+            cse, jump = [CSE, node.names, None], [JUMP, None]
+            code.append(cse)
+            actions += [('patch', jump), ('visit', node.original), ('patch', cse), ('emit', jump), ('visit', node.body)]
+        else:
+            code.append([EVALUATE, node])
+    return code
+
+
+class PostfixProgram:
+    """后缀指令序列, 调用时按evaluate的语义求值"""
+
+    def __init__(self, node: ASTNode):
+        # 每条指令为(操作码, 参数), 多个参数合为元组
+        self.code: Tuple[Tuple[int, Any], ...] = tuple(
+            (op, args[0] if len(args) == 1 else tuple(args)) for op, *args in _linearize(node)
+        )
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def evaluate(self, context: Union[Dict[str, Any], None] = None) -> Any:
+        code, size = self.code, len(self.code)
+        variables = context if context else {}
+        stack: List[Any] = []
+        push, pop = stack.append, stack.pop
+        shared: Union[Dict[int, Any], None] = None
+        pc = 0
+        while pc < size:
+            op, arg = code[pc]
+            pc += 1
+            if op == LOAD:
+                name, func_mgr = arg
+                if name in variables:
+                    push(variables[name])
+                elif func_mgr.has_func(name):
+                    push(func_mgr.get_func(name))
+                else:
+                    raise KeyError(f'{name} not found')
+            elif op == BINARY_OP_LOAD:
+                func, (name, func_mgr) = arg
+                if name in variables:
+                    stack[-1] = func(stack[-1], variables[name])
+                elif func_mgr.has_func(name):
+                    stack[-1] = func(stack[-1], func_mgr.get_func(name))
+                else:
+                    raise KeyError(f'{name} not found')
+            elif op == PUSH:
+                push(arg)
+            elif op == BINARY_OP_PUSH:
+                stack[-1] = arg[0](stack[-1], arg[1])
+            elif op == BINARY_OP:
+                right = pop()
+                stack[-1] = arg(stack[-1], right)
+            elif op == CALL:
+                n_args, names = arg
+                total = n_args + len(names)
+                values = stack[len(stack) - total:]
+                del stack[len(stack) - total:]
+                if names:
+                    stack[-1] = stack[-1](*values[:n_args], **dict(zip(names, values[n_args:])))
+                else:
+                    stack[-1] = stack[-1](*values)
+            elif op == UNARY_OP or op == ATTRIBUTION:
+                stack[-1] = arg(stack[-1])
+            elif op == ITEM:
+                index = pop()
+                stack[-1] = getitem(stack[-1], index)
+            elif op == BUILD_TUPLE or op == BUILD_LIST:
+                values = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                push(tuple(values) if op == BUILD_TUPLE else values)
+            elif op == BUILD_SLICE:
+                step, stop = pop(), pop()
+                stack[-1] = slice(stack[-1], stop, step)
+            elif op == GUARD:
+                names, value, end = arg
+                if not any(name in variables for name in names):
+                    push(value)
+                    pc = end
+            elif op == SHARED_BEGIN:
+                key, end = arg
+                if shared is not None and key in shared:
+                    push(shared[key])
+                    pc = end
+            elif op == SHARED_END:
+                if shared is not None and type(stack[-1]) in _SHAREABLE_TYPES:
+                    shared[arg] = stack[-1]
+            elif op == CSE:
+                names, original = arg
+                if any(name in variables for name in names):
+                    pc = original
+                else:
+                    shared = {}
+            elif op == JUMP:
+                pc = arg
+            elif op == LAZY_CALL:
+                name, func_mgr, args, names, kwargs = arg
+                if name in variables:
+                    # 被上下文中的普通函数覆盖
+                    push(variables[name](*[a.evaluate(context) for a in args],
+                                         **{k: v.evaluate(context) for k, v in zip(names, kwargs)}))
+                else:
+                    push(func_mgr.get_func(name)(*[partial(a.evaluate, context) for a in args],
+                                                 **{k: partial(v.evaluate, context) for k, v in zip(names, kwargs)}))
+            else:
+                push(arg.evaluate(context))
+        return stack[-1]
+
+    __call__ = evaluate
@@ -0,0 +1,259 @@
+"""逐节点的求值性能分析
+
+Profiler通过独立的求值器记录每个语法树节点及每个函数/运算符符号的调用次数、累计耗时及自身耗时,
+结果可标注在render的树形视图上, 或导出为火焰图工具(flamegraph.pl、speedscope等)使用的折叠栈格式。
+普通的evaluate及compile路径不做任何检查, 不开启分析时没有额外开销。
+"""
+import time
+from dataclasses import dataclass
+from functools import partial
+from operator import getitem, attrgetter
+from typing import Any, Callable, Dict, Tuple, Union
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, SliceNode,
+    AttributionNode, TupleNode, ListNode, ItemNode, ArgsNode, KwargsNode, FunctionCallNode, SharedNode, CSENode,
+    render_tree, _SHAREABLE_TYPES
+)
+
+
+@dataclass(slots=True)
+class ProfileStats:
+    """调用次数、累计耗时及自身耗时（秒）, 自身耗时不含子节点"""
+    calls: int = 0
+    total: float = 0.0
+    self_time: float = 0.0
+
+
+def _call_name(node: FunctionCallNode) -> str:
+    """被调用函数在公式中的名称"""
+    func = node.func
+    if isinstance(func, IdentifierNode):
+        return func.name
+    if isinstance(func, AttributionNode):
+        properties = '.'.join(func.properties)
+        return f'{func.obj.name}.{properties}' if isinstance(func.obj, IdentifierNode) else f'.{properties}'
+    return '<call>'
+
+
+def _label(node: ASTNode) -> str:
+    if isinstance(node, FunctionCallNode):
+        label = f'Function({_call_name(node)})'
+    else:
+        label = node._render_info()[0]
+    # 折叠栈格式以分号分隔栈帧, 以最后一个空格分隔计数
+    return label.replace(';', ',').replace('\n', ' ')
+
+
+class Profiler:
+    """求值性能分析器, 多次求值的结果累计, 可用于同一解析器的多个语法树
+
+    nodes按节点对象记录统计, 同名变量在一次解析中为同一节点, 其统计合并;
+    symbols按符号记录函数、运算符、属性访问及下标的调用本身的耗时, 不含参数求值:
+    运算符为'op(+)'、'unary(-)', 函数为公式中的名称, 属性访问为'.属性', 下标为'[]'
+    """
+
+    def __init__(self, timer: Callable[[], float] = time.perf_counter):
+        self.timer = timer
+        self.nodes: Dict[int, ProfileStats] = {}
+        self.symbols: Dict[str, ProfileStats] = {}
+        # 以根节点到当前节点的标签序列为键累计自身耗时
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        # 持有被分析的节点, 避免其id被新对象复用
+        self._refs: Dict[int, ASTNode] = {}
+        self._labels: Dict[int, str] = {}
+
+    def evaluate(self, node: ASTNode, context: Union[Dict[str, Any], None] = None) -> Any:
+        """求值并记录耗时, 结果及异常与node.evaluate(context)一致"""
+        return _ProfilingEvaluator(self, context).visit(node, ())
+
+    def reset(self):
+        self.nodes.clear()
+        self.symbols.clear()
+        self.stacks.clear()
+        self._refs.clear()
+        self._labels.clear()
+
+    def stats(self, node: ASTNode) -> ProfileStats:
+        """节点的统计, 未被求值的节点返回全零的统计"""
+        return self.nodes.get(id(node), ProfileStats()) if self._refs.get(id(node)) is node else ProfileStats()
+
+    def render(self, node: ASTNode) -> str:
+        """在树形视图的每个节点后标注调用次数、累计耗时及自身耗时"""
+        def render_info(n: ASTNode):
+            head, leafs = n._render_info()
+            stats = self.stats(n)
+            if stats.calls:
+                head = (f'{head}  calls={stats.calls} total={stats.total * 1e3:.3f}ms '
+                        f'self={stats.self_time * 1e3:.3f}ms')
+            return head, leafs
+        return render_tree(node, render_info)
+
+    def report(self) -> str:
+        """按累计耗时降序列出各符号的统计"""
+        lines = [f'{"symbol":<24} {"calls":>10} {"total(ms)":>12} {"per call(us)":>14}']
+        for name, stats in sorted(self.symbols.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append(f'{name:<24} {stats.calls:>10} {stats.total * 1e3:>12.3f} '
+                         f'{stats.total / stats.calls * 1e6:>14.2f}')
+        return '\n'.join(lines)
+
+    def collapsed(self) -> str:
+        """导出折叠栈文本, 每行为以分号分隔的节点标签及该栈的自身耗时（纳秒）"""
+        lines = []
+        for stack, seconds in self.stacks.items():
+            count = round(seconds * 1e9)
+            if count > 0:
+                lines.append(f'{";".join(stack)} {count}')
+        return '\n'.join(lines)
+
+    def dump_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+            f.write('\n')
+
+
+class _ProfilingEvaluator:
+    """记录耗时的递归求值器, 各节点的语义与其evaluate一致"""
+
+    def __init__(self, profiler: Profiler, context: Union[Dict[str, Any], None]):
+        self.profiler = profiler
+        self.timer = profiler.timer
+        self.context = context
+        # 当前节点的子节点累计耗时
+        self._children = 0.0
+        self._shared_values: Union[Dict[int, Any], None] = None
+
+    def visit(self, node: ASTNode, stack: Tuple[str, ...]) -> Any:
+        profiler, key = self.profiler, id(node)
+        stats = profiler.nodes.get(key)
+        if stats is None or profiler._refs[key] is not node:
+            stats = profiler.nodes[key] = ProfileStats()
+            profiler._refs[key] = node
+            profiler._labels[key] = _label(node)
+        stack = (*stack, profiler._labels[key])
+
+        visit = getattr(self, f'visit_{type(node).__name__}', None)
+        children, self._children = self._children, 0.0
+        start = self.timer()
+        try:
+            if visit is None:
+                return node.evaluate(self.context)
+            return visit(node, stack)
+        finally:
+            elapsed = self.timer() - start
+            own = elapsed - self._children
+            self._children = children + elapsed
+            stats.calls += 1
+            stats.total += elapsed
+            stats.self_time += own
+            profiler.stacks[stack] = profiler.stacks.get(stack, 0.0) + own
+
+    def call(self, symbol: str, func, *args, **kwargs) -> Any:
+        """调用函数或运算符并按符号记录耗时"""
+        stats = self.profiler.symbols.get(symbol)
+        if stats is None:
+            stats = self.profiler.symbols[symbol] = ProfileStats()
+        start = self.timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = self.timer() - start
+            stats.calls += 1
+            stats.total += elapsed
+            stats.self_time += elapsed
+
+    def call_lazy(self, symbol: str, func, node: FunctionCallNode, stack: Tuple[str, ...]) -> Any:
+        """以thunk调用惰性函数, thunk中参数求值的耗时计入参数节点, 不计入符号统计"""
+        spent = 0.0
+
+        def thunk(arg: ASTNode) -> Any:
+            nonlocal spent
+            start = self.timer()
+            try:
+                return self.visit(arg, stack)
+            finally:
+                spent += self.timer() - start
+
+        try:
+            return self.call(symbol, func, *[partial(thunk, arg) for arg in node.args.args],
+                             **{k: partial(thunk, v) for k, v in node.kwargs.kwargs.items()})
+        finally:
+            stats = self.profiler.symbols[symbol]
+            stats.total -= spent
+            stats.self_time -= spent
+
+    def visit_NumberNode(self, node: NumberNode, stack) -> Any:
+        return node.value
+
+    def visit_StringNode(self, node: StringNode, stack) -> Any:
+        return node.value
+
+    def visit_NoneNode(self, node: NoneNode, stack) -> Any:
+        return None
+
+    def visit_IdentifierNode(self, node: IdentifierNode, stack) -> Any:
+        return node.evaluate(self.context)
+
+    def visit_ConstantNode(self, node: ConstantNode, stack) -> Any:
+        if self.context and any(name in self.context for name in node.names):
+            return self.visit(node.original, stack)
+        return node.value
+
+    def visit_SharedNode(self, node: SharedNode, stack) -> Any:
+        values = self._shared_values
+        if values is None:
+            return self.visit(node.node, stack)
+        key = id(node)
+        if key in values:
+            return values[key]
+        value = self.visit(node.node, stack)
+        if type(value) in _SHAREABLE_TYPES:
+            values[key] = value
+        return value
+
+    def visit_CSENode(self, node: CSENode, stack) -> Any:
+        if self.context and any(name in self.context for name in node.names):
+            return self.visit(node.original, stack)
+        values, self._shared_values = self._shared_values, {}
+        try:
+            return self.visit(node.body, stack)
+        finally:
+            self._shared_values = values
+
+    def visit_BinaryOpNode(self, node: BinaryOpNode, stack) -> Any:
+        func = node.op_mgr.binary_funcs[node.operator]
+        left, right = self.visit(node.left, stack), self.visit(node.right, stack)
+        return self.call(f'op({node.operator})', func, left, right)
+
+    def visit_UnaryOpNode(self, node: UnaryOpNode, stack) -> Any:
+        func = node.op_mgr.unary_funcs[node.operator]
+        return self.call(f'unary({node.operator})', func, self.visit(node.operand, stack))
+
+    def visit_SliceNode(self, node: SliceNode, stack) -> Any:
+        return slice(self.visit(node.start, stack), self.visit(node.stop, stack), self.visit(node.step, stack))
+
+    def visit_AttributionNode(self, node: AttributionNode, stack) -> Any:
+        properties = '.'.join(node.properties)
+        return self.call(f'.{properties}', attrgetter(properties), self.visit(node.obj, stack))
+
+    def visit_TupleNode(self, node: TupleNode, stack) -> Any:
+        return tuple(self.visit(arg, stack) for arg in node.args)
+
+    def visit_ListNode(self, node: ListNode, stack) -> Any:
+        return [self.visit(arg, stack) for arg in node.args]
+
+    def visit_ItemNode(self, node: ItemNode, stack) -> Any:
+        obj = self.visit(node.obj, stack)
+        return self.call('[]', getitem, obj, self.visit(node.slice_obj, stack))
+
+    def visit_ArgsNode(self, node: ArgsNode, stack) -> Any:
+        return [self.visit(arg, stack) for arg in node.args]
+
+    def visit_KwargsNode(self, node: KwargsNode, stack) -> Any:
+        return {k: self.visit(v, stack) for k, v in node.kwargs.items()}
+
+    def visit_FunctionCallNode(self, node: FunctionCallNode, stack) -> Any:
+        func = self.visit(node.func, stack)
+        if node.is_lazy(self.context):
+            return self.call_lazy(_call_name(node), func, node, stack)
+        args, kwargs = self.visit(node.args, stack), self.visit(node.kwargs, stack)
+        return self.call(_call_name(node), func, *args, **kwargs)
@@ -0,0 +1,465 @@
+"""基于NumPy的向量化批量求值
+
+columns将变量名映射为一维NumPy数组（每个元素对应一行）或其他值（所有行共用）。
+内置运算符与函数整体作用于数组，仅无法向量化的运算符、函数及语法节点退化为逐行计算。
+内置惰性函数按条件将行分组，每个参数只对选中它的行求值；声明为vectorized的惰性函数接收返回整列值的thunk，其他惰性函数逐行计算。
+NumPy为可选依赖，仅在调用向量化求值时导入。
+"""
+import math
+import inspect
+import operator
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Tuple, Callable, Union
+from formulaparser.func_manager import if_, and_then, or_else, coalesce
+from formulaparser.ast_nodes import (
+    ASTNode, NumberNode, StringNode, NoneNode, ConstantNode, BinaryOpNode, UnaryOpNode, IdentifierNode, TupleNode, ListNode,
+    FunctionCallNode, SharedNode, CSENode
+)
+
+# 逐元素计算结果中可直接组成数值数组的类型
+_NUMBER_TYPES = {int, float, bool, complex}
+# 依次求值参数的内置惰性函数, 以及参数的值可作为结果的条件
+_LAZY_CHAINS = {and_then: 'falsy', or_else: 'truthy', coalesce: 'not_none'}
+
+
+class _IntegerOverflow(ArithmeticError):
+    """整数运算的结果可能超出int64范围, NumPy会静默回绕, 需改为逐行求值"""
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError('向量化求值需要安装numpy：pip install "formulaparser[numpy]"') from e
+    return numpy
+
+
+@lru_cache(maxsize=None)
+def _builtin_impls(np) -> Dict[Callable, Callable]:
+    """内置运算符及函数到NumPy实现的映射, 以原函数对象为键, 与注册名称及上下文覆盖无关"""
+
+    int64_max = int(np.iinfo(np.int64).max)
+
+    def as_int(x):
+        # Python中bool参与算术运算时按int处理, NumPy的bool数组则按逻辑运算处理;
+        # 较短的整数及无符号整数数组提升为int64, 避免取负、相减等运算回绕
+        if isinstance(x, np.ndarray) and x.dtype.kind in 'biu' and x.dtype != np.int64:
+            if x.dtype == np.uint64 and len(x) and int(x.max()) > int64_max:
+                raise _IntegerOverflow
+            return x.astype(np.int64)
+        return x
+
+    def bound(x):
+        """整数参数的最大绝对值, 其他参数返回None"""
+        if isinstance(x, np.ndarray):
+            if x.dtype.kind not in 'iu':
+                return None
+            return max(-int(x.min()), int(x.max())) if len(x) else 0
+        if isinstance(x, (int, np.integer, np.bool_)):
+            return abs(int(x))
+        return None
+
+    def arithmetic(ufunc, limit=None):
+        # 参数均为整数时由各参数的最大绝对值判断结果是否可能超出int64, 可能超出时改为逐行求值
+        def impl(*args):
+            args = [as_int(arg) for arg in args]
+            if limit is not None:
+                bounds = [bound(arg) for arg in args]
+                if None not in bounds and not limit(*bounds):
+                    raise _IntegerOverflow
+            return ufunc(*args)
+        return impl
+
+    def shift(ufunc, left):
+        def impl(x, n):
+            x, n = as_int(x), as_int(n)
+            bx, bn = bound(x), bound(n)
+            if bx is not None and bn is not None:
+                if (n.min() if isinstance(n, np.ndarray) and len(n) else n) < 0:
+                    # 负的移位数在Python中抛出ValueError, 逐元素计算
+                    raise ValueError('不可向量化的参数')
+                if bn > 63 or (left and bx.bit_length() + bn > 63):
+                    raise _IntegerOverflow
+            return ufunc(x, n)
+        return impl
+
+    def power_limit(a, b):
+        return a <= 1 or a.bit_length() * b <= 63
+
+    add = arithmetic(np.add, lambda a, b: a + b <= int64_max)
+
+    def select(cmp):
+        # 与内置max/min一致: 仅当后续元素严格更大/更小时才替换, 对NaN的处理也相同
+        def impl(*args):
+            if len(args) == 1:
+                if not isinstance(args[0], (tuple, list)):
+                    raise TypeError('不可向量化的参数')
+                values = args[0]
+            else:
+                values = args
+            if not any(isinstance(v, np.ndarray) for v in values):
+                raise TypeError('不可向量化的参数')
+            values = same_dtype(values)
+            ans = values[0]
+            for v in values[1:]:
+                ans = np.where(cmp(v, ans), v, ans)
+            return ans
+        return impl
+
+    def same_dtype(values):
+        """各参数类型一致时返回参数（整数数组统一为int64）, 否则抛出TypeError以逐元素计算"""
+        # np.where会将不同类型的参数转为同一类型（如整数转为浮点数）, 而内置max/min返回被选中的参数本身
+        arrays = [v for v in values if isinstance(v, np.ndarray)]
+        dtypes = {v.dtype for v in arrays}
+        if all(d.kind in 'iu' for d in dtypes) and np.dtype(np.uint64) not in dtypes:
+            if not all(isinstance(v, np.ndarray) or (type(v) is int and abs(v) <= int64_max) for v in values):
+                raise TypeError('不可向量化的参数')
+            return [v.astype(np.int64) if isinstance(v, np.ndarray) else v for v in values]
+        scalar = {'f': float, 'b': bool, 'U': str}.get(dtypes.pop().kind) if len(dtypes) == 1 else None
+        if scalar is None or not all(isinstance(v, np.ndarray) or type(v) is scalar for v in values):
+            raise TypeError('不可向量化的参数')
+        return values
+
+    def floating(ufunc):
+        # 整数及bool数组直接调用时结果可能为float16等低精度类型, 与math函数一样先转为float64
+        def impl(*args):
+            return ufunc(*[as_float(arg) for arg in args])
+        return impl
+
+    def as_float(x):
+        if isinstance(x, np.ndarray) and x.dtype.kind in 'biu':
+            return x.astype(np.float64)
+        return x
+
+    def is_integer(x):
+        if isinstance(x, np.ndarray):
+            return x.dtype.kind in 'iub'
+        return isinstance(x, int)
+
+    def vector_sum(values, start=0):
+        # 浮点数求和时内置sum使用补偿求和, 逐项相加的结果可能不同, 因此仅向量化整数求和
+        if not isinstance(values, (tuple, list)) or not all(is_integer(v) for v in (start, *values)):
+            raise TypeError('不可向量化的参数')
+        ans = start
+        for v in values:
+            ans = add(ans, v)
+        return ans
+
+    def log(x, base=None):
+        if base is None:
+            return np.log(as_float(x))
+        return np.log(as_float(x)) / np.log(as_float(base))
+
+    impls = {
+        operator.add: add,
+        operator.sub: arithmetic(np.subtract, lambda a, b: a + b <= int64_max),
+        operator.mul: arithmetic(np.multiply, lambda a, b: a * b <= int64_max),
+        # 整数转为浮点数时超过2**53会损失精度, 与Python的整数除法结果不同
+        operator.truediv: arithmetic(np.true_divide, lambda a, b: max(a, b) <= 2 ** 53),
+        operator.floordiv: arithmetic(np.floor_divide, lambda a, b: max(a, b) <= int64_max),
+        operator.mod: arithmetic(np.mod, lambda a, b: max(a, b) <= int64_max),
+        operator.pow: arithmetic(np.power, power_limit),
+        operator.lshift: shift(np.left_shift, True),
+        operator.rshift: shift(np.right_shift, False),
+        operator.neg: arithmetic(np.negative, lambda a: a <= int64_max),
+        operator.pos: arithmetic(np.positive),
+        operator.invert: arithmetic(np.invert),
+        operator.and_: np.bitwise_and,
+        operator.or_: np.bitwise_or,
+        operator.xor: np.bitwise_xor,
+        operator.lt: np.less,
+        operator.le: np.less_equal,
+        operator.eq: np.equal,
+        operator.ne: np.not_equal,
+        operator.ge: np.greater_equal,
+        operator.gt: np.greater,
+        abs: arithmetic(np.abs, lambda a: a <= int64_max),
+        max: select(operator.gt),
+        min: select(operator.lt),
+        sum: vector_sum,
+        math.sin: floating(np.sin),
+        math.cos: floating(np.cos),
+        math.tan: floating(np.tan),
+        math.exp: floating(np.exp),
+        math.sqrt: floating(np.sqrt),
+        math.log: log,
+    }
+    return impls
+
+
+class _Vectorizer:
+    """向量化求值器, 节点求值结果为数组（按行变化）或普通值（所有行相同）"""
+
+    def __init__(self, np, columns: Dict[str, Any]):
+        self.np = np
+        self.columns = columns
+        self.impls = _builtin_impls(np)
+
+        sizes = {len(v) for v in columns.values() if isinstance(v, np.ndarray)}
+        if any(v.ndim != 1 for v in columns.values() if isinstance(v, np.ndarray)):
+            raise ValueError('向量化求值仅支持一维数组')
+        if len(sizes) > 1:
+            raise ValueError(f'数组长度不一致：{sorted(sizes)}')
+        self.size = sizes.pop() if sizes else None
+        self._row_lists = None
+        self._shared_values: Dict[int, Any] = {}
+
+    def evaluate(self, node: ASTNode) -> Any:
+        np = self.np
+        if self.size is None:
+            return node.evaluate(self.columns)
+        try:
+            with np.errstate(divide='raise', over='raise', invalid='raise'):
+                result = self.visit(node)
+        except (FloatingPointError, _IntegerOverflow):
+            # 除零、溢出（包括整数超出int64）等情况下逐行求值, 以得到与evaluate完全一致的结果或异常
+            return self.to_array(self.rowwise(node))
+        if isinstance(result, np.ndarray):
+            return result
+        return self.to_array(self.rows(result))
+
+    def visit(self, node: ASTNode) -> Any:
+        visit = getattr(self, f'visit_{type(node).__name__}', None)
+        if visit is None:
+            return self.to_array(self.rowwise(node))
+        return visit(node)
+
+    def visit_NumberNode(self, node: NumberNode) -> Any:
+        return node.value
+
+    def visit_StringNode(self, node: StringNode) -> Any:
+        return node.value
+
+    def visit_NoneNode(self, node: NoneNode) -> Any:
+        return None
+
+    def visit_ConstantNode(self, node: ConstantNode) -> Any:
+        if any(name in self.columns for name in node.names):
+            return self.visit(node.original)
+        return node.value
+
+    def visit_SharedNode(self, node: SharedNode) -> Any:
+        key = id(node)
+        if key not in self._shared_values:
+            self._shared_values[key] = self.visit(node.node)
+        return self._shared_values[key]
+
+    def visit_CSENode(self, node: CSENode) -> Any:
+        if any(name in self.columns for name in node.names):
+            return self.visit(node.original)
+        return self.visit(node.body)
+
+    def visit_IdentifierNode(self, node: IdentifierNode) -> Any:
+        return node.evaluate(self.columns)
+
+    def visit_BinaryOpNode(self, node: BinaryOpNode) -> Any:
+        func = node.op_mgr.binary_funcs[node.operator]
+        args = (self.visit(node.left), self.visit(node.right))
+        return self.apply(func, args, {}, node.operator in node.op_mgr.vectorized_binary_ops)
+
+    def visit_UnaryOpNode(self, node: UnaryOpNode) -> Any:
+        func = node.op_mgr.unary_funcs[node.operator]
+        args = (self.visit(node.operand),)
+        return self.apply(func, args, {}, node.operator in node.op_mgr.vectorized_unary_ops)
+
+    def visit_TupleNode(self, node: TupleNode) -> Any:
+        return tuple(self.visit(arg) for arg in node.args)
+
+    def visit_ListNode(self, node: ListNode) -> Any:
+        return [self.visit(arg) for arg in node.args]
+
+    def visit_FunctionCallNode(self, node: FunctionCallNode) -> Any:
+        func = self.visit(node.func)
+        if node.is_lazy(self.columns):
+            return self.lazy_call(func, node)
+        args = tuple(self.visit(arg) for arg in node.args.args)
+        kwargs = {k: self.visit(v) for k, v in node.kwargs.kwargs.items()}
+        vectorized = (
+            isinstance(node.func, IdentifierNode)
+            and node.func.name not in self.columns
+            and node.func.name in node.func.func_mgr.vectorized_functions
+        )
+        return self.apply(func, args, kwargs, vectorized)
+
+    def lazy_call(self, func: Callable, node: FunctionCallNode) -> Any:
+        args, kwargs = node.args.args, node.kwargs.kwargs
+        if func is if_:
+            try:
+                bound = inspect.signature(if_).bind(*args, **kwargs)
+            except TypeError:
+                return self.to_array(self.rowwise(node))
+            return self.lazy_if(**bound.arguments)
+        if func in _LAZY_CHAINS and not kwargs and (args or func is coalesce):
+            return self.lazy_chain(args, _LAZY_CHAINS[func])
+        if node.func.name in node.func.func_mgr.vectorized_functions:
+            # 可向量化的惰性函数, thunk返回整列的值
+            return func(*[partial(self.visit, arg) for arg in args],
+                        **{k: partial(self.visit, v) for k, v in kwargs.items()})
+        return self.to_array(self.rowwise(node))
+
+    def lazy_if(self, cond: ASTNode, then: ASTNode, otherwise: Union[ASTNode, None] = None) -> Any:
+        value = self.visit(cond)
+        if not isinstance(value, self.np.ndarray):
+            if value:
+                return self.visit(then)
+            return self.visit(otherwise) if otherwise is not None else None
+        mask = self.stops(value, 'truthy')
+        parts = []
+        for rows, branch in ((self.np.flatnonzero(mask), then), (self.np.flatnonzero(~mask), otherwise)):
+            if len(rows):
+                parts.append((rows, self.subset(branch, rows)))
+        return self.merge(parts)
+
+    def lazy_chain(self, nodes: List[ASTNode], stop: str) -> Any:
+        """依次对尚未确定结果的行求值参数, 值满足stop条件的行以该值为结果, 其余行继续求值下一个参数"""
+        np = self.np
+        parts, rows = [], None
+        for i, node in enumerate(nodes):
+            last = i == len(nodes) - 1
+            value = self.visit(node) if rows is None else self.subset(node, rows)
+            if rows is None:
+                # 值不随行变化时与普通求值相同
+                if not isinstance(value, np.ndarray):
+                    if last or self.stops(value, stop):
+                        return value
+                    continue
+                rows = np.arange(self.size)
+            if last:
+                parts.append((rows, value))
+                break
+            mask = self.stops(value, stop)
+            parts.append((rows[mask], value[mask]))
+            rows = rows[~mask]
+            if not len(rows):
+                break
+        return self.merge(parts) if parts else None
+
+    def stops(self, value: Any, stop: str) -> Any:
+        """值是否满足条件, value为数组时返回逐行的掩码"""
+        np = self.np
+        if not isinstance(value, np.ndarray):
+            return value is not None if stop == 'not_none' else bool(value) == (stop == 'truthy')
+        if stop == 'not_none':
+            if value.dtype != object:
+                return np.ones(len(value), dtype=bool)
+            return np.fromiter((v is not None for v in value), dtype=bool, count=len(value))
+        if value.dtype.kind in 'biufc':
+            truth = value != 0
+        elif value.dtype.kind == 'U':
+            truth = value != ''
+        else:
+            truth = np.fromiter((bool(v) for v in value), dtype=bool, count=len(value))
+        return truth if stop == 'truthy' else ~truth
+
+    def subset(self, node: Union[ASTNode, None], rows: Any) -> Any:
+        """仅对rows中的行求值, 返回长度与rows相同的数组, node为None时结果为None"""
+        np = self.np
+        if node is None:
+            return np.full(len(rows), None, dtype=object)
+        columns = {k: v[rows] if isinstance(v, np.ndarray) else v for k, v in self.columns.items()}
+        return _Vectorizer(np, columns).evaluate(node)
+
+    def merge(self, parts: List[Tuple[Any, Any]]) -> Any:
+        """将(行号, 结果)形式的各部分合并为完整的结果数组"""
+        np = self.np
+        if not parts:
+            return self.to_array([])
+        kinds = {part.dtype.kind for _, part in parts}
+        # 与to_array一致, 仅合并同类数组, 否则如int与float的分支会被转为同一类型
+        if len(kinds) == 1 and (kinds <= set('biufc') or kinds == {'U'}):
+            array = np.empty(self.size, dtype=np.result_type(*[part.dtype for _, part in parts]))
+            for rows, part in parts:
+                array[rows] = part
+            return array
+        # 与to_array一致, 对象数组中保存Python对象
+        array = np.empty(self.size, dtype=object)
+        for rows, part in parts:
+            for i, v in zip(rows.tolist(), part.tolist()):
+                array[i] = v
+        return array
+
+    def apply(self, func: Callable, args: Tuple, kwargs: Dict[str, Any], vectorized: bool) -> Any:
+        if isinstance(func, self.np.ndarray):
+            # 按行变化的可调用对象只能逐行调用
+            return self.elementwise(lambda f, *a, **kw: f(*a, **kw), (func,) + args, kwargs)
+        if not self.has_array(args) and not self.has_array(kwargs.values()):
+            return func(*args, **kwargs)
+        if vectorized:
+            return func(*args, **kwargs)
+        try:
+            impl = self.impls.get(func)
+        except TypeError:
+            impl = None
+        if impl is not None:
+            try:
+                return impl(*args, **kwargs)
+            except (TypeError, ValueError):
+                pass
+        return self.elementwise(func, args, kwargs)
+
+    def has_array(self, values) -> bool:
+        for v in values:
+            if isinstance(v, self.np.ndarray):
+                return True
+            if isinstance(v, (tuple, list)) and self.has_array(v):
+                return True
+        return False
+
+    def rows(self, value: Any) -> List[Any]:
+        """将求值结果展开为逐行的值"""
+        if isinstance(value, self.np.ndarray):
+            return value.tolist()
+        if isinstance(value, (tuple, list)) and self.has_array(value):
+            rows = zip(*[self.rows(v) for v in value])
+            return [tuple(row) for row in rows] if isinstance(value, tuple) else [list(row) for row in rows]
+        return [value] * self.size
+
+    def elementwise(self, func: Callable, args: Tuple, kwargs: Dict[str, Any]) -> Any:
+        arg_rows = [self.rows(arg) for arg in args]
+        if kwargs:
+            keys = list(kwargs)
+            kwarg_rows = [self.rows(kwargs[k]) for k in keys]
+            results = [
+                func(*row_args, **dict(zip(keys, row_kwargs)))
+                for row_args, row_kwargs in zip(zip(*arg_rows), zip(*kwarg_rows))
+            ] if arg_rows else [func(**dict(zip(keys, row_kwargs))) for row_kwargs in zip(*kwarg_rows)]
+        elif arg_rows:
+            results = [func(*row_args) for row_args in zip(*arg_rows)]
+        else:
+            results = [func() for _ in range(self.size)]
+        return self.to_array(results)
+
+    def rowwise(self, node: ASTNode) -> List[Any]:
+        """逐行调用evaluate计算节点的值"""
+        if self._row_lists is None:
+            self._row_lists = {k: v.tolist() for k, v in self.columns.items() if isinstance(v, self.np.ndarray)}
+        context = dict(self.columns)
+        results = []
+        for i in range(self.size):
+            for k, v in self._row_lists.items():
+                context[k] = v[i]
+            results.append(node.evaluate(context))
+        return results
+
+    def to_array(self, results: List[Any]) -> Any:
+        np = self.np
+        types = {type(v) for v in results}
+        # 类型不同的结果（如max返回的int与float）组成数值数组时会被转为同一类型, 保存为对象数组
+        if len(types) == 1 and (types <= _NUMBER_TYPES or types == {str}):
+            array = np.array(results)
+            # 超出int64范围的整数会被转为uint64或浮点数, 此时保存为Python整数
+            if array.ndim == 1 and array.dtype != object and (array.dtype.kind in 'ib' or not types <= {int, bool}):
+                return array
+        array = np.empty(len(results), dtype=object)
+        for i, v in enumerate(results):
+            array[i] = v
+        return array
+
+
+def evaluate_vectorized(node: ASTNode, columns: Union[Dict[str, Any], None] = None) -> Any:
+    """对一维数组形式的列数据批量求值, 返回每行结果组成的数组
+
+    结果与对每一行调用evaluate一致; 列中没有数组时等价于evaluate(columns)
+    """
+    np = _import_numpy()
+    return _Vectorizer(np, dict(columns or {})).evaluate(node)
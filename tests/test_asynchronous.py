@@ -0,0 +1,71 @@
+import time
+import asyncio
+import unittest
+
+from formulaparser import Parser
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = Parser()
+        self.active = self.max_active = 0
+
+        async def fx(x, delay=0.05):
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(delay)
+            self.active -= 1
+            if x < 0:
+                raise ValueError(f'负数：{x}')
+            return x * 10
+        self.parser.register_function('fx', fx)
+
+    def test_concurrent(self):
+        ast = self.parser.parse('fx(a) * fx(b) + fx(c)')
+        start = time.perf_counter()
+        self.assertEqual(asyncio.run(ast.evaluate_async(dict(a=1, b=2, c=3))), 230)
+        self.assertLess(time.perf_counter() - start, 0.12)
+        self.assertEqual(self.max_active, 3)
+
+        # 嵌套调用及多种语法节点
+        ast = self.parser.parse('[fx(fx(a)), (fx(b), 1)[0:1], fx(c, delay=0.01).real][fx(0) + 1:]')
+        self.assertEqual(asyncio.run(ast.evaluate_async(dict(a=1, b=2, c=3))), [(20,), 30])
+        self.assertEqual(asyncio.run(self.parser.parse('sqrt(a) + 1').evaluate_async(dict(a=4))), 3)
+
+    def test_limit(self):
+        ast = self.parser.parse('fx(1) + fx(2) + fx(3) + fx(4)')
+        self.assertEqual(asyncio.run(ast.evaluate_async(limit=2)), 100)
+        self.assertEqual(self.max_active, 2)
+        self.assertRaises(ValueError, asyncio.run, ast.evaluate_async(limit=0))
+
+    def test_exception(self):
+        # 多个子表达式出错时与evaluate一样抛出第一个
+        ast = self.parser.parse('fx(a, delay=0.05) + fx(b, delay=0.01)')
+        with self.assertRaises(ValueError) as cm:
+            asyncio.run(ast.evaluate_async(dict(a=-1, b=-2)))
+        self.assertIn('-1', str(cm.exception))
+        self.assertRaises(KeyError, asyncio.run, ast.evaluate_async(dict(a=1)))
+
+        # 缺少的变量在之前的子表达式出错之后报告
+        self.assertRaises(ValueError, asyncio.run, self.parser.parse('sqrt(a) + b').evaluate_async(dict(a=-1)))
+        self.assertRaises(ZeroDivisionError, asyncio.run, self.parser.parse('(1 / a, b)').evaluate_async(dict(a=0)))
+        with self.assertRaises(ValueError) as cm:
+            asyncio.run(self.parser.parse('[fx(a), b, fx(c)]').evaluate_async(dict(a=-1, c=-3)))
+        self.assertIn('-1', str(cm.exception))
+        # 出错的变量之后的子表达式不再求值
+        self.max_active = 0
+        self.assertRaises(KeyError, asyncio.run, self.parser.parse('(b, fx(1))').evaluate_async())
+        self.assertEqual(self.max_active, 0)
+
+    def test_optimized(self):
+        calls = []
+
+        async def heavy(x):
+            calls.append(x)
+            await asyncio.sleep(0.01)
+            return x + 1
+        self.parser.register_function('heavy', heavy, pure=True)
+        ast = self.parser.parse('heavy(a) * 2 + heavy(a) + sqrt(4)', optimize=True)
+        self.assertEqual(asyncio.run(ast.evaluate_async(dict(a=1))), 8)
+        self.assertEqual(calls, [1])
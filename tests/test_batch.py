@@ -0,0 +1,37 @@
+import unittest
+
+from formulaparser import Parser
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_evaluate_batch(self):
+        parser = Parser()
+        parser.register_function('clip', lambda x, lo: x if x > lo else lo)
+        parser.register_function('len', len)
+        ast = parser.parse('clip(a * 2, 0) + b + len(s)')
+        columns = dict(a=[i * 0.5 - 10 for i in range(101)], b=list(range(101)), s=[str(i) for i in range(101)])
+        rows = [dict(a=a, b=b, s=s) for a, b, s in zip(*columns.values())]
+        expected = [ast.evaluate(row) for row in rows]
+        self.assertEqual(parser.evaluate_batch(ast, columns, workers=2, chunk_size=7), expected)
+        self.assertEqual(parser.evaluate_batch('clip(a * 2, 0) + b + len(s)', rows, workers=3), expected)
+        self.assertEqual(parser.evaluate_batch(ast, rows, workers=1), expected)
+        self.assertEqual(parser.evaluate_batch(ast, [], workers=2), [])
+        self.assertEqual(parser.evaluate_batch('1 + 2', [{}] * 3, workers=2), [3, 3, 3])
+
+    def test_exception(self):
+        parser = Parser()
+
+        def check(x):
+            if x == 13:
+                raise ValueError('x不能为13')
+            return x
+        parser.register_function('check', check)
+        for workers in (1, 2):
+            with self.assertRaises(ValueError) as cm:
+                parser.evaluate_batch('check(x) + 1', dict(x=list(range(40))), workers=workers, chunk_size=5)
+            self.assertEqual(cm.exception.row, 13)
+            self.assertIn('位置：第13行', cm.exception.__notes__)
+        self.assertRaises(ValueError, parser.evaluate_batch, 'x', dict(x=[1, 2], y=[1]))
+        self.assertRaises(ValueError, parser.evaluate_batch, 'x', [dict(x=1), dict(y=1)])
+        self.assertRaises(ValueError, parser.evaluate_batch, 'x', dict(x=[1, 2]), workers=-1)
@@ -0,0 +1,125 @@
+import array
+import operator
+import unittest
+
+from formulaparser import Parser
+
+
+class TestBind(unittest.TestCase):
+
+    def test_bind(self):
+        parser = Parser()
+        variables = ['abc', 'bcd', 'xs', 'operator']
+        row = (5, 9, [1, 2, 3], operator)
+        context = dict(zip(variables, row))
+        cases = [
+            '2 + 3 * 4',
+            '-sqrt(4) + 10 - 2 * (1 + (3 + 5) * (7 * (1 + 2)))',
+            'max(1, 2, 3) + abc - bcd',
+            '2 * abc - abc * 2 + abc / bcd',
+            '"hello " + "world"',
+            'sum([1, 2, 9, abc][1:], start=0)',
+            '(1, 2, abc, 66, 55, 99)[1:4:2]',
+            'sum(xs[::2], start=bcd) + max((4 ,5 ,7)) * operator.add(abc, bcd)',
+            'operator.add.__name__',
+            'if_(abc > bcd, 1 / 0, coalesce(abc, 1 / 0))',
+            'max(abc, bcd) * max(abc, bcd) + sqrt(abc * bcd) - sqrt(abc * bcd)',
+            'abs(-2) * sqrt(16) + abc',
+        ]
+        for formula in cases:
+            for optimize in (False, True):
+                ast = parser.parse(formula, optimize)
+                bound = ast.bind(variables)
+                self.assertEqual(bound(row), ast.evaluate(context), formula)
+                self.assertEqual(bound(list(row)), ast.evaluate(context), formula)
+        self.assertEqual(bound.evaluate_many([row, (1, 1, [], operator)]), [13.0, 9.0])
+
+    def test_row_types(self):
+        parser = Parser()
+        bound = parser.parse('a * 2 + b - max(a, b) / c').bind(['a', 'b', 'c'])
+        expected = 3.5 * 2 + 1.5 - 3.5 / 2
+        for row in [(3.5, 1.5, 2.0), [3.5, 1.5, 2.0], array.array('d', [3.5, 1.5, 2.0]),
+                    memoryview(array.array('d', [3.5, 1.5, 2.0]))]:
+            self.assertEqual(bound(row), expected)
+        ints = memoryview(array.array('q', [1, 2, 3]))
+        self.assertEqual(bound(ints), 1 * 2 + 2 - 2 / 3)
+
+    def test_resolve(self):
+        parser = Parser()
+        # 变量覆盖同名函数, 包括被折叠及被共享的函数调用
+        ast = parser.parse('sqrt(16) + sqrt(x) * sqrt(x)', optimize=True)
+        self.assertEqual(ast.bind(['x']).evaluate([4]), 8.0)
+        self.assertEqual(ast.bind(['x', 'sqrt']).evaluate([4, lambda v: v + 1]), 42)
+        self.assertEqual(parser.parse('if_(x, 1, 2)').bind(['x', 'if_'])((0, lambda *a: a)), (0, 1, 2))
+
+        self.assertRaises(KeyError, parser.parse('a + b').bind, ['a'])
+        self.assertRaises(KeyError, parser.parse('f(a)').bind, ['a'])
+        self.assertRaises(ValueError, parser.parse('a').bind, ['a', 'a'])
+        self.assertRaises(IndexError, parser.parse('a + b').bind(['a', 'b']), (1,))
+        self.assertEqual(repr(parser.parse('a + b').bind(['a', 'b'])), 'BoundFormula(a, b)')
+
+    def test_context(self):
+        parser = Parser()
+        context = dict(abc=5, bcd=9, xs=[1, 2, 3])
+        cases = [
+            'max(1, 2, 3) + abc - bcd',
+            'sum(xs[::2], start=bcd) * -abc',
+            'if_(abc > bcd, 1 / 0, coalesce(abc, 1 / 0))',
+            'max(abc, bcd) * max(abc, bcd) + sqrt(abc * bcd) - sqrt(abc * bcd) + sqrt(16)',
+        ]
+        for formula in cases:
+            for optimize in (False, True):
+                ast = parser.parse(formula, optimize)
+                for shadowable in (True, False, ['max']):
+                    bound = ast.bind(shadowable=shadowable)
+                    self.assertEqual(bound(context), ast.evaluate(context), (formula, shadowable))
+        self.assertEqual(parser.bind('1 + 2')(), 3)
+        self.assertEqual(repr(parser.bind('a')), 'BoundFormula(**context)')
+        self.assertRaises(KeyError, parser.bind('a + 1'), dict(b=1))
+
+    def test_shadowable(self):
+        parser = Parser()
+        ast = parser.parse('sqrt(16) + sqrt(x) * sqrt(x) + if_(x, 1, 2)', optimize=True)
+        context = dict(x=4, sqrt=lambda v: v + 1, if_=lambda *a: len(a))
+        self.assertEqual(ast.bind()(context), ast.evaluate(context))
+        self.assertEqual(ast.bind(shadowable=['sqrt'])(context), 17 + 25 + 1)
+        self.assertEqual(ast.bind(shadowable=False)(context), 4 + 4 + 1)
+        self.assertEqual(ast.bind(shadowable=['if_'])(context), 4 + 4 + 3)
+
+        # 按位置取值时, 变量不能覆盖不可覆盖的函数
+        self.assertEqual(ast.bind(['x', 'sqrt'], shadowable=['sqrt'])((4, lambda v: v + 1)), 17 + 25 + 1)
+        self.assertRaises(ValueError, ast.bind, ['x', 'sqrt'], shadowable=False)
+        self.assertRaises(ValueError, ast.bind, ['x', 'if_'], shadowable=['sqrt'])
+
+        # 未注册的函数在绑定时报错, 除非声明由上下文给出
+        self.assertRaises(KeyError, parser.parse('f(x) + 1').bind)
+        self.assertRaises(KeyError, parser.parse('f(x) + 1').bind, shadowable=False)
+        self.assertEqual(parser.parse('f(x) + 1').bind(shadowable=['f'])(dict(x=1, f=abs)), 2)
+        self.assertRaises(KeyError, parser.parse('f(x) + 1').bind, ['x'])
+
+    def test_registry(self):
+        parser = Parser()
+        parser.register_function('f', lambda x: x + 1, pure=True)
+        snapshot = parser.snapshot()
+        ast = parser.parse('f(x) * 2')
+        bound, positional = ast.bind(registry=snapshot), ast.bind(['x'])
+        # 之后注册的函数及运算符不影响快照
+        parser.register_function('g', abs)
+        parser.register_binary_op('<>', lambda a, b: a != b, 11000)
+        self.assertFalse(snapshot.functions.has_func('g'))
+        self.assertNotIn('<>', snapshot.operators.binary_funcs)
+        self.assertRaises(TypeError, operator.setitem, snapshot.functions.functions, 'g', abs)
+        self.assertRaises(KeyError, parser.parse('g(x)').bind, registry=snapshot)
+        self.assertRaises(KeyError, parser.parse('x <> 1').bind, ['x'], snapshot)
+        self.assertEqual(bound(dict(x=1)), 4)
+        self.assertEqual(positional((1,)), 4)
+        self.assertEqual(parser.parse('g(x) <> 1').bind(['x'])((-2,)), True)
+
+        # 快照可用于其他解析器的语法树
+        other = Parser()
+        self.assertRaises(KeyError, other.parse('f(1)').bind)
+        self.assertEqual(other.parse('f(1)').bind(registry=snapshot)(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
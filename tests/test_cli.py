@@ -0,0 +1,104 @@
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+from contextlib import redirect_stderr
+
+import formulaparser
+from formulaparser.cli import main, parse_formula_option
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name, content=None):
+        path = os.path.join(self.tmp.name, name)
+        if content is not None:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+        return path
+
+    def run_main(self, *argv):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            code = main(list(argv))
+        return code, stderr.getvalue()
+
+    def read(self, path):
+        with open(path, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def test_formula_option(self):
+        self.assertEqual(parse_formula_option('total = price * qty'), ('total', 'price * qty'))
+        self.assertEqual(parse_formula_option('flag=a==b'), ('flag', 'a==b'))
+        self.assertEqual(parse_formula_option('a == b'), ('a == b', 'a == b'))
+
+    def test_csv(self):
+        src = self.path('in.csv', 'price,qty,name\n2.5,4,a\n3,x,b\n,2,c\n')
+        out = self.path('out.csv')
+        formulas = ['-f', 'total=price * qty', '-f', 'tax=total * 0.1', '-f', 'name + "!"']
+
+        code, summary = self.run_main(src, '-o', out, '--on-error', 'null', *formulas)
+        self.assertEqual(code, 0)
+        self.assertEqual(self.read(out), ['price,qty,name,total,tax,"name + ""!"""', '2.5,4,a,10.0,1.0,a!',
+                                          '3,x,b,xxx,,b!', ',2,c,,,c!'])
+        self.assertIn('读取3行, 输出3行, 跳过0行, 出错2行', summary)
+
+        code, summary = self.run_main(src, '-o', out, '--on-error', 'skip', '--drop-input', *formulas)
+        self.assertEqual(self.read(out), ['total,tax,"name + ""!"""', '10.0,1.0,a!'])
+        self.assertIn('跳过2行', summary)
+
+        code, message = self.run_main(src, '-o', out, *formulas)
+        self.assertEqual(code, 1)
+        self.assertIn('位置：第3行，公式：tax', message)
+
+        # 指定类型及关闭自动转换
+        code, _ = self.run_main(src, '-o', out, '--coerce', 'none', '--type', 'qty=float', '--on-error', 'null',
+                                '--drop-input', '--quiet', '-f', 'name * 2', '-f', 'q=qty / 2')
+        self.assertEqual(self.read(out), ['name * 2,q', 'aa,2.0', 'bb,', 'cc,1.0'])
+
+        self.assertEqual(self.run_main(src, '-f', 'a +')[0], 2)
+
+    def test_jsonl(self):
+        src = self.path('in.jsonl', '{"a": 1, "b": [1, 2]}\n\n{"a": 2, "b": [3]}\nnot json\n')
+        out = self.path('out.jsonl')
+        code, summary = self.run_main(src, '-o', out, '--on-error', 'skip', '-f', 's=sum(b) + a')
+        self.assertEqual(code, 0)
+        self.assertEqual([json.loads(line) for line in self.read(out)],
+                         [{'a': 1, 'b': [1, 2], 's': 4}, {'a': 2, 'b': [3], 's': 5}])
+        self.assertIn('读取3行, 输出2行, 跳过1行, 出错1行', summary)
+
+        code, message = self.run_main(src, '-o', out, '-f', 's=sum(b) + a')
+        self.assertEqual(code, 1)
+        self.assertIn('位置：第4行', message)
+
+        out = self.path('out.csv')
+        self.run_main(src, '-o', out, '--output-format', 'csv', '--on-error', 'skip', '-f', 's=sum(b) + a')
+        self.assertEqual(self.read(out), ['a,b,s', '1,"[1, 2]",4', '2,[3],5'])
+
+    def test_workers(self):
+        src = self.path('in.csv', 'a,b\n' + ''.join(f'{i},{i % 7}\n' for i in range(3000)))
+        results = []
+        for workers in ('1', '2'):
+            out = self.path(f'out{workers}.csv')
+            code, summary = self.run_main(src, '-o', out, '--workers', workers, '--chunk-size', '100',
+                                          '-f', 'x=a * b', '-f', 'y=x // (b - 3)', '--on-error', 'null')
+            self.assertEqual(code, 0)
+            self.assertIn('读取3000行, 输出3000行, 跳过0行, 出错429行', summary)
+            results.append(self.read(out))
+        self.assertEqual(results[0], results[1])
+
+    def test_stdio(self):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(formulaparser.__file__)))
+        process = subprocess.run([sys.executable, '-m', 'formulaparser', '-f', 'c=a + b', '--format', 'jsonl'],
+                                 input='{"a": 1, "b": 2}\n{"a": "x", "b": "y"}\n', capture_output=True, text=True,
+                                 env=env, timeout=60)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(process.stdout.splitlines(), ['{"a": 1, "b": 2, "c": 3}', '{"a": "x", "b": "y", "c": "xy"}'])
+        self.assertIn('读取2行', process.stderr)
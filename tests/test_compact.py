@@ -0,0 +1,79 @@
+import math
+import unittest
+import tracemalloc
+
+from formulaparser import Parser
+from formulaparser.compact import CompactAST
+
+
+class TestCompact(unittest.TestCase):
+
+    formulas = [
+        'sum([1, 2, abc], start=1) - max(a, 1) * c[b]',
+        '-x.real + (1, "s", c)[-2:3:1][1][0] * 2.5',
+        'sqrt(2) * x + sqrt(2) * x',
+        'f(a, b=2)(c)[::2]',
+    ]
+
+    def test_roundtrip(self):
+        parser = Parser()
+        context = dict(abc=5, a=3, b=1, c=(1, 2), x=-2, f=lambda *args, b: lambda c: [c] * b)
+        for formula in self.formulas:
+            for optimize in (False, True):
+                ast = parser.parse(formula, optimize=optimize)
+                compact = ast.compact()
+                self.assertEqual(compact.evaluate(context), ast.evaluate(context))
+                restored = compact.to_ast()
+                self.assertEqual(repr(restored), repr(ast))
+                self.assertEqual(restored.evaluate(context), ast.evaluate(context))
+                if 'Shared' not in ast.render():
+                    self.assertEqual(compact.render(), ast.render())
+                    self.assertEqual(restored.render(), ast.render())
+
+        # 同名标识符只保存一次, 转换后仍为同一节点
+        compact = parser.parse('x * x + x').compact()
+        self.assertEqual(len(compact), 3)
+        restored = compact.to_ast()
+        self.assertIs(restored.left.left, restored.right)
+        # 被折叠的函数被上下文覆盖时按原节点求值
+        compact = parser.parse('sqrt(4) + 1', optimize=True).compact()
+        self.assertEqual(compact.evaluate(), 3)
+        self.assertEqual(compact.evaluate(dict(sqrt=lambda v: v)), 5)
+
+    def test_constants(self):
+        parser = Parser()
+        ast = parser.parse('(1, 1.0, 1 == 1, 0.0, -0.0)', optimize=True)
+        values = ast.compact().evaluate()
+        self.assertEqual([type(v) for v in values], [int, float, bool, float, float])
+        self.assertEqual(math.copysign(1, values[4]), -1)
+
+    def test_exception(self):
+        parser = Parser()
+        compact = parser.parse('a + b').compact()
+        self.assertRaises(KeyError, compact.evaluate, dict(a=1))
+        # 未注册自定义函数的解析器共享同一注册表, 注册表不同时不能合并
+        other_parser = Parser()
+        other_parser.register_function('h', abs)
+        other = other_parser.parse('c')
+        ast = parser.parse('a + b')
+        CompactAST.from_ast(type(ast)(ast.op_mgr, '+', ast.left, Parser().parse('c')))
+        self.assertRaises(ValueError, CompactAST.from_ast, type(ast)(ast.op_mgr, '+', ast.left, other))
+
+    def test_memory(self):
+        parser = Parser(cache_size=0)
+        texts = [f'sum([1, 2, abc{i}], start=1) - max(a, {i}) * c[b] + x{i}.real' for i in range(500)]
+        self.assertFalse(hasattr(parser.parse(texts[0]), '__dict__'))
+
+        tracemalloc.start()
+        try:
+            asts = [parser.parse(text) for text in texts]
+            ast_size = tracemalloc.get_traced_memory()[0]
+            del asts
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            compacts = [parser.parse(text).compact() for text in texts]
+            compact_size = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(compacts), len(texts))
+        self.assertLess(compact_size, ast_size * 0.6)
@@ -0,0 +1,49 @@
+import unittest
+import operator
+
+from formulaparser import Parser
+
+
+class TestCompile(unittest.TestCase):
+
+    def test_compile(self):
+        parser = Parser()
+        context = dict(abc=5, bcd=9, operator=operator)
+        cases = [
+            '2 + 3 * 4',
+            '-sqrt(4) + 10 - 2 * (1 + (3 + 5) * (7 * (1 + 2)))',
+            'max(1, 2, 3) + abc - bcd',
+            '"hello " + "world"',
+            'sum([1, 2, 9, abc][1:], start=0)',
+            '(1, 2, abc, 66, 55, 99)[1:4:2]',
+            '[1, 2, abc, 66, 55][::bcd - 7]',
+            'sum([1,2,3], start=bcd) + max((4 ,5 ,7)) * operator.add(abc, bcd)',
+            'operator.add.__name__',
+            'pow(2, 3) + abs(-1) + max(1, 2, 3, 4)',
+        ]
+        for formula in cases:
+            ast = parser.parse(formula)
+            self.assertEqual(ast.compile()(context), ast.evaluate(context), formula)
+            self.assertEqual(parser.compile(formula)(context), ast.evaluate(context), formula)
+
+    def test_identifier(self):
+        parser = Parser()
+        func = parser.compile('sqrt(a) + b')
+        self.assertEqual(func(dict(a=16, b=1)), 5)
+        # 上下文中的同名变量优先于注册函数
+        self.assertEqual(func(dict(a=16, b=1, sqrt=lambda x: x)), 17)
+        self.assertRaises(KeyError, func, dict(a=16))
+        self.assertRaises(KeyError, parser.compile('a'))
+
+        # 语法树固定使用解析时的注册表, 之后注册的函数需重新解析才能找到
+        func = parser.compile('late(2)')
+        self.assertRaises(KeyError, func)
+        parser.register_function('late', lambda x: x * 10)
+        self.assertRaises(KeyError, func)
+        self.assertEqual(parser.compile('late(2)')(), 20)
+
+    def test_exception(self):
+        parser = Parser()
+        func = parser.compile('1 / a')
+        self.assertRaises(ZeroDivisionError, func, dict(a=0))
+        self.assertRaises(AttributeError, parser.compile('a.b'), dict(a=1))
@@ -0,0 +1,78 @@
+import unittest
+
+from formulaparser import Parser
+
+
+class CountingDict(dict):
+    """记录每个键被读取的次数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reads = {}
+
+    def __getitem__(self, key):
+        self.reads[key] = self.reads.get(key, 0) + 1
+        return super().__getitem__(key)
+
+
+class TestFused(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = Parser()
+        self.calls = []
+
+        def expensive(x):
+            self.calls.append(x)
+            return x * 100
+        self.parser.register_function('expensive', expensive, pure=True)
+        self.formulas = {
+            'margin': '(revenue - cost) / revenue',
+            'profit': '(revenue - cost) * (1 - tax)',
+            'score': 'log(volume) * 2 + expensive(cost)',
+            'volume_log': 'log(volume)',
+            'scaled': 'expensive(cost) / 1000 + max(1, 2)',
+            'choice': 'if_(revenue > cost, revenue - cost, missing)',
+            'constant': 'sqrt(16) + 1',
+        }
+
+    def test_compile_many(self):
+        fused = self.parser.compile_many(self.formulas)
+        self.assertGreater(fused.deduplicated, 0)
+        self.assertEqual(fused.variables, ('cost', 'missing', 'revenue', 'tax', 'volume'))
+        for context in [dict(revenue=100.0, cost=60.0, tax=0.25, volume=1000.0),
+                        dict(revenue=50, cost=80, tax=0.1, volume=10, missing=-1)]:
+            expected = {name: self.parser.parse(f).evaluate(context) for name, f in self.formulas.items()}
+            self.calls.clear()
+            self.assertEqual(fused(context), expected)
+            # 共有的子表达式只计算一次
+            self.assertEqual(self.calls, [context['cost']])
+        self.assertEqual(fused.evaluate_many([dict(revenue=1, cost=2, tax=0, volume=1, missing=5)])[0]['choice'], 5)
+
+        tuple_fused = self.parser.compile_many(self.formulas, as_tuple=True)
+        context = dict(revenue=100.0, cost=60.0, tax=0.25, volume=1000.0)
+        self.assertEqual(tuple_fused(context), tuple(fused(context).values()))
+        self.assertEqual(repr(self.parser.compile_many({'a': 'x', 'b': '1'})), 'FusedFormulas(a, b)')
+        self.assertEqual(self.parser.compile_many({})(), {})
+        self.assertEqual(self.parser.compile_many({'a': '1 + 2'})(), {'a': 3})
+
+    def test_read_once(self):
+        fused = self.parser.compile_many(self.formulas)
+        context = CountingDict(revenue=100.0, cost=60.0, tax=0.25, volume=1000.0, missing=0)
+        fused(context)
+        self.assertEqual(context.reads, dict.fromkeys(['cost', 'missing', 'revenue', 'tax', 'volume'], 1))
+
+    def test_fallback(self):
+        fused = self.parser.compile_many(self.formulas)
+        # 缺少的变量只在用到时抛出异常
+        self.assertRaises(KeyError, fused, dict(revenue=50, cost=80, tax=0.1, volume=10))
+        self.assertRaises(KeyError, fused, dict(revenue=100, cost=60, volume=10))
+
+        # 上下文中的同名变量覆盖函数, 包括被折叠及被共享的函数调用
+        context = dict(revenue=100.0, cost=60.0, tax=0.25, volume=1000.0, sqrt=lambda x: x, log=lambda x: 1)
+        expected = {name: self.parser.parse(f).evaluate(context) for name, f in self.formulas.items()}
+        self.assertEqual(fused(context), expected)
+        self.assertEqual(expected['constant'], 17)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from formulaparser import Parser, FormulaGraph
+
+
+class TestFormulaGraph(unittest.TestCase):
+
+    def test_update(self):
+        parser = Parser()
+        calls = []
+
+        def track(name, value):
+            calls.append(name)
+            return value
+        parser.register_function('track', track)
+
+        graph = FormulaGraph(parser)
+        graph.add('ratio', 'track("ratio", margin / revenue)')
+        graph.add('margin', 'track("margin", revenue - cost)')
+        graph.add('tax', 'track("tax", revenue * rate)')
+        graph.add('net', 'track("net", margin - tax)')
+        self.assertEqual(graph.order, ['margin', 'tax', 'ratio', 'net'])
+        self.assertEqual(graph.dependencies('net'), {'margin', 'tax'})
+
+        results = graph.update(revenue=100, cost=60, rate=0.1)
+        self.assertEqual(results, dict(margin=40, tax=10, ratio=0.4, net=30))
+        self.assertEqual(sorted(calls), ['margin', 'net', 'ratio', 'tax'])
+
+        # 仅重新计算下游公式, 每个公式只计算一次
+        calls.clear()
+        self.assertEqual(graph.update(cost=80), dict(margin=20, ratio=0.2, net=10))
+        self.assertEqual(calls, ['margin', 'ratio', 'net'])
+        calls.clear()
+        self.assertEqual(graph.update(rate=0.2), dict(tax=20, net=0))
+        self.assertEqual(graph['net'], 0)
+        self.assertEqual(graph.values, dict(ratio=0.2, margin=20, tax=20, net=0))
+        self.assertEqual(calls, ['tax', 'net'])
+
+        # 替换公式时重新计算它及下游公式
+        calls.clear()
+        graph.add('tax', 'track("tax", 5)')
+        self.assertEqual(graph['net'], 15)
+        self.assertEqual(calls, ['tax', 'net'])
+
+        graph.remove('tax')
+        self.assertRaises(KeyError, graph.refresh)
+        self.assertEqual(graph.update(tax=1), dict(net=19))
+        self.assertNotIn('tax', graph)
+        self.assertEqual(len(graph), 3)
+
+    def test_cycle(self):
+        graph = FormulaGraph()
+        graph.add('a', 'b + 1')
+        graph.add('b', 'c * 2')
+        with self.assertRaises(ValueError) as cm:
+            graph.add('c', 'a - 1')
+        self.assertIn('c -> a -> b -> c', str(cm.exception))
+        self.assertRaises(ValueError, graph.add, 'd', 'd + 1')
+        self.assertNotIn('c', graph)
+        self.assertEqual(graph.update(c=1), dict(b=2, a=3))
+
+    def test_exception(self):
+        graph = FormulaGraph()
+        graph.add('x', '1 / a')
+        graph.add('y', 'x + b')
+        self.assertRaises(ValueError, graph.update, x=1)
+        self.assertRaises(KeyError, graph.update, a=1)
+        self.assertRaises(ZeroDivisionError, graph.update, a=0, b=1)
+        self.assertEqual(graph.update(a=2), dict(x=0.5, y=1.5))
+        self.assertRaises(KeyError, graph.__getitem__, 'z')
@@ -0,0 +1,90 @@
+import unittest
+
+from formulaparser import Parser
+
+
+class TestIncremental(unittest.TestCase):
+
+    def test_update(self):
+        parser = Parser()
+        calls = []
+
+        def heavy(x):
+            calls.append(x)
+            return x * 2
+        parser.register_function('heavy', heavy, pure=True)
+
+        formula = 'heavy(a + 1) * w + heavy(b)[0] + c.real + sum([a, b[0]], start=c)'
+        ast = parser.parse(formula)
+        context = dict(a=1, b=(2, 3), c=4, w=2)
+        expected = ast.evaluate(context)
+        calls.clear()
+        inc = ast.incremental(context)
+        self.assertEqual(inc.value, expected)
+        self.assertEqual(len(calls), 2)
+
+        context.update(w=5)
+        expected = ast.evaluate(context)
+        calls.clear()
+        self.assertEqual(inc.update(w=5), expected)
+        self.assertEqual(calls, [])
+        # w、乘法及三次加法
+        self.assertEqual(inc.recomputed, 5)
+
+        context.update(a=3, c=1)
+        expected = ast.evaluate(context)
+        calls.clear()
+        self.assertEqual(inc.update(dict(a=3), c=1), expected)
+        self.assertEqual(calls, [4])
+        self.assertEqual(inc.context, context)
+
+        inc.update()
+        self.assertEqual(inc.recomputed, 0)
+
+    def test_impure(self):
+        parser = Parser()
+        counter = iter(range(100))
+        parser.register_function('tick', lambda: next(counter))
+        parser.register_binary_op('$%', lambda x, y: x + y, 16500)
+        ast = parser.parse('tick() + a + (b $% 1)')
+        inc = ast.incremental(dict(a=10, b=1))
+        self.assertEqual(inc.value, 12)
+        self.assertEqual(inc.update(a=20), 23)
+        self.assertEqual(inc.update(), 24)
+
+        # 上下文覆盖纯函数时每次更新都会重新计算
+        values = iter(range(100))
+        inc = parser.parse('sqrt(x) + 1').incremental(dict(x=4, sqrt=lambda v: next(values)))
+        self.assertEqual(inc.value, 1)
+        self.assertEqual(inc.update(), 2)
+
+    def test_optimized(self):
+        parser = Parser()
+        ast = parser.parse('sqrt(4) * x + sqrt(4) * x + y', optimize=True)
+        inc = ast.incremental(dict(x=1, y=1))
+        self.assertEqual(inc.value, 5)
+        self.assertEqual(inc.update(y=2), 6)
+        self.assertEqual(inc.recomputed, 2)
+        # 覆盖被折叠或共享的函数后按原语法树求值
+        self.assertEqual(inc.update(sqrt=lambda v: v), 10)
+        self.assertEqual(inc.update(x=2), 18)
+
+    def test_exception(self):
+        parser = Parser()
+        ast = parser.parse('1 / a + b')
+        inc = ast.incremental(dict(a=1, b=1))
+        self.assertRaises(ZeroDivisionError, inc.update, a=0)
+        self.assertRaises(ZeroDivisionError, inc.update, b=2)
+        self.assertEqual(inc.update(a=2), 2.5)
+        self.assertRaises(KeyError, parser.parse('a + c').incremental, dict(a=1))
+
+    def test_deep(self):
+        parser = Parser()
+        # 增量求值不受递归深度限制
+        ast = parser.parse('+'.join(f'x{i % 50}' for i in range(3000)))
+        context = {f'x{i}': i for i in range(50)}
+        inc = ast.incremental(context)
+        self.assertEqual(inc.value, sum(i % 50 for i in range(3000)))
+        self.assertEqual(inc.update(x7=100), sum(i % 50 for i in range(3000)) + 93 * 60)
+        # 同名标识符为同一节点, 仅重新计算x7及其后的加法
+        self.assertEqual(inc.recomputed, 1 + 2993)
@@ -0,0 +1,152 @@
+import asyncio
+import unittest
+
+from formulaparser import Parser, Profiler
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestLazy(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = Parser()
+        self.calls = []
+
+        def expensive(x):
+            self.calls.append(x)
+            return x * 100
+        self.parser.register_function('expensive', expensive)
+
+    def evaluators(self, ast):
+        """各种求值方式, 结果及异常应与evaluate一致"""
+        return {
+            'evaluate': ast.evaluate,
+            'compile': ast.compile(),
+            'postfix': ast.postfix(),
+            'compact': ast.compact().evaluate,
+            'loads': self.parser.loads(ast.dumps()).evaluate,
+            'async': lambda context: asyncio.run(ast.evaluate_async(context)),
+            'profiled': lambda context: ast.evaluate_profiled(Profiler(), context),
+        }
+
+    def test_builtin(self):
+        cases = [
+            ('if_(x > 0, 10 / x, 1 / 0)', dict(x=2), 5.0),
+            ('if_(x > 0, 10 / x, -1)', dict(x=0), -1),
+            ('if_(x, 1)', dict(x=0), None),
+            ('if_(x, then=expensive(x), otherwise=0)', dict(x=0), 0),
+            ('and_then(x, 1 / 0)', dict(x=0), 0),
+            ('and_then(x, y, expensive(1))', dict(x=1, y=''), ''),
+            ('and_then(x, y)', dict(x=1, y=2), 2),
+            ('or_else(x, 1 / 0)', dict(x=3), 3),
+            ('or_else(x, y, 7)', dict(x=0, y=0), 7),
+            ('coalesce(n, m, x, expensive(x))', dict(n=None, m=None, x=0), 0),
+            ('coalesce(n, m)', dict(n=None, m=None), None),
+            ('if_(x > 1, if_(x > 2, 2, expensive(x)), or_else(y, 3))', dict(x=1, y=0), 3),
+        ]
+        for formula, context, expected in cases:
+            for optimize in (False, True):
+                ast = self.parser.parse(formula, optimize)
+                for name, evaluate in self.evaluators(ast).items():
+                    self.assertEqual(evaluate(context), expected, (formula, name))
+        self.assertEqual(self.calls, [])
+
+        # 只有被选中的参数出错时才抛出异常
+        ast = self.parser.parse('if_(x > 0, 1 / x, y)')
+        for name, evaluate in self.evaluators(ast).items():
+            self.assertEqual(evaluate(dict(x=2)), 0.5, name)
+            self.assertRaises(KeyError, evaluate, dict(x=-1))
+
+        # 参数均为常量时可折叠
+        self.assertEqual(repr(self.parser.parse('coalesce(if_(0, 1), 3) * and_then(1, 2)', optimize=True)),
+                         'ConstantNode(6)')
+
+    def test_fold(self):
+        folded = []
+
+        def heavy(x):
+            folded.append(x)
+            return x + 1
+        self.parser.register_function('heavy', heavy, pure=True)
+        # 优化时只计算求值时必定会取用的参数
+        formula = 'if_(x, 1, heavy(5)) + and_then(0, heavy(7)) + or_else(heavy(1), heavy(8))'
+        ast = self.parser.parse(formula, optimize=True)
+        self.assertEqual(folded, [1])
+        self.assertEqual(ast.evaluate(dict(x=1)), 1 + 0 + 2)
+        self.assertEqual(folded, [1])
+        self.assertEqual(ast.evaluate(dict(x=0)), 6 + 0 + 2)
+        self.assertEqual(folded, [1, 5])
+
+        # 已取用的参数替换为常量, 调用本身不能折叠
+        ast = self.parser.parse('if_(heavy(2) > 2, x, heavy(9))', optimize=True)
+        self.assertEqual((ast.args.args[0].value, ast.args.args[0].names), (True, ('heavy',)))
+        self.assertEqual(ast.args.args[2], self.parser.parse('heavy(9)'))
+        self.assertEqual(folded, [1, 5, 2])
+        self.assertEqual(ast.evaluate(dict(x=3, heavy=lambda v: 0)), 0)
+
+    def test_custom(self):
+        def unless(cond, value, default=None):
+            if not cond():
+                return value()
+            return default() if default is not None else None
+        self.parser.register_function('unless', unless, lazy=True)
+        ast = self.parser.parse('unless(x > 0, 1 / x, default=expensive(x))')
+        for name, evaluate in self.evaluators(ast).items():
+            self.assertEqual(evaluate(dict(x=-2)), -0.5, name)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(ast.evaluate(dict(x=1)), 100)
+        self.assertEqual(self.calls, [1])
+
+        # 上下文中的同名变量覆盖惰性函数时按普通函数调用
+        context = dict(x=1, unless=lambda cond, value, default=None: (cond, value, default))
+        for name, evaluate in self.evaluators(ast).items():
+            self.assertEqual(evaluate(context), (True, 1.0, 100), name)
+
+        self.assertRaises(ValueError, self.parser.register_function, 'cached', unless, pure=True, cache=8,
+                          lazy=True)
+
+    def test_incremental(self):
+        ast = self.parser.parse('if_(x > 0, expensive(x), -1) + y')
+        evaluator = ast.incremental(dict(x=0, y=1))
+        self.assertEqual(evaluator.value, 0)
+        self.assertEqual(evaluator.update(y=2), 1)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(evaluator.update(x=3), 302)
+        self.assertEqual(self.calls, [3])
+
+    @unittest.skipIf(np is None, 'numpy未安装')
+    def test_vectorize(self):
+        columns = dict(
+            x=np.array([0, 1, 2, -3, 0, 5]),
+            f=np.array([0.5, 0.0, 1.5, 0.0, 2.5, 3.5]),
+            s=np.array(['', 'a', '', 'b', 'c', '']),
+            o=np.array([None, 1, 'z', None, 0, None], dtype=object),
+            k=3,
+        )
+        rows = [{k: v[i].item() if isinstance(v, np.ndarray) and v.dtype != object else
+                 v[i] if isinstance(v, np.ndarray) else v for k, v in columns.items()} for i in range(6)]
+        formulas = [
+            'if_(x > 0, 10 / x, -1)',
+            'if_(x > 0, expensive(x))',
+            'and_then(x, 10 // x)',
+            'or_else(x, f, 7)',
+            'coalesce(o, s, x)',
+            'if_(s, s + "!", x)',
+            'if_(k, x, 1 / 0)',
+            'if_(f > 1, (x, f), [x])',
+            'if_(x > 1, if_(x > 4, 2, 10 / (x - 3)), 0)',
+        ]
+        for formula in formulas:
+            ast = self.parser.parse(formula)
+            self.assertEqual(ast.evaluate_vectorized(columns).tolist(), [ast.evaluate(row) for row in rows], formula)
+        # 每个参数只对选中它的行求值
+        self.calls.clear()
+        self.parser.parse('if_(x > 0, expensive(x), 0)').evaluate_vectorized(columns)
+        self.assertEqual(self.calls, [1, 2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
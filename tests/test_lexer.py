@@ -0,0 +1,85 @@
+import unittest
+
+from formulaparser.lexer import Lexer, TokenType
+from formulaparser.op_manager import OperatorManager
+
+
+class TestLexer(unittest.TestCase):
+
+    def tokenize(self, text, op_mgr=None):
+        return [(t.type, t.value, t.position) for t in Lexer(op_mgr or OperatorManager(), text).tokenize()]
+
+    def test_tokens(self):
+        self.assertEqual(self.tokenize(' f(a.b.c, k=2.5e-3)[1:] <<= "x\\"y\\n" '), [
+            (TokenType.IDENTIFIER, 'f', 1),
+            (TokenType.LPAREN, '(', 2),
+            (TokenType.IDENTIFIER, 'a', 3),
+            (TokenType.ATTRIBUTION, ['b', 'c'], 4),
+            (TokenType.COMMA, ',', 8),
+            (TokenType.IDENTIFIER, 'k', 10),
+            (TokenType.ASSIGNMENT, '=', 11),
+            (TokenType.NUMBER, 2.5e-3, 12),
+            (TokenType.RPAREN, ')', 18),
+            (TokenType.LSQUARE, '[', 19),
+            (TokenType.NUMBER, 1, 20),
+            (TokenType.COLON, ':', 21),
+            (TokenType.RSQUARE, ']', 22),
+            (TokenType.OPERATOR, '<<', 24),
+            (TokenType.ASSIGNMENT, '=', 26),
+            (TokenType.STRING, 'x"y\n', 28),
+            (TokenType.EOF, None, 37),
+        ])
+
+    def test_longest_operator(self):
+        op_mgr = OperatorManager()
+        op_mgr.register_binary_op('%>%', lambda x, y: y(x), 100000)
+        self.assertEqual([t[1] for t in self.tokenize('a%>%b%c//d', op_mgr)],
+                         ['a', '%>%', 'b', '%', 'c', '//', 'd', None])
+
+    def test_match_operator(self):
+        op_mgr = OperatorManager()
+        pattern = op_mgr.operator_pattern
+        self.assertEqual(op_mgr.match_operator('a <<= b', 2), '<<')
+        self.assertIsNone(op_mgr.match_operator('a <<= b', 0))
+        self.assertIs(op_mgr.operator_pattern, pattern)
+
+        op_mgr.register_unary_op('<<<', lambda x: x)
+        op_mgr.register_binary_op('?', lambda x, y: x or y, 100)
+        self.assertIsNot(op_mgr.operator_pattern, pattern)
+        self.assertEqual(op_mgr.match_operator('<<<<'), '<<<')
+        self.assertEqual(op_mgr.match_operator('??'), '?')
+        self.assertEqual([t[1] for t in self.tokenize('<<<<a?b', op_mgr)], ['<<<', '<', 'a', '?', 'b', None])
+
+    def test_exception(self):
+        cases = [
+            ('a + 测', '未知字符："测"，位置：4'),
+            ('a +  \t', '未知字符："\t"，位置：5'),
+            ('a ? b', '不支持的运算符，位置：2'),
+            ('"abc', '未闭合的字符串，位置：0'),
+            ('1 + "a\\x"', '不支持的转义符"\\x"，位置：6'),
+            ('a.', '未知字符："."，位置：1'),
+        ]
+        for text, message in cases:
+            with self.assertRaises(ValueError) as cm:
+                self.tokenize(text)
+            self.assertEqual(str(cm.exception), message)
+
+    def test_single_pass(self):
+        # 计数正则匹配而非计时: 每个token只匹配一次, 位置单调递增且不复制文本, 即分词为线性时间
+        # 耗时随长度的伸缩性见benchmarks/bench_lexer_scaling.py
+        text = ' + '.join(f'x{i} * 1.5e3 - f(y{i}, "s\\t{i}").attr[{i}:]' for i in range(500))
+        lexer = Lexer(OperatorManager(), text)
+        pattern, positions = lexer.pattern, []
+        test = self
+
+        class CountingPattern:
+            @staticmethod
+            def match(string, pos):
+                test.assertIs(string, text)
+                positions.append(pos)
+                return pattern.match(string, pos)
+        lexer.pattern = CountingPattern
+        tokens = lexer.tokenize()
+        self.assertLessEqual(len(positions), len(tokens))
+        self.assertEqual(positions, sorted(set(positions)))
+        self.assertEqual(positions[0], 0)
@@ -0,0 +1,141 @@
+import math
+import pickle
+import unittest
+
+from formulaparser import Parser, FormulaGraph
+from formulaparser.memo import MemoizedFunction, MemoPolicy, MemoInfo, evaluation_scope
+
+
+class TestMemo(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def double(x, scale=1):
+            self.calls.append(x)
+            return x * 2 * scale
+        self.double = double
+
+    def test_cache(self):
+        parser = Parser()
+        parser.register_function('f', self.double, pure=True, cache=2)
+        ast = parser.parse('f(a) + f(a) + f(b)')
+        self.assertEqual(ast.evaluate(dict(a=1, b=2)), 8)
+        self.assertEqual(self.calls, [1, 2])
+        # compile及postfix同样经过缓存
+        self.assertEqual(ast.compile()(dict(a=1, b=2)), 8)
+        self.assertEqual(ast.postfix()(dict(a=1, b=2)), 8)
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(parser.memo_info('f'), MemoInfo(7, 2, 0, 0, 2, 2))
+
+        # 超出大小时淘汰最久未使用的条目
+        self.assertEqual(parser.parse('f(3)').evaluate(), 6)
+        self.assertEqual(parser.memo_info('f').evictions, 1)
+        self.assertEqual(parser.parse('f(2)').evaluate(), 4)
+        self.assertEqual(self.calls, [1, 2, 3])
+
+        # 参数类型不同的调用不共用结果
+        self.assertIsInstance(parser.parse('f(3.0)').evaluate(), float)
+        self.assertEqual(parser.parse('f(2, scale=3) + f(2, scale=3)').evaluate(), 24)
+        self.assertEqual(self.calls, [1, 2, 3, 3.0, 2])
+
+        parser.clear_memo('f')
+        self.assertEqual(parser.memo_info('f'), MemoInfo(0, 0, 0, 0, 2, 0))
+
+    def test_signed_zero(self):
+        # 0.0与-0.0相等, 但不能共用结果
+        def sign(x, y=1.0):
+            return math.copysign(1.0, x) * math.copysign(1.0, y)
+        for scope in ('global', 'evaluation'):
+            memo = MemoizedFunction(sign, MemoPolicy(scope=scope))
+            with evaluation_scope():
+                self.assertEqual([memo(0.0), memo(-0.0), memo(0.0), memo(1, y=0.0), memo(1, y=-0.0)],
+                                 [1.0, -1.0, 1.0, 1.0, -1.0])
+
+        parser = Parser()
+        parser.register_function('cs', sign, pure=True, cache=16)
+        ast = parser.parse('cs(a)')
+        self.assertEqual([ast.evaluate(dict(a=a)) for a in (0.0, -0.0, 0.0)], [1.0, -1.0, 1.0])
+        self.assertEqual(parser.parse('cs(a) + cs(-a)').evaluate(dict(a=0.0)), 0.0)
+
+    def test_unhashable(self):
+        parser = Parser()
+        parser.register_function('f', self.double, pure=True, cache=None)
+        parser.register_function('g', self.double, pure=True, cache=MemoPolicy(maxsize=None))
+        self.assertEqual(parser.parse('f(x) + g(x) + g(x)').evaluate(dict(x=[1])), [1] * 6)
+        self.assertEqual(parser.parse('g(1, scale=x)').evaluate(dict(x=[1])), [1, 1])
+        self.assertEqual(parser.memo_info('g'), MemoInfo(0, 0, 3, 0, None, 0))
+        self.assertRaises(ValueError, parser.memo_info, 'f')
+
+    def test_ttl(self):
+        now = [0.0]
+        func = MemoizedFunction(self.double, MemoPolicy(ttl=10), timer=lambda: now[0])
+        self.assertEqual(func(1), 2)
+        now[0] = 9
+        self.assertEqual(func(1), 2)
+        now[0] = 10
+        self.assertEqual(func(1), 2)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(func.cache_info()[:2], (1, 2))
+
+    def test_exception(self):
+        def fail(x):
+            self.calls.append(x)
+            raise ValueError(x)
+        func = MemoizedFunction(fail, MemoPolicy())
+        self.assertRaises(ValueError, func, 1)
+        self.assertRaises(ValueError, func, 1)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(func.cache_info().currsize, 0)
+
+    def test_evaluation_scope(self):
+        parser = Parser()
+        parser.register_function('f', self.double, pure=True, cache=MemoPolicy(scope='evaluation'))
+        func = parser.compile('f(a) + f(a)')
+        # 不在求值范围内时不缓存
+        self.assertEqual(func(dict(a=1)), 4)
+        self.assertEqual(self.calls, [1, 1])
+        with evaluation_scope():
+            self.assertEqual(func(dict(a=1)), 4)
+            with evaluation_scope():
+                self.assertEqual(func(dict(a=1)), 4)
+        self.assertEqual(self.calls, [1, 1, 1])
+        self.assertEqual(parser.memo_info('f')[:2], (3, 3))
+
+        # 依赖图的一次刷新为同一求值范围
+        graph = FormulaGraph(parser)
+        graph.add('x', 'f(a)')
+        graph.add('y', 'f(a) + x')
+        self.assertEqual(graph.update(a=5), {'x': 10, 'y': 20})
+        self.assertEqual(graph.update(a=6), {'x': 12, 'y': 24})
+        self.assertEqual(self.calls, [1, 1, 1, 5, 6])
+
+    def test_registry(self):
+        parser = Parser()
+        self.assertRaises(ValueError, parser.register_function, 'f', self.double, cache=8)
+        self.assertRaises(ValueError, parser.register_function, 'f', self.double, pure=True, cache=0)
+        self.assertRaises(ValueError, parser.register_function, 'f', self.double, pure=True,
+                          cache=MemoPolicy(scope='thread'))
+
+        async def coroutine(x):
+            return x
+        self.assertRaises(ValueError, parser.register_function, 'g', coroutine, pure=True, cache=8)
+
+        parser.register_function('f', self.double, pure=True, cache=8)
+        parser.parse('f(1) + f(1)').evaluate()
+        # 注册表变化时清空结果, 保留统计
+        parser.register_function('h', abs)
+        self.assertEqual(parser.memo_info('f'), MemoInfo(1, 1, 0, 0, 8, 0))
+        parser.parse('f(1)').evaluate()
+        self.assertEqual(self.calls, [1, 1])
+
+        # 序列化时只保留函数及策略
+        func = pickle.loads(pickle.dumps(parser.func_mgr.get_func('abs')))
+        self.assertIs(func, abs)
+        memoized = pickle.loads(pickle.dumps(MemoizedFunction(abs, MemoPolicy(16))))
+        self.assertEqual(memoized(-1), 1)
+        self.assertEqual(memoized.policy, MemoPolicy(16))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import math
+import unittest
+
+from formulaparser import Parser
+from formulaparser.ast_nodes import NumberNode, StringNode, ConstantNode, BinaryOpNode, ListNode, SharedNode, CSENode
+
+
+class TestConstantFolding(unittest.TestCase):
+
+    def test_fold(self):
+        parser = Parser()
+        ast = parser.parse('3600 * 24 * rate', optimize=True)
+        self.assertEqual(ast.left, NumberNode(86400))
+        self.assertEqual(ast.evaluate(dict(rate=2)), 172800)
+
+        self.assertEqual(parser.parse('"a" + "b" * 2', optimize=True), StringNode('abb'))
+        self.assertEqual(parser.parse('-(1 + 2)', optimize=True), NumberNode(-3))
+        self.assertEqual(parser.parse('(1, (2, 3))[1:]', optimize=True), ConstantNode(((2, 3),)))
+        self.assertEqual(parser.parse('sum([1, 2, 3][1:], start=max(1, 2))', optimize=True).value, 7)
+        self.assertEqual(parser.parse('1 < 2', optimize=True), ConstantNode(True))
+        self.assertIsInstance(parser.parse('[1, 2 + 3]', optimize=True), ListNode)
+        self.assertEqual(parser.parse('[1, 2 + 3]', optimize=True).args[1], NumberNode(5))
+
+    def test_function_shadowing(self):
+        parser = Parser()
+        ast = parser.parse('sqrt(2) * x', optimize=True)
+        self.assertIsInstance(ast.left, ConstantNode)
+        self.assertEqual(ast.left.names, ('sqrt',))
+        self.assertEqual(ast.evaluate(dict(x=2)), math.sqrt(2) * 2)
+        # 上下文中的同名变量覆盖被折叠的函数
+        context = dict(x=2, sqrt=lambda v: v * 10)
+        self.assertEqual(ast.evaluate(context), 40)
+        self.assertEqual(ast.compile()(context), 40)
+
+        # 未声明为纯函数的自定义函数不会被折叠
+        parser.register_function('twice', lambda v: v * 2)
+        parser.register_function('triple', lambda v: v * 3, pure=True)
+        ast = parser.parse('twice(2) + triple(2)', optimize=True)
+        self.assertIsInstance(ast, BinaryOpNode)
+        self.assertEqual(ast.right, ConstantNode(6, ('triple',), ast.right.original))
+
+    def test_operator(self):
+        parser = Parser()
+        parser.register_binary_op('$%', lambda x, y: (x + y) * 2, 16500)
+        parser.register_binary_op('%$', lambda x, y: (x - y) * 2, 16500, pure=True)
+        self.assertIsInstance(parser.parse('1 $% 2', optimize=True), BinaryOpNode)
+        self.assertEqual(parser.parse('3 %$ 2', optimize=True), NumberNode(2))
+
+    def test_exception(self):
+        parser = Parser()
+        ast = parser.parse('1 + 1 / 0', optimize=True)
+        self.assertIsInstance(ast, BinaryOpNode)
+        self.assertRaises(ZeroDivisionError, ast.evaluate)
+        self.assertRaises(ValueError, parser.parse('sqrt(-1) + 2 * 3', optimize=True).evaluate)
+
+    def test_unchanged(self):
+        parser = Parser()
+        formula = 'sum([1, 2, abc], start=1) - max(a, 1) * c[b]'
+        ast = parser.parse(formula)
+        optimized = parser.parse(formula, optimize=True)
+        self.assertEqual(repr(ast), repr(optimized))
+        self.assertIsNot(ast, optimized)
+        self.assertEqual(optimized.evaluate(dict(abc=5, a=3, b=1, c=(1, 2))), 3)
+
+
+class TestCommonSubexpression(unittest.TestCase):
+
+    def test_cse(self):
+        parser = Parser()
+        calls = []
+
+        def heavy(x):
+            calls.append(x)
+            return x * 2
+        parser.register_function('heavy', heavy, pure=True)
+
+        ast = parser.parse('heavy(a / b) * w1 + heavy(a / b) * w2 + sqrt(heavy(a / b)) + (a / b)')
+        cse, deduplicated = ast.cse()
+        self.assertIsInstance(cse, CSENode)
+        self.assertEqual(deduplicated, 13)
+        context = dict(a=3, b=2, w1=1, w2=2)
+        expected = ast.evaluate(context)
+        calls.clear()
+        self.assertEqual(cse.evaluate(context), expected)
+        self.assertEqual(len(calls), 1)
+        calls.clear()
+        self.assertEqual(cse.compile()(context), expected)
+        self.assertEqual(len(calls), 1)
+        # 每次求值重新计算公共子表达式
+        self.assertEqual(cse.evaluate(dict(context, a=5)), ast.evaluate(dict(context, a=5)))
+
+        # 上下文覆盖纯函数时按原语法树求值
+        calls.clear()
+        self.assertEqual(cse.evaluate(dict(context, heavy=heavy)), expected)
+        self.assertEqual(len(calls), 3)
+
+    def test_impure(self):
+        parser = Parser()
+        counter = iter(range(100))
+        parser.register_function('tick', lambda: next(counter))
+        ast = parser.parse('tick() + tick() + a.b + a.b')
+        self.assertEqual(ast.cse(), (ast, 0))
+
+        # 可变的结果不会在多个父节点间共用
+        def append(items):
+            items.append(0)
+            return len(items)
+        parser.register_function('append', append)
+        ast = parser.parse('append([a] * 2) + append([a] * 2)')
+        self.assertEqual(ast.cse()[0].evaluate(dict(a=1)), 6)
+
+        ast = parser.parse('(x + 1) * (x + 1) + [x + 1][0]')
+        cse, deduplicated = ast.cse()
+        self.assertEqual(deduplicated, 6)
+        self.assertEqual(cse.evaluate(dict(x=2)), 12)
+        self.assertRaises(TypeError, cse.evaluate, dict(x='a'))
+
+    def test_optimize(self):
+        parser = Parser()
+        ast = parser.parse('sqrt(2) * x + sqrt(2) * x', optimize=True)
+        self.assertIsInstance(ast, CSENode)
+        self.assertIsInstance(ast.body.left, SharedNode)
+        self.assertIs(ast.body.left, ast.body.right)
+        self.assertEqual(ast.evaluate(dict(x=1)), math.sqrt(2) * 2)
+
+    def test_signed_zero(self):
+        parser = Parser()
+        parser.register_function('cs', math.copysign, pure=True)
+        # 0.0与-0.0相等, 但不能合并为同一常量
+        formula = 'cs(a, -0.0) + cs(a, 0.0) + cs(a, (-0.0, 1)[0]) + cs(a, (0.0, 1)[0])'
+        context = dict(a=4)
+        self.assertEqual(parser.parse(formula).evaluate(context), 0.0)
+        optimized = parser.parse(formula, optimize=True)
+        self.assertEqual(optimized.evaluate(context), 0.0)
+        self.assertEqual(optimized.compile()(context), 0.0)
+        self.assertEqual(parser.compile_many({'x': formula})(context), {'x': 0.0})
@@ -147,3 +147,61 @@ class TestParser(unittest.TestCase):
         parser = Parser()
         ast = parser.parse('sum([1,2,3], start=bcd) + max((4 ,5 ,7)) * operator.add(abc, bcd) + sum([5, 6][::3])')
         self.assertEqual(f'{ast!r}', 'BinaryOpNode(+, BinaryOpNode(+, FunctionCallNode(IdentifierNode(sum), ArgsNode(ListNode[NumberNode(1), NumberNode(2), NumberNode(3)]), KwargsNode(start=IdentifierNode(bcd))), BinaryOpNode(*, FunctionCallNode(IdentifierNode(max), ArgsNode(TupleNode(NumberNode(4), NumberNode(5), NumberNode(7))), KwargsNode()), FunctionCallNode(AttributionNode(IdentifierNode(operator).add), ArgsNode(IdentifierNode(abc), IdentifierNode(bcd)), KwargsNode()))), FunctionCallNode(IdentifierNode(sum), ArgsNode(ItemNode(ListNode[NumberNode(5), NumberNode(6)], SliceNode(NoneNode:NoneNode:NumberNode(3)))), KwargsNode()))')
+
+    def test_cache(self):
+        parser = Parser(cache_size=2)
+        ast = parser.parse('a * b')
+        self.assertIs(parser.parse('a * b'), ast)
+        parser.parse('a + b')
+        parser.parse('a - b')
+        self.assertIsNot(parser.parse('a * b'), ast)
+        info = parser.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions, info.currsize), (1, 4, 2, 2))
+
+        # 注册运算符后, 相同文本可能得到不同的分词结果
+        self.assertEqual(parser.parse('2*-3').evaluate(), -6)
+        parser.register_binary_op('*-', lambda x, y: x * y - 1, 17000)
+        self.assertEqual(parser.parse('2*-3').evaluate(), 5)
+
+        ast = parser.parse('a + b')
+        parser.register_function('cube', lambda x: x ** 3)
+        self.assertIsNot(parser.parse('a + b'), ast)
+
+        parser = Parser(cache_size=0)
+        self.assertIsNot(parser.parse('a'), parser.parse('a'))
+        self.assertEqual(parser.cache_info().currsize, 0)
+
+    def test_deep_formula(self):
+        parser = Parser(cache_size=0)
+        depth = 5000
+
+        ast = parser.parse('(' * depth + 'a' + ')' * depth)
+        self.assertEqual(ast.evaluate(dict(a=7)), 7)
+
+        # 递归下降时单目运算符链每层都会递归
+        ast = parser.parse('- ' * depth + 'a')
+        self.assertEqual(ast.postfix()(dict(a=3)), 3)
+
+        ast = parser.parse(' + '.join(f'x{i} * 2' for i in range(depth)))
+        self.assertEqual(ast.postfix()({f'x{i}': i for i in range(depth)}), depth * (depth - 1))
+
+        ast = parser.parse('f(' * depth + 'a' + ', k=[b[1:], (c,)])' * depth)
+        self.assertEqual(ast.postfix()(dict(a=1, b=[1, 2], c=3, f=lambda x, k: x)), 1)
+
+    def test_syntax_error(self):
+        parser = Parser()
+        cases = [
+            ('', '表达式为空'),
+            ('a b', '意外的token：'),
+            ('(a, b', '缺少右圆括号，位置：0'),
+            ('f(a, 1=2)', '错误的赋值符号，位置: 6'),
+            ('f(k=1, a)', '顺序参数必须在关键字参数前，位置：8'),
+            ('a[1:2:3:4]', '切片参数个数大于3，位置：2'),
+            ('a[:::]', '冒号过多，位置：2'),
+            ('a[,]', '切片参数解析失败，位置：2'),
+            ('a )', '解析错误：意外的token'),
+        ]
+        for formula, message in cases:
+            with self.assertRaises(ValueError) as cm:
+                parser.parse(formula)
+            self.assertIn(message, str(cm.exception))
@@ -0,0 +1,48 @@
+import sys
+import unittest
+
+from formulaparser import Parser
+
+
+class TestPostfix(unittest.TestCase):
+
+    def test_evaluate(self):
+        parser = Parser()
+        parser.register_function('pair', lambda a, b=0: (a, b))
+        formulas = [
+            'sum([1, 2, abc], start=1) - max(a, 1) * c[b]',
+            '-x.real + (1, "s", c)[-2:3:1][1][0] * 2.5 + len([]) + len(())',
+            'pair(a, b=c)[1][::-1] + pair(x)',
+            'sqrt(2) * x + sqrt(2) * x + abs(sqrt(2) * x)',
+        ]
+        parser.register_function('len', len)
+        context = dict(abc=5, a=3, b=1, c=(1, 2), x=-2)
+        for formula in formulas:
+            for optimize in (False, True):
+                ast = parser.parse(formula, optimize=optimize)
+                program = ast.postfix()
+                self.assertEqual(repr(program(context)), repr(ast.evaluate(context)))
+                # 覆盖被折叠或共享的函数
+                shadowed = dict(context, sqrt=lambda v: v, max=min)
+                self.assertEqual(repr(program(shadowed)), repr(ast.evaluate(shadowed)))
+        self.assertEqual(parser.parse('1 + 2').postfix().evaluate(), 3)
+
+    def test_deep(self):
+        parser = Parser()
+        n = max(20000, sys.getrecursionlimit() * 4)
+        ast = parser.parse(' + '.join(f'x{i % 100}' for i in range(n)))
+        context = {f'x{i}': i for i in range(100)}
+        self.assertRaises(RecursionError, ast.evaluate, context)
+        self.assertEqual(ast.postfix()(context), sum(i % 100 for i in range(n)))
+
+    def test_exception(self):
+        parser = Parser()
+        cases = [('a + b', dict(a=1)), ('1 / a', dict(a=0)), ('a.b', dict(a=1)), ('f(1)', dict(f=lambda: 0)),
+                 ('(a, b)[2]', dict(a=1, b=2)), ('sqrt(-1) + 1 / 0', None)]
+        for formula, context in cases:
+            ast = parser.parse(formula)
+            with self.assertRaises(Exception) as expected:
+                ast.evaluate(context)
+            with self.assertRaises(type(expected.exception)) as actual:
+                ast.postfix()(context)
+            self.assertEqual(str(actual.exception), str(expected.exception))
@@ -0,0 +1,81 @@
+import os
+import time
+import tempfile
+import unittest
+
+from formulaparser import Parser, Profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = Parser()
+        self.parser.register_function('slow', lambda x: (time.sleep(0.02), x)[1])
+
+    def test_equivalence(self):
+        context = dict(a=3, b=[1, 2, 3], c=2.5)
+        formulas = [
+            'slow(a) * 2 + max(a, c).real - sum(b[1:], start=a)',
+            '(a, -a, [c, "s"][0:1], b[::-1])',
+            'max(a, 1) + max(a, 1) * sqrt(4)',
+        ]
+        for formula in formulas:
+            for ast in (self.parser.parse(formula), self.parser.parse(formula, optimize=True)):
+                self.assertEqual(ast.evaluate_profiled(Profiler(), context), ast.evaluate(context))
+        # 上下文覆盖被折叠的函数时对原节点求值
+        ast = self.parser.parse('max(a, 1) + max(a, 1) * sqrt(4)', optimize=True)
+        self.assertEqual(ast.evaluate_profiled(Profiler(), dict(a=3, sqrt=lambda x: x)), 15)
+
+        profiler = Profiler()
+        ast = self.parser.parse('a + b')
+        self.assertRaises(KeyError, ast.evaluate_profiled, profiler, dict(a=1))
+        # 出错前已求值的节点仍被记录
+        self.assertEqual(profiler.stats(ast.left).calls, 1)
+
+    def test_stats(self):
+        ast = self.parser.parse('slow(a) + a * 2')
+        profiler = Profiler()
+        for _ in range(3):
+            ast.evaluate_profiled(profiler, dict(a=1))
+
+        call, product = ast.left, ast.right
+        self.assertEqual(profiler.stats(ast).calls, 3)
+        # 同名变量为同一节点, 统计合并
+        self.assertEqual(profiler.stats(product.left).calls, 6)
+        self.assertGreaterEqual(profiler.stats(call).self_time, 0.06)
+        self.assertGreaterEqual(profiler.stats(ast).total, profiler.stats(call).total + profiler.stats(product).total)
+        self.assertLess(profiler.stats(ast).self_time, 0.01)
+        self.assertEqual(profiler.stats(self.parser.parse('b')).calls, 0)
+
+        symbols = profiler.symbols
+        self.assertEqual(set(symbols), {'slow', 'op(+)', 'op(*)'})
+        self.assertEqual(symbols['slow'].calls, 3)
+        self.assertGreaterEqual(symbols['slow'].total, 0.06)
+        self.assertEqual(profiler.report().splitlines()[1].split()[0], 'slow')
+
+        profiler.reset()
+        self.assertEqual((profiler.nodes, profiler.symbols, profiler.stacks), ({}, {}, {}))
+
+    def test_output(self):
+        ast = self.parser.parse('slow(a) + obj.real * [1, 2][0]')
+        profiler = Profiler()
+        ast.evaluate_profiled(profiler, dict(a=1, obj=2.5))
+
+        rendered = profiler.render(ast).splitlines()
+        self.assertEqual(len(rendered), len(ast.render().splitlines()))
+        self.assertTrue(rendered[0].startswith('BinaryOp(+)  calls=1 total='))
+        self.assertIn('.real', profiler.symbols)
+        self.assertIn('[]', profiler.symbols)
+
+        lines = profiler.collapsed().splitlines()
+        stacks = dict(line.rsplit(' ', 1) for line in lines)
+        self.assertIn('BinaryOp(+);Function(slow)', stacks)
+        self.assertIn('BinaryOp(+);BinaryOp(*);Attr(real);ID(obj)', stacks)
+        # 各栈自身耗时之和等于根节点的累计耗时
+        self.assertAlmostEqual(sum(map(int, stacks.values())) / 1e9, profiler.stats(ast).total, delta=1e-6)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'profile.folded')
+            profiler.dump_collapsed(path)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read().splitlines(), lines)
@@ -0,0 +1,129 @@
+import pickle
+import sys
+import threading
+import unittest
+from types import MappingProxyType
+
+from formulaparser import Parser
+from formulaparser.func_manager import FunctionManager
+from formulaparser.op_manager import OperatorManager
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_snapshot(self):
+        parser = Parser()
+        snapshot = parser.snapshot()
+        # 注册表不变时快照为同一对象
+        self.assertIs(parser.func_mgr.snapshot(), snapshot.functions)
+        self.assertIs(parser.op_mgr.snapshot(), snapshot.operators)
+        self.assertIsInstance(snapshot.functions.functions, MappingProxyType)
+
+        ast = parser.parse('g(a) + 1')
+        self.assertIs(ast.left.func.func_mgr, snapshot.functions)
+        parser.register_function('g', abs)
+        parser.register_binary_op('<>', lambda a, b: a != b, 11000)
+        self.assertIsNot(parser.func_mgr.snapshot(), snapshot.functions)
+        self.assertFalse(snapshot.functions.has_func('g'))
+        self.assertEqual(snapshot.operators.match_operator('<>'), '<')
+        self.assertEqual(parser.op_mgr.match_operator('<>'), '<>')
+
+        # 语法树固定使用解析时的快照, 重新解析后使用新的注册表
+        self.assertRaises(KeyError, ast.evaluate, dict(a=-1))
+        self.assertEqual(parser.parse('g(a) + 1').evaluate(dict(a=-1)), 2)
+        self.assertEqual(parser.parse('g(a) <> 1').evaluate(dict(a=-1)), False)
+        self.assertEqual(parser.parse('g(a) <> 1').evaluate(dict(a=-2)), True)
+
+    def test_shared_defaults(self):
+        first, second = Parser(), Parser()
+        # 新建的解析器共享预定义函数及运算符组成的快照
+        self.assertIs(first.func_mgr.snapshot(), second.func_mgr.snapshot())
+        self.assertIs(first.op_mgr.snapshot(), second.op_mgr.snapshot())
+
+        first.register_function('f', abs)
+        first.register_unary_op('!', lambda x: not x)
+        self.assertIsNot(first.func_mgr.snapshot(), second.func_mgr.snapshot())
+        self.assertEqual(first.parse('!f(-2) + max(1, 2)').evaluate(), 2)
+        self.assertFalse(second.func_mgr.has_func('f'))
+        self.assertNotIn('!', second.op_mgr.unary_ops)
+        self.assertIs(Parser().func_mgr.snapshot(), second.func_mgr.snapshot())
+
+        # 子类的预定义函数单独构建, 同一子类的实例之间共享
+        class Functions(FunctionManager):
+            PREDEFINE_FUNCTIONS = {**FunctionManager.PREDEFINE_FUNCTIONS, 'double': lambda x: x * 2}
+        self.assertTrue(Functions().has_func('double'))
+        self.assertTrue(Functions().is_pure('double'))
+        self.assertFalse(FunctionManager().has_func('double'))
+        self.assertIs(Functions().snapshot(), Functions().snapshot())
+
+        # 以给定的快照创建注册表
+        functions = FunctionManager(first.func_mgr.snapshot())
+        functions.register_func('g', abs)
+        self.assertTrue(functions.has_func('f'))
+        self.assertFalse(first.func_mgr.has_func('g'))
+
+    def test_pickle(self):
+        for snapshot in (FunctionManager().snapshot(), OperatorManager().snapshot()):
+            loaded = pickle.loads(pickle.dumps(snapshot))
+            self.assertEqual(loaded, snapshot)
+            self.assertTrue(all(not isinstance(v, dict) for v in loaded))
+        parser = Parser()
+        ast = pickle.loads(pickle.dumps(parser.parse('max(a, 2) * -b')))
+        self.assertEqual(ast.evaluate(dict(a=1, b=3)), -6)
+
+    def test_concurrency(self):
+        parser = Parser()
+        base = parser.parse('a + b * 2')
+        count, readers = 40, 4
+        errors = []
+        done = threading.Event()
+
+        def register():
+            try:
+                for k in range(1, count + 1):
+                    parser.register_function(f'f{k}', lambda x, k=k: x + k, pure=True)
+                    parser.register_binary_op('$' * k, lambda a, b, k=k: a * k + b, 20000)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        def read():
+            try:
+                while True:
+                    finished = done.is_set()
+                    snapshot = parser.snapshot()
+                    operators, functions = snapshot
+                    # 快照总是某次注册前后的完整状态
+                    self.assertEqual(operators.binary_ops, set(operators.binary_funcs))
+                    self.assertEqual(operators.binary_ops, set(operators.binary_precedences))
+                    self.assertTrue(all(operators.match_operator(op) == op for op in operators.binary_ops))
+                    self.assertTrue(functions.pure_functions <= set(functions.functions))
+                    k = sum(1 for op in operators.binary_ops if op.startswith('$'))
+                    if k and functions.has_func(f'f{k}'):
+                        ast = parser.parse(f'f{k}(a) {"$" * k} b')
+                        self.assertEqual(ast.evaluate(dict(a=1, b=2)), (1 + k) * k + 2)
+                    self.assertEqual(base.evaluate(dict(a=1, b=2)), 5)
+                    if finished:
+                        return
+            except Exception as e:
+                errors.append(e)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=read) for _ in range(readers)]
+            threads.append(threading.Thread(target=register))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(parser.func_mgr.version, len(FunctionManager().functions) + count)
+        self.assertEqual(parser.parse('f40(1) $$ 2').evaluate(), 2 * 41 + 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
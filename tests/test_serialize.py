@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from formulaparser import Parser
+from formulaparser.ast_nodes import ConstantNode
+
+
+class TestSerialize(unittest.TestCase):
+
+    def make_parser(self):
+        parser = Parser()
+        parser.register_function('twice', lambda x: x * 2, pure=True)
+        parser.register_binary_op('$%', lambda x, y: (x + y) * 2, 16500)
+        return parser
+
+    def test_dumps(self):
+        parser = self.make_parser()
+        formulas = [
+            'sum([1, 2.5, abc], start=-1) - max(a, 1) * c[b] + twice(a) $% 3',
+            '-x.real + (1, "字符\\n", c)[-2:3:1][1][0] * 2e-3',
+            'twice(2) * x + twice(2) * x + pow(10, 30) // 7',
+            '(1, 1.0, 1 == 1, 0.0, -0.0, -123456789012345678901234567890)',
+        ]
+        context = dict(abc=5, a=3, b=1, c=(1, 2), x=-2)
+        loader = self.make_parser()
+        for formula in formulas:
+            for optimize in (False, True):
+                ast = parser.parse(formula, optimize=optimize)
+                data = ast.dumps()
+                self.assertIsInstance(data, bytes)
+                loaded = loader.loads(data)
+                self.assertEqual(repr(loaded), repr(ast))
+                self.assertEqual(repr(loaded.evaluate(context)), repr(ast.evaluate(context)))
+                # 运算符和函数绑定到加载方解析器注册表的快照
+                self.assertIs(getattr(loaded, 'op_mgr', loader.op_mgr.snapshot()), loader.op_mgr.snapshot())
+
+        value = (1j, frozenset({1, 'a'}), range(3), slice(None, -1), b'\x00', None)
+        self.assertEqual(loader.loads(ConstantNode(value).dumps()), ConstantNode(value))
+
+    def test_exception(self):
+        parser = self.make_parser()
+        data = parser.parse('a $% twice(b)').dumps()
+        # 缺少自定义运算符时加载失败, 函数在求值时才查找
+        self.assertRaises(ValueError, Parser().loads, data)
+        loaded = Parser().loads(parser.parse('twice(b)').dumps())
+        self.assertRaises(KeyError, loaded.evaluate, dict(b=1))
+        self.assertRaises(ValueError, parser.loads, b'xxxx')
+        self.assertRaises(ValueError, parser.loads, data[:-3])
+        self.assertRaises(ValueError, ConstantNode(object()).dumps)
+
+    def test_catalog(self):
+        parser = self.make_parser()
+        formulas = {f'公式{i}': f'a * {i} + twice(b) $% {i}' for i in range(200)}
+        formulas['const'] = parser.parse('twice(3) + 1', optimize=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'formulas.fpc')
+            parser.dump_catalog(path, formulas)
+            with self.make_parser().open_catalog(path) as catalog:
+                self.assertEqual(len(catalog), 201)
+                self.assertIn('公式17', catalog)
+                self.assertNotIn('公式200', catalog)
+                self.assertEqual(catalog['公式17'].evaluate(dict(a=1, b=2)), 17 + (4 + 17) * 2)
+                self.assertEqual(catalog.load_compact('const').evaluate(), 7)
+                self.assertEqual(sorted(catalog), sorted(formulas))
+                self.assertIsNone(catalog.get('missing'))
+                self.assertRaises(KeyError, catalog.__getitem__, 'missing')
+
+            open(path, 'wb').close()
+            self.assertRaises(ValueError, parser.open_catalog, path)
@@ -0,0 +1,113 @@
+import math
+import unittest
+
+from formulaparser import Parser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, 'numpy未安装')
+class TestVectorize(unittest.TestCase):
+
+    def assert_rows_equal(self, ast, columns):
+        result = ast.evaluate_vectorized(columns)
+        self.assertEqual(len(result), len(next(v for v in columns.values() if isinstance(v, np.ndarray))))
+        lists = {k: v.tolist() for k, v in columns.items() if isinstance(v, np.ndarray)}
+        for i, value in enumerate(result.tolist()):
+            context = dict(columns, **{k: v[i] for k, v in lists.items()})
+            expected = ast.evaluate(context)
+            if isinstance(expected, float) and math.isnan(expected):
+                self.assertTrue(math.isnan(value))
+            else:
+                self.assertEqual(value, expected, f'{ast} @ row {i}')
+            self.assertIs(type(value), type(expected), f'{ast} @ row {i}')
+        return result
+
+    def test_builtin(self):
+        parser = Parser()
+        rng = np.random.default_rng(0)
+        columns = dict(
+            a=rng.uniform(0.5, 10, 50), b=rng.integers(1, 20, 50), c=rng.integers(-5, 5, 50), k=3,
+        )
+        cases = [
+            'a * 2 + b - c / 4',
+            'sqrt(a) + sin(b) * cos(c) - tan(a) + exp(c) + log(a) + log(b, 2)',
+            'abs(c) + max(a, b, c) - min((a, c))',
+            'sum([b, c, k], start=1) + b // k + b % k - pow(c, 2)',
+            '(a < b) + (b >= c) * 2 - ~(c == k) + (b << 2) + (b >> 1) + (b & c) + (b | 1) + (b ^ c)',
+            '-a + +b',
+            'max(c, 0)',
+        ]
+        for formula in cases:
+            self.assert_rows_equal(parser.parse(formula), columns)
+
+    def test_dtypes(self):
+        parser = Parser()
+        # 较短的整数及bool数组的计算结果与Python一致, 而不是float16等低精度类型
+        columns = dict(u=np.array([3, 200, 0], dtype=np.uint8), i=np.array([-3, 5, 0], dtype=np.int8),
+                       b=np.array([True, False, True]), n=np.array([3, 1, 2]), f=np.array([1.5, 2.5, 2.0]),
+                       big=np.array([2 ** 60 + 1, 3, -2 ** 60 - 1]))
+        cases = [
+            'sqrt(u) + sqrt(b)', 'log(u + 1) + log(b + 1, 2)', 'sin(b) + cos(u) + tan(i)', 'exp(i) + exp(b)',
+            # max/min返回被选中的参数本身, 不将整数转为浮点数
+            'max(n, 2.5)', 'min(n, 2.5)', 'max(big, 1)', 'min(big, f)', 'max(u, i)', 'max(b, 0)', 'max([f, 2.0])',
+            'if_(n > 2, n, f)',
+        ]
+        for formula in cases:
+            self.assert_rows_equal(parser.parse(formula), columns)
+        self.assertEqual(parser.parse('sqrt(u)').evaluate_vectorized(columns).dtype, np.float64)
+        self.assertEqual(parser.parse('max(n, 2.5)').evaluate_vectorized(columns).tolist(), [3, 2.5, 2.5])
+
+    def test_fallback(self):
+        parser = Parser()
+        calls = []
+
+        def clip(x, lo=0):
+            calls.append(x)
+            return x if x > lo else lo
+        parser.register_function('clip', clip)
+        parser.register_function('double', lambda x: x * 2, vectorized=True)
+
+        columns = dict(a=np.array([-1.5, 0.5, 3.0]), b=np.array([1, 0, 2]), s=np.array(['x', 'y', 'z']))
+        ast = parser.parse('clip(a, lo=b - 1) + double(a)')
+        ast.evaluate_vectorized(columns)
+        self.assertEqual(len(calls), 3)
+        self.assert_rows_equal(ast, columns)
+        # 下标、切片和属性访问逐行求值
+        self.assert_rows_equal(parser.parse('[a, b, 5][b] + (a, b)[1:][0] + a.real'), columns)
+        self.assert_rows_equal(parser.parse('s + "!"'), columns)
+        self.assert_rows_equal(parser.parse('(a, b)'), columns)
+        # 常量公式广播到每一行
+        self.assertEqual(parser.parse('1 + 2').evaluate_vectorized(columns).tolist(), [3, 3, 3])
+        # 不含数组时与evaluate一致
+        self.assertEqual(parser.parse('a + 1').evaluate_vectorized(dict(a=2)), 3)
+
+    def test_exception(self):
+        parser = Parser()
+        columns = dict(a=np.array([1.0, 0.0]), b=np.array([-1.0, 4.0]))
+        self.assertRaises(ZeroDivisionError, parser.parse('1 / a').evaluate_vectorized, columns)
+        self.assertRaises(ValueError, parser.parse('sqrt(b)').evaluate_vectorized, columns)
+        self.assertRaises(TypeError, parser.parse('max(a)').evaluate_vectorized, columns)
+        self.assertRaises(KeyError, parser.parse('a + c').evaluate_vectorized, columns)
+        self.assertRaises(ValueError, parser.parse('a').evaluate_vectorized, dict(a=np.ones(2), b=np.ones(3)))
+        # Python浮点数溢出得到inf而非异常
+        self.assert_rows_equal(parser.parse('a * 1e308 * 10'), columns)
+
+    def test_integer_overflow(self):
+        parser = Parser()
+        # NumPy整数运算溢出时静默回绕, 结果应与Python整数一致
+        columns = dict(a=np.array([2 ** 62, 3], dtype=np.int64), n=np.array([1, 2]))
+        for formula in ['a * 4', 'a + a', 'pow(a, 3)', 'a << 3', 'sum([a, a, a])', '-a - a - a', 'a * n + 1']:
+            result = self.assert_rows_equal(parser.parse(formula), columns)
+        self.assertEqual(result.dtype, np.int64)
+        self.assertEqual(parser.parse('a * 4').evaluate_vectorized(columns).tolist(), [2 ** 64, 12])
+
+        columns = dict(b=np.array([1, 200], dtype=np.uint8), c=np.array([-128, 5], dtype=np.int8),
+                       u=np.array([2 ** 64 - 1, 1], dtype=np.uint64))
+        for formula in ['-b', 'b - 5', '~b', 'b * b', '-c', 'abs(c)', 'c - b', 'u + 1', 'b << 70']:
+            self.assert_rows_equal(parser.parse(formula), columns)
+        self.assertEqual(parser.parse('-b').evaluate_vectorized(columns).tolist(), [-1, -200])
+        self.assertRaises(ValueError, parser.parse('b << (c < 0) * -1').evaluate_vectorized, columns)